@@ -0,0 +1,183 @@
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from metadata_index import CATEGORY_COLUMNS, DATE_COLUMN, MISSING_DAY, MetadataIndex
+
+# Saved next to the vector store and updated by build_vector_store
+AGGREGATES_FILE = 'aggregates.csv'
+AGGREGATES_FINGERPRINT_FILE = 'aggregates.fingerprint'
+
+# Key of the aggregate cube: one count per distinct (client, region, theme, day)
+KEY_COLUMNS = CATEGORY_COLUMNS + [DATE_COLUMN]
+
+# Columns the counts can be grouped by; month and year are derived from complaint_date
+GROUP_BY_COLUMNS = CATEGORY_COLUMNS + [DATE_COLUMN, 'month', 'year']
+
+# Value of the group_by columns in the row that sums the groups left out by top
+OTHER_GROUP = 'other'
+
+
+def days_to_dates(days):
+    dates = pd.to_datetime(np.where(days == MISSING_DAY, 0, days), unit='D').strftime('%Y-%m-%d')
+    return np.where(days == MISSING_DAY, '', dates)
+
+
+class ComplaintAggregates:
+    """
+    Complaint counts per (client_name, client_region, theme, complaint_date), maintained
+    incrementally as complaints are added or removed. Count and trend questions are
+    answered from this cube rather than from retrieved rows, so they cover every
+    complaint and cost milliseconds. Metadata filters use the same syntax as getContext.
+    """
+
+    def __init__(self, counts=None, fingerprint=None):
+        """
+        Parameters:
+        counts (dict): (client_name, client_region, theme, complaint_date) -> count.
+        fingerprint (str): complaint_store.store_fingerprint of the store the counts cover.
+        """
+        self.counts = Counter(counts or {})
+        self.fingerprint = fingerprint
+        self._cube = None
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def _key(self, record):
+        return tuple('' if record.get(column) is None else str(record.get(column)) for column in KEY_COLUMNS)
+
+    def add(self, records):
+        """
+        Adds complaints (metadata dicts) to the counts.
+        """
+        for record in records:
+            self.counts[self._key(record)] += 1
+        self._cube = None
+
+    def remove(self, records):
+        """
+        Removes complaints (metadata dicts) from the counts.
+        """
+        for record in records:
+            key = self._key(record)
+            self.counts[key] -= 1
+            if self.counts[key] <= 0:
+                del self.counts[key]
+        self._cube = None
+
+    @classmethod
+    def from_metadata_index(cls, metadata_index):
+        """
+        Builds the counts from a MetadataIndex in one vectorised pass.
+        """
+        keys = np.stack([metadata_index.codes[column] for column in CATEGORY_COLUMNS] + [metadata_index.days], axis=1)
+        if not len(keys):
+            return cls(fingerprint=metadata_index.fingerprint)
+        unique_keys, counts = np.unique(keys, axis=0, return_counts=True)
+        columns = [metadata_index.categories[column][unique_keys[:, i]] for i, column in enumerate(CATEGORY_COLUMNS)]
+        columns.append(days_to_dates(unique_keys[:, -1]))
+        return cls(dict(zip(zip(*columns), counts.tolist())), metadata_index.fingerprint)
+
+    def to_frame(self):
+        df = pd.DataFrame(list(self.counts.keys()), columns=KEY_COLUMNS)
+        df['complaint_count'] = list(self.counts.values())
+        return df
+
+    def save(self, store_path):
+        # Imported here because complaint_store builds on this module
+        from complaint_store import replace_file
+
+        replace_file(os.path.join(store_path, AGGREGATES_FILE),
+                     lambda temp_path: self.to_frame().to_csv(temp_path, index=False))
+        # Written after the counts, so a stale fingerprint can only make them be rebuilt
+        def write_fingerprint(temp_path):
+            with open(temp_path, 'w') as f:
+                f.write(self.fingerprint or '')
+        replace_file(os.path.join(store_path, AGGREGATES_FINGERPRINT_FILE), write_fingerprint)
+
+    @classmethod
+    def load(cls, store_path):
+        df = pd.read_csv(os.path.join(store_path, AGGREGATES_FILE), dtype=str, keep_default_na=False)
+        keys = zip(*(df[column] for column in KEY_COLUMNS))
+        fingerprint_path = os.path.join(store_path, AGGREGATES_FINGERPRINT_FILE)
+        fingerprint = None
+        if os.path.exists(fingerprint_path):
+            with open(fingerprint_path) as f:
+                fingerprint = f.read().strip() or None
+        return cls(dict(zip(keys, df['complaint_count'].astype(int).tolist())), fingerprint)
+
+    @classmethod
+    def load_or_build(cls, metadata_index, store_path):
+        """
+        Loads the saved counts, rebuilding them from the metadata index if they are
+        missing or were counted for other complaints (their fingerprint differs from
+        the metadata index's).
+        """
+        if os.path.exists(os.path.join(store_path, AGGREGATES_FILE)):
+            aggregates = cls.load(store_path)
+            if metadata_index.fingerprint is not None and aggregates.fingerprint == metadata_index.fingerprint:
+                return aggregates
+        aggregates = cls.from_metadata_index(metadata_index)
+        try:
+            aggregates.save(store_path)
+        except OSError:
+            pass
+        return aggregates
+
+    def _materialise(self):
+        # The cube is indexed like the complaints themselves so the same filters apply
+        if self._cube is None:
+            records = [dict(zip(KEY_COLUMNS, key)) for key in self.counts]
+            weights = np.fromiter(self.counts.values(), dtype=np.int64, count=len(self.counts))
+            self._cube = (MetadataIndex.from_records(records), weights)
+        return self._cube
+
+    def query(self, group_by=None, metadata_filter=None, top=None):
+        """
+        Counts complaints grouped by one or more columns.
+
+        Parameters:
+        group_by (list): Columns from GROUP_BY_COLUMNS, e.g. ['client_region'] or ['month'].
+            None or [] returns the total count.
+        metadata_filter (dict): Optional filter, see MetadataIndex.resolve.
+        top (int): Only return the largest groups, followed by an OTHER_GROUP row counting
+            the rest, so complaint_count still sums to the total.
+
+        Returns:
+        pd.DataFrame: The group_by columns and complaint_count, largest first
+            (chronological when grouping only by time).
+        """
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by or [])
+        unknown = [column for column in group_by if column not in GROUP_BY_COLUMNS]
+        if unknown:
+            raise ValueError(f"Cannot group by {unknown}; choose from {GROUP_BY_COLUMNS}")
+
+        cube, weights = self._materialise()
+        positions = cube.resolve(metadata_filter) if metadata_filter else None
+        if positions is None:
+            positions = np.arange(len(weights))
+
+        df = pd.DataFrame({'complaint_count': weights[positions]})
+        if not group_by:
+            return df.sum().to_frame().T
+
+        for column in group_by:
+            if column in CATEGORY_COLUMNS:
+                df[column] = cube.categories[column][cube.codes[column][positions]]
+            else:
+                dates = days_to_dates(cube.days[positions])
+                df[column] = {'month': [d[:7] for d in dates], 'year': [d[:4] for d in dates]}.get(column, dates)
+
+        result = df.groupby(group_by, sort=False)['complaint_count'].sum().reset_index()
+        if set(group_by) <= {DATE_COLUMN, 'month', 'year'}:
+            result = result.sort_values(group_by, ignore_index=True)
+        else:
+            result = result.sort_values('complaint_count', ascending=False, kind='stable', ignore_index=True)
+        if top and len(result) > top:
+            other = {column: OTHER_GROUP for column in group_by}
+            other['complaint_count'] = result['complaint_count'].iloc[top:].sum()
+            result = pd.concat([result.head(top), pd.DataFrame([other])], ignore_index=True)
+        return result
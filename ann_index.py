@@ -0,0 +1,295 @@
+import json
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+from complaint_store import INDEX_FILE, ColumnarDocstore, read_index, replace_file, write_index
+from tracing import tracer
+
+# Approximate index and its settings, saved next to the exact index.faiss in the vector store folder
+ANN_INDEX_FILE = 'index_ann.faiss'
+ANN_CONFIG_FILE = 'ann_config.json'
+
+# flat   - exact search only (no approximate index)
+# ivf    - inverted file: search the nprobe closest of nlist clusters
+# ivfpq  - inverted file with product-quantised vectors (pq_m bytes per vector)
+# hnsw   - HNSW graph with M links per node over the full vectors
+# hnswpq - HNSW graph over product-quantised vectors
+# Plain PQ (IndexPQ) is not offered: it cannot take the id selector the metadata filters use.
+INDEX_TYPES = ['flat', 'ivf', 'ivfpq', 'hnsw', 'hnswpq']
+IVF_TYPES = ['ivf', 'ivfpq']
+HNSW_TYPES = ['hnsw', 'hnswpq']
+PQ_TYPES = ['ivfpq', 'hnswpq']
+
+DEFAULT_NPROBE = 16
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 80
+DEFAULT_EF_SEARCH = 64
+DEFAULT_PQ_M = 64
+
+# Vectors reconstructed from the exact index at a time while filling the approximate one
+ADD_BATCH_SIZE = 50000
+
+# 8-bit PQ codebooks have 256 centroids per sub-vector
+PQ_MIN_TRAIN = 256
+
+
+def default_nlist(ntotal):
+    # Usual 4 * sqrt(n) rule, keeping at least 39 training points per cluster
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+
+def factory_string(index_type, nlist=None, hnsw_m=DEFAULT_HNSW_M, pq_m=DEFAULT_PQ_M):
+    """
+    Returns:
+    str: The faiss.index_factory description of the index type.
+    """
+    if index_type == 'ivf':
+        return f'IVF{nlist},Flat'
+    if index_type == 'ivfpq':
+        return f'IVF{nlist},PQ{pq_m}'
+    if index_type == 'hnsw':
+        return f'HNSW{hnsw_m}'
+    if index_type == 'hnswpq':
+        return f'HNSW{hnsw_m}_PQ{pq_m}'
+    raise ValueError(f"index_type must be one of {INDEX_TYPES[1:]}, got {index_type!r}")
+
+
+def sample_positions(ntotal, size, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(ntotal, size=min(size, ntotal), replace=False))
+
+
+def reconstruct(flat_index, positions):
+    return flat_index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+
+
+def train_ann_index(flat_index, index_type, nlist=None, hnsw_m=DEFAULT_HNSW_M, ef_construction=DEFAULT_EF_CONSTRUCTION,
+                    pq_m=DEFAULT_PQ_M, train_size=None, seed=0):
+    """
+    Builds an approximate index holding the same vectors, at the same positions, as the
+    exact flat index. IVF centroids and PQ codebooks are trained on a random sample of
+    the vectors rather than on all of them.
+
+    Parameters:
+    flat_index (faiss.IndexFlat): The exact index.
+    index_type (str): One of INDEX_TYPES other than 'flat'.
+    nlist (int): Number of IVF clusters. Defaults to default_nlist(ntotal).
+    hnsw_m (int): HNSW links per node.
+    ef_construction (int): HNSW candidate list size while building.
+    pq_m (int): PQ code size in bytes (sub-quantisers); must divide the dimension.
+    train_size (int): Number of vectors to train on. Defaults to max(40 * nlist, 10000).
+    seed (int): Random seed for the training sample.
+
+    Returns:
+    tuple: (index, settings dict).
+    """
+    ntotal, dimension = flat_index.ntotal, flat_index.d
+    if index_type in IVF_TYPES:
+        nlist = nlist or default_nlist(ntotal)
+        if nlist > ntotal:
+            raise ValueError(f"nlist ({nlist}) cannot be larger than the number of vectors ({ntotal})")
+    if index_type in PQ_TYPES:
+        if dimension % pq_m:
+            raise ValueError(f"pq_m ({pq_m}) must divide the embedding dimension ({dimension})")
+        if ntotal < PQ_MIN_TRAIN:
+            raise ValueError(f"PQ needs at least {PQ_MIN_TRAIN} vectors to train, the store has {ntotal}")
+
+    description = factory_string(index_type, nlist, hnsw_m, pq_m)
+    index = faiss.index_factory(dimension, description, faiss.METRIC_L2)
+    if index_type in HNSW_TYPES:
+        index.hnsw.efConstruction = ef_construction
+
+    train_size = min(ntotal, train_size or max(40 * (nlist or 0), 10000))
+    if not index.is_trained:
+        index.train(reconstruct(flat_index, sample_positions(ntotal, train_size, seed)))
+    for start in range(0, ntotal, ADD_BATCH_SIZE):
+        index.add(flat_index.reconstruct_n(start, min(ADD_BATCH_SIZE, ntotal - start)))
+
+    settings = {
+        'index_type': index_type,
+        'factory': description,
+        'nlist': nlist,
+        'hnsw_m': hnsw_m if index_type in HNSW_TYPES else None,
+        'ef_construction': ef_construction if index_type in HNSW_TYPES else None,
+        'pq_m': pq_m if index_type in PQ_TYPES else None,
+        'train_size': train_size if index_type != 'hnsw' else 0,
+    }
+    return index, settings
+
+
+def search_parameters(config, selector=None):
+    """
+    Search parameters for the approximate index described by config (nprobe for IVF,
+    efSearch for HNSW), with an optional id selector. IVF indexes reject the generic
+    SearchParameters class, so the matching subclass is always used.
+    """
+    index_type = config['index_type'] if config else 'flat'
+    if index_type in IVF_TYPES:
+        params = faiss.SearchParametersIVF()
+        params.nprobe = config['nprobe']
+    elif index_type in HNSW_TYPES:
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = config['ef_search']
+    elif selector is None:
+        return None
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def recall_at_k(flat_index, ann_index, config, k=10, num_queries=200, seed=1):
+    """
+    Measures recall@k of the approximate index against the exact one. The queries are
+    midpoints of random pairs of stored vectors, so they look like real data without
+    being stored vectors themselves.
+
+    Returns:
+    dict: recall (fraction of the exact top k found), and the mean exact and approximate
+        query latency in milliseconds.
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, flat_index.ntotal)
+    pairs = rng.integers(0, flat_index.ntotal, size=(num_queries, 2))
+    queries = (reconstruct(flat_index, pairs[:, 0]) + reconstruct(flat_index, pairs[:, 1])) / 2
+
+    start = time.perf_counter()
+    exact_distances_all, _ = flat_index.search(queries, k)
+    flat_ms = (time.perf_counter() - start) * 1000 / num_queries
+
+    params = search_parameters(config)
+    start = time.perf_counter()
+    _, approximate = ann_index.search(queries, k, params=params)
+    ann_ms = (time.perf_counter() - start) * 1000 / num_queries
+
+    # A result counts if it is as close as the k-th exact neighbour, so ties between
+    # duplicate complaints are not counted as misses. Distances are recomputed from the
+    # exact vectors because PQ distances are approximate.
+    found = 0
+    for query, exact_distances, positions in zip(queries, exact_distances_all, approximate):
+        positions = positions[positions >= 0]
+        distances = ((reconstruct(flat_index, positions) - query) ** 2).sum(axis=1)
+        found += int((distances <= exact_distances[-1] * (1 + 1e-5) + 1e-6).sum())
+    return {'recall': found / (k * num_queries), 'recall_k': k, 'recall_queries': num_queries,
+            'flat_ms': flat_ms, 'ann_ms': ann_ms}
+
+
+def load_ann_config(store_path):
+    config_path = os.path.join(store_path, ANN_CONFIG_FILE)
+    if not os.path.exists(config_path):
+        return None
+    with open(config_path) as f:
+        return json.load(f)
+
+
+def load_ann_index(store_path, fingerprint, mmap=True):
+    """
+    Loads the approximate index of a vector store folder, if it has one built for the
+    same complaints. An out of date one, or one whose settings cannot be read, is
+    ignored (searches stay exact), which the ann_index_load span records as stale=True.
+
+    Parameters:
+    store_path (str): The vector store folder.
+    fingerprint (str): complaint_store.store_fingerprint of the store.
+    mmap (bool): Memory-map the index.
+
+    Returns:
+    tuple: (index, config), or (None, None).
+    """
+    ann_path = os.path.join(store_path, ANN_INDEX_FILE)
+    if not os.path.exists(ann_path) or not os.path.exists(os.path.join(store_path, ANN_CONFIG_FILE)):
+        return None, None
+    with tracer.span('ann_index_load', path=ann_path) as span:
+        try:
+            config = load_ann_config(store_path)
+        except ValueError:
+            # Not valid JSON, e.g. written by a build that was interrupted
+            config = None
+        stale = not isinstance(config, dict) or config.get('fingerprint') != fingerprint
+        span.set(stale=stale)
+        if stale:
+            return None, None
+        return read_index(ann_path, mmap=mmap), config
+
+
+def remove_ann_index(store_path):
+    for name in (ANN_INDEX_FILE, ANN_CONFIG_FILE):
+        path = os.path.join(store_path, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def build_ann_index(store_path, index_type, nlist=None, nprobe=DEFAULT_NPROBE, hnsw_m=DEFAULT_HNSW_M,
+                    ef_construction=DEFAULT_EF_CONSTRUCTION, ef_search=DEFAULT_EF_SEARCH, pq_m=DEFAULT_PQ_M,
+                    train_size=None, recall_k=10, recall_queries=200):
+    """
+    Builds the approximate index for a vector store folder from its exact index.faiss,
+    checks its recall@k against the exact index and saves both the index and its
+    settings (including the recall report). The RAG modules then search it instead of
+    the exact index. index_type 'flat' removes any approximate index.
+
+    Parameters:
+    store_path (str): The vector store folder.
+    index_type (str): One of INDEX_TYPES.
+    nlist, hnsw_m, ef_construction, pq_m, train_size: See train_ann_index.
+    nprobe (int): IVF clusters searched per query.
+    ef_search (int): HNSW candidate list size while searching.
+    recall_k (int): k of the recall check.
+    recall_queries (int): Number of queries in the recall check.
+
+    Returns:
+    dict: The saved settings and recall report, or None for 'flat'.
+    """
+    if index_type == 'flat':
+        remove_ann_index(store_path)
+        return None
+
+    flat_index = read_index(os.path.join(store_path, INDEX_FILE), mmap=False)
+    start = time.perf_counter()
+    ann_index, config = train_ann_index(flat_index, index_type, nlist, hnsw_m, ef_construction, pq_m, train_size)
+    config['build_s'] = time.perf_counter() - start
+    config['nprobe'] = min(nprobe, config['nlist']) if index_type in IVF_TYPES else None
+    config['ef_search'] = ef_search if index_type in HNSW_TYPES else None
+    config['ntotal'] = ann_index.ntotal
+    config['fingerprint'] = ColumnarDocstore.load(store_path).fingerprint()
+    config.update(recall_at_k(flat_index, ann_index, config, recall_k, recall_queries))
+
+    ann_path = os.path.join(store_path, ANN_INDEX_FILE)
+    write_index(ann_index, ann_path)
+    config['ann_size_mb'] = os.path.getsize(ann_path) / (1024 * 1024)
+    config['flat_size_mb'] = os.path.getsize(os.path.join(store_path, INDEX_FILE)) / (1024 * 1024)
+    def write_config(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump(config, f, indent=2)
+    replace_file(os.path.join(store_path, ANN_CONFIG_FILE), write_config)
+
+    print(f"{config['factory']}: recall@{config['recall_k']} {config['recall']:.3f}, "
+          f"{config['ann_ms']:.2f} ms/query vs {config['flat_ms']:.2f} ms exact, "
+          f"{config['ann_size_mb']:.1f} MB vs {config['flat_size_mb']:.1f} MB")
+    return config
+
+
+def rebuild_ann_index(store_path):
+    """
+    Rebuilds the approximate index with its saved settings, e.g. after the exact index
+    was updated. Does nothing if the store has no approximate index.
+    """
+    try:
+        config = load_ann_config(store_path)
+    except ValueError:
+        print(f"Cannot read the settings in {os.path.join(store_path, ANN_CONFIG_FILE)}; "
+              f"rebuild the approximate index with --ann-only --index-type")
+        return None
+    if config is None:
+        return None
+    return build_ann_index(
+        store_path, config['index_type'], nlist=config['nlist'], nprobe=config['nprobe'] or DEFAULT_NPROBE,
+        hnsw_m=config['hnsw_m'] or DEFAULT_HNSW_M, ef_construction=config['ef_construction'] or DEFAULT_EF_CONSTRUCTION,
+        ef_search=config['ef_search'] or DEFAULT_EF_SEARCH, pq_m=config['pq_m'] or DEFAULT_PQ_M,
+        train_size=config['train_size'] or None, recall_k=config['recall_k'], recall_queries=config['recall_queries'],
+    )
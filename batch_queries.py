@@ -0,0 +1,273 @@
+"""
+Batch query runner for scheduled reports.
+
+Runs a list of questions through the RAG pipeline in stages rather than one by one:
+filters are extracted for all queries up front (rules first, the filter LLM only for the
+rest, concurrently), queries are then retrieved in batches (one concurrent embedding pass
+and one index.search per distinct filter, see retrieval.search_many), and answers are
+generated concurrently under a shared rate limit. Every answer is appended to a JSON-lines
+file as soon as it is ready, and a rerun with the same output file skips the queries it
+already answered.
+
+Usage:
+    python batch_queries.py monthly_questions.txt --output monthly_answers.jsonl --requests-per-second 2
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import rag_functions
+from complaint_store import get_complaint_store
+from filter_parser import DEFAULT_K
+from map_reduce import DEFAULT_MAX_CONCURRENCY, RateLimiter
+from retrieval import build_results, search_many
+from tracing import tracer
+
+# Queries retrieved together in one search_many call
+DEFAULT_BATCH_SIZE = 256
+
+# Concurrent filter extraction calls for the queries the rules cannot parse
+DEFAULT_FILTER_WORKERS = 8
+
+
+def read_queries(path):
+    """
+    Reads queries from a file: .txt (one query per line, blank lines and lines starting
+    with # skipped), .jsonl (objects with "query" and optionally "id") or .csv (a "query"
+    column and optionally an "id" column).
+
+    Returns:
+    list: One {'id': str, 'query': str} dict per query.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, encoding='utf-8', newline='') as f:
+        if extension == '.jsonl':
+            rows = [json.loads(line) for line in f if line.strip()]
+        elif extension == '.csv':
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [{'query': line.strip()} for line in f if line.strip() and not line.lstrip().startswith('#')]
+    return normalise_queries(rows)
+
+
+def normalise_queries(queries):
+    """
+    Turns a list of query strings or {'query', 'id'} dicts into {'id', 'query'} dicts.
+    Queries without an id are numbered by their position, so a rerun on the same list
+    finds the same ids.
+    """
+    normalised = []
+    for number, query in enumerate(queries):
+        if isinstance(query, str):
+            query = {'query': query}
+        normalised.append({'id': str(query.get('id') or number), 'query': query['query']})
+    ids = [query['id'] for query in normalised]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Query ids must be unique")
+    return normalised
+
+
+def completed_ids(output_path):
+    """
+    Returns:
+    set: Ids of the queries already answered in an output file (failed ones are retried).
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a run that was killed mid-write
+                continue
+            if 'answer' in record:
+                done.add(record['id'])
+    return done
+
+
+def ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def extract_all_filters(queries, rate_limiter, max_workers=DEFAULT_FILTER_WORKERS):
+    """
+    Extracts the filters of every query: the rule-based parser handles what it can and
+    the rest go to rag_functions.extract_filters concurrently, under the rate limit.
+
+    Returns:
+    list: (metadata_filter, k) per query; queries without usable filters get (None, DEFAULT_K).
+    """
+    parser = rag_functions.get_filter_parser()
+    filter_terms = [parser.parse(query['query']) for query in queries]
+    remaining = [i for i, terms in enumerate(filter_terms) if terms is None]
+
+    def extract(query):
+        rate_limiter.acquire()
+        try:
+            return rag_functions.extract_filters(query['query'])
+        except Exception as e:
+            # Searched without filters, as getContext does
+            print(f"Filter extraction failed for query {query['id']} ({e!r})")
+            return None
+
+    with tracer.span('batch_filter_extraction', queries=len(queries), llm=len(remaining)):
+        if remaining:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(remaining))) as executor:
+                extracted = executor.map(tracer.propagate(extract), [queries[i] for i in remaining])
+                for i, terms in zip(remaining, extracted):
+                    filter_terms[i] = terms
+
+    filters = []
+    for terms in filter_terms:
+        try:
+            filters.append((terms['metadata_filter'], int(terms['k_filter'])))
+        except (KeyError, TypeError, ValueError):
+            filters.append((None, DEFAULT_K))
+    return filters
+
+
+def retrieve_all(queries, filters, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Retrieves the context of every query in batches (see retrieval.search_many). Like
+    getContext, a query whose filter fails is searched again without it. A query that
+    still fails, or whose whole batch fails (e.g. in the embedding pass), is yielded with
+    the exception instead of a context, so one bad query does not stop the run.
+
+    Yields:
+    tuple: (query, metadata_filter, k, context_df or Exception) per query, batch by batch.
+    """
+    vector_store = get_complaint_store()
+    metadata_index = vector_store.metadata_index
+
+    def search(requests):
+        try:
+            return search_many(vector_store, metadata_index, requests)
+        except Exception as e:
+            if len(requests) == 1:
+                return [e]
+            # Find the failing queries by searching the batch one query at a time
+            return [search([request])[0] for request in requests]
+
+    for start in range(0, len(queries), batch_size):
+        batch = list(zip(queries[start:start + batch_size], filters[start:start + batch_size]))
+        requests = [(query['query'], metadata_filter, k, None) for query, (metadata_filter, k) in batch]
+        results = search(requests)
+        failed = [i for i, result in enumerate(results) if isinstance(result, Exception)]
+        if failed:
+            retried = search([(requests[i][0], None, DEFAULT_K, None) for i in failed])
+            for i, result in zip(failed, retried):
+                if not isinstance(result, Exception):
+                    results[i] = result
+                    batch[i] = (batch[i][0], (None, DEFAULT_K))
+        for (query, (metadata_filter, k)), result in zip(batch, results):
+            if not isinstance(result, Exception):
+                try:
+                    result = build_results(vector_store, *result)
+                except Exception as e:
+                    result = e
+            yield query, metadata_filter, k, result
+
+
+def run_batch(queries, output_path, resume=True, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+              requests_per_second=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Answers a batch of queries and appends one JSON line per query to output_path as soon
+    as its answer is ready: {"id", "query", "metadata_filter", "k", "rows", "answer",
+    "seconds"}, or {"id", "query", "error"} if it failed.
+
+    Parameters:
+    queries (list or str): Query strings or {'query', 'id'} dicts, or a file (see read_queries).
+    output_path (str): The JSON-lines output file.
+    resume (bool): Skip queries already answered in output_path; failed ones are retried.
+        Without resume the file is overwritten.
+    max_concurrency (int): Number of answers generated at once.
+    requests_per_second (float): Optional cap on the rate of LLM calls (filter extraction
+        and generation share it).
+    batch_size (int): Queries retrieved together.
+
+    Returns:
+    dict: Counts of queries, skipped, answered and failed, and the run time in seconds.
+    """
+    queries = read_queries(queries) if isinstance(queries, str) else normalise_queries(queries)
+    done = completed_ids(output_path) if resume else set()
+    pending = [query for query in queries if query['id'] not in done]
+    summary = {'queries': len(queries), 'skipped': len(queries) - len(pending), 'answered': 0, 'failed': 0}
+    print(f"{len(pending)} queries to answer, {summary['skipped']} already answered")
+
+    rate_limiter = RateLimiter(requests_per_second)
+    write_lock = threading.Lock()
+    start_time = time.time()
+
+    with open(output_path, 'a' if resume else 'w', encoding='utf-8') as output, tracer.span('batch_run') as span:
+        if output.tell() and not ends_with_newline(output_path):
+            # Keep the partial last line of a killed run from swallowing the first new record
+            output.write('\n')
+        def write(record):
+            with write_lock:
+                output.write(json.dumps(record, default=str) + '\n')
+                output.flush()
+                summary['answered' if 'answer' in record else 'failed'] += 1
+                finished = summary['answered'] + summary['failed']
+                if finished % 10 == 0 or finished == len(pending):
+                    print(f"Finished {finished}/{len(pending)} queries ({summary['failed']} failed)")
+
+        def answer(query, metadata_filter, k, context_df):
+            if isinstance(context_df, Exception):
+                write({'id': query['id'], 'query': query['query'], 'error': repr(context_df)})
+                return
+            query_start = time.time()
+            try:
+                # Every generation call, map-reduce ones included, goes through the shared limit
+                response = rag_functions.getResponse(query['query'], context_df, rate_limiter)
+            except Exception as e:
+                write({'id': query['id'], 'query': query['query'], 'error': repr(e)})
+                return
+            write({
+                'id': query['id'],
+                'query': query['query'],
+                'metadata_filter': metadata_filter,
+                'k': k,
+                'rows': len(context_df),
+                'answer': response,
+                'seconds': time.time() - query_start,
+            })
+
+        filters = extract_all_filters(pending, rate_limiter)
+        # Generation starts as soon as the first batch is retrieved
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(tracer.propagate(answer), *retrieved)
+                       for retrieved in retrieve_all(pending, filters, batch_size)]
+            for future in as_completed(futures):
+                future.result()
+        span.set(queries=len(pending), failed=summary['failed'])
+
+    summary['seconds'] = time.time() - start_time
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of complaint queries in batch.")
+    parser.add_argument('queries_path', help="Queries file: .txt (one per line), .jsonl or .csv")
+    parser.add_argument('--output', required=True, help="JSON-lines file the answers are appended to")
+    parser.add_argument('--no-resume', action='store_true', help="Answer every query again and overwrite the output")
+    parser.add_argument('--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument('--requests-per-second', type=float, help="Cap on the rate of LLM calls")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    summary = run_batch(args.queries_path, args.output, resume=not args.no_resume,
+                        max_concurrency=args.max_concurrency, requests_per_second=args.requests_per_second,
+                        batch_size=args.batch_size)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Connection pool sized for concurrent embedding calls, tool calls and chatbot sessions
+BEDROCK_CONFIG = Config(
+    region_name='us-east-1',
+    max_pool_connections=50,
+    connect_timeout=5,
+    read_timeout=120,
+    tcp_keepalive=True,
+    retries={'max_attempts': 8, 'mode': 'adaptive'},
+)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_bedrock_client():
+    """
+    Returns the process-wide bedrock-runtime client, creating it on first use. boto3
+    clients are thread-safe, so sharing one client means credentials are resolved once
+    and TLS connections are reused from its pool across calls and threads.
+
+    Returns:
+    The shared bedrock-runtime client.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = boto3.session.Session().client(service_name='bedrock-runtime', config=BEDROCK_CONFIG)
+    return _client
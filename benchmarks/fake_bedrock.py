@@ -0,0 +1,133 @@
+import hashlib
+import io
+import json
+import threading
+import time
+
+import numpy as np
+
+
+def hash_embedding(text, dimension=1024):
+    """
+    Deterministic unit-length embedding seeded from a hash of the text, so the same text
+    always gets the same vector and different texts get unrelated ones.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def estimate_tokens(value):
+    return max(1, len(json.dumps(value, default=str)) // 4)
+
+
+class FakeBedrockClient:
+    """
+    Local stand-in for the bedrock-runtime client used by the RAG modules.
+
+    invoke_model returns hash embeddings in the Titan response format. converse and
+    converse_stream return scripted responses with the same shape as Bedrock, including
+    usage and metrics, and walk the tool-use loop through identify_complaints_filters ->
+    get_complaintsData -> generateResponse -> final answer. Every call sleeps for a
+    configurable latency so stage timings include a realistic network cost.
+    """
+
+    def __init__(self, dimension=1024, embed_latency=0.0, converse_latency=0.0, stream_chunks=20,
+                 answer="Most complaints relate to delayed payments and digital channel outages.",
+                 filter_input=None):
+        """
+        Parameters:
+        dimension (int): Embedding dimension.
+        embed_latency (float): Seconds per invoke_model call.
+        converse_latency (float): Seconds per converse call (spread over the chunks when streaming).
+        stream_chunks (int): Number of text deltas converse_stream yields.
+        answer (str): Text returned for generation calls.
+        filter_input (dict): toolUse input returned for identify_complaints_filters in
+            rag_functions, defaults to {'x': {}, 'y': 100}.
+        """
+        self.dimension = dimension
+        self.embed_latency = embed_latency
+        self.converse_latency = converse_latency
+        self.stream_chunks = stream_chunks
+        self.answer = answer
+        self.filter_input = filter_input or {'x': {}, 'y': 100}
+        self.calls = {'invoke_model': 0, 'converse': 0, 'converse_stream': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None):
+        self._count('invoke_model')
+        time.sleep(self.embed_latency)
+        text = json.loads(body)['inputText']
+        payload = {'embedding': hash_embedding(text, self.dimension), 'inputTextTokenCount': estimate_tokens(text)}
+        return {'body': io.BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    def _tool_use(self, name, tool_input):
+        return {'toolUse': {'toolUseId': f'tooluse_{name}', 'name': name, 'input': tool_input}}
+
+    def _next_content(self, messages, toolConfig):
+        """
+        Picks the scripted reply for the conversation so far.
+        """
+        tool_names = {tool['toolSpec']['name'] for tool in (toolConfig or {}).get('tools', [])}
+        if tool_names == {'identify_complaints_filters'}:
+            return [{'text': 'Extracting filters.'}, self._tool_use('identify_complaints_filters', self.filter_input)], 'tool_use'
+        if not tool_names:
+            return [{'text': self.answer}], 'end_turn'
+
+        user_query = messages[0]['content'][0]['text']
+        last_results = [block['toolResult'] for block in messages[-1]['content'] if 'toolResult' in block]
+        if not last_results:
+            tool_input = {'filter_dict': {'metadata_filter': {}, 'k_filter': 100}}
+            return [self._tool_use('identify_complaints_filters', tool_input)], 'tool_use'
+        result = last_results[0]['content'][0]
+        if 'json' in result and 'filter_terms' in result['json']:
+            filter_terms = result['json']['filter_terms'].get('filter_dict', {'metadata_filter': {}, 'k_filter': 100})
+            tool_input = {'user_query': user_query, 'filter_terms': filter_terms}
+            return [self._tool_use('get_complaintsData', tool_input)], 'tool_use'
+        if 'json' in result and 'context_handle' in result['json']:
+            tool_input = {'user_query': user_query, 'context_handle': result['json']['context_handle']}
+            return [self._tool_use('generateResponse', tool_input)], 'tool_use'
+        return [{'text': self.answer}], 'end_turn'
+
+    def converse(self, modelId, messages, system=None, inferenceConfig=None, toolConfig=None):
+        self._count('converse')
+        start = time.time()
+        time.sleep(self.converse_latency)
+        content, stop_reason = self._next_content(messages, toolConfig)
+        input_tokens = estimate_tokens(messages) + estimate_tokens(system)
+        output_tokens = estimate_tokens(content)
+        return {
+            'output': {'message': {'role': 'assistant', 'content': content}},
+            'stopReason': stop_reason,
+            'usage': {'inputTokens': input_tokens, 'outputTokens': output_tokens,
+                      'totalTokens': input_tokens + output_tokens},
+            'metrics': {'latencyMs': int((time.time() - start) * 1000)},
+        }
+
+    def converse_stream(self, modelId, messages, system=None, inferenceConfig=None, toolConfig=None):
+        self._count('converse_stream')
+        words = self.answer.split(' ')
+        step = max(1, len(words) // self.stream_chunks)
+        pieces = [' '.join(words[i:i + step]) + ' ' for i in range(0, len(words), step)]
+        input_tokens = estimate_tokens(messages) + estimate_tokens(system)
+
+        def events():
+            start = time.time()
+            yield {'messageStart': {'role': 'assistant'}}
+            for piece in pieces:
+                time.sleep(self.converse_latency / len(pieces))
+                yield {'contentBlockDelta': {'contentBlockIndex': 0, 'delta': {'text': piece}}}
+            yield {'contentBlockStop': {'contentBlockIndex': 0}}
+            yield {'messageStop': {'stopReason': 'end_turn'}}
+            output_tokens = estimate_tokens(self.answer)
+            yield {'metadata': {
+                'usage': {'inputTokens': input_tokens, 'outputTokens': output_tokens,
+                          'totalTokens': input_tokens + output_tokens},
+                'metrics': {'latencyMs': int((time.time() - start) * 1000)},
+            }}
+
+        return {'stream': events()}
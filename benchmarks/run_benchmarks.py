@@ -0,0 +1,215 @@
+"""
+Offline benchmarks for the complaints RAG pipeline.
+
+Runs ingestion, module import, index loading and the per-query stages of getContext, getResponse and
+run_loop against a local FakeBedrockClient, on synthetic complaint sets of each size.
+Each size runs in a fresh process so memory figures are not mixed up between sizes.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --sizes 10000,100000,1000000 --output benchmark_results.json
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = [
+    "summarise the complaints by the client region",
+    "show me 5 complaints in region MC",
+    "what are the main issues with payments in LC",
+    "show me all complaints in region ICB after 15th June 2024",
+    "complaints about the mobile app crashing",
+    "which clients had delayed international payments",
+    "show me 20 complaints about frozen accounts",
+    "summarise customer service complaints between 2024-01-01 and 2024-03-31",
+]
+
+SYSTEM_PROMPT = """You are an AI assistant within a corporate bank in the Complaints team. Use the tools to
+identify filters, retrieve the complaints and generate a response to the user's query."""
+
+
+def percentiles(samples):
+    """
+    Returns:
+    dict: count, mean, p50, p95, p99 and max of the samples, in milliseconds.
+    """
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(values):
+        return {'count': 0}
+    return {
+        'count': int(len(values)),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed(samples, stage, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    samples.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def run_size(rows, options):
+    """
+    Benchmarks one corpus size. Runs in its own process and works in a temporary
+    directory, since the RAG modules load complaints.vs from the working directory.
+    """
+    sys.path.insert(0, REPO_ROOT)
+    import bedrock_client
+    from benchmarks.fake_bedrock import FakeBedrockClient
+    from benchmarks.synthetic import write_complaints_csv
+
+    fake = FakeBedrockClient(
+        dimension=options['dimension'],
+        embed_latency=options['embed_latency'],
+        converse_latency=options['converse_latency'],
+    )
+    bedrock_client._client = fake
+    result = {'rows': rows}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        csv_path = os.path.join(work_dir, 'complaints.csv')
+
+        start = time.perf_counter()
+        write_complaints_csv(csv_path, rows)
+        result['generate_s'] = time.perf_counter() - start
+
+        import build_vector_store
+        start = time.perf_counter()
+        build_vector_store.ingest_csv(
+            csv_path,
+            store_path='complaints.vs',
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            max_workers=options['max_workers'],
+            checkpoint_every=10 ** 9,
+            resume=False,
+            ann_options={'index_type': options['index_type']} if options['index_type'] != 'flat' else None,
+        )
+        ingest_s = time.perf_counter() - start
+        result['ingest'] = {'seconds': ingest_s, 'rows_per_second': rows / ingest_s, 'peak_memory_mb': peak_memory_mb()}
+        result['store_size_mb'] = sum(
+            os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk('complaints.vs') for name in names
+        ) / (1024 * 1024)
+        from ann_index import load_ann_config
+        result['ann_index'] = load_ann_config('complaints.vs')
+
+        start = time.perf_counter()
+        rag_functions = importlib.import_module('rag_functions')
+        rag_functions_tool_use = importlib.import_module('rag_functions_toolUse')
+        result['import_s'] = time.perf_counter() - start
+
+        import retrieval
+        from complaint_store import get_complaint_store, get_query_embeddings
+        from context_packer import pack_context
+        start = time.perf_counter()
+        vector_store = get_complaint_store()
+        result['index_load_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        metadata_index = vector_store.metadata_index
+        vector_store.aggregates
+        result['metadata_load_s'] = time.perf_counter() - start
+
+        result['queries'] = {}
+        for phase in ('cold', 'warm'):
+            samples = {}
+            if phase == 'cold':
+                rag_functions.filter_cache = type(rag_functions.filter_cache)()
+            for _ in range(options['repeats']):
+                for query in QUERIES:
+                    query_start = time.perf_counter()
+                    filter_terms = timed(samples, 'filter_extraction', rag_functions.extract_filters, query) or {}
+                    metadata_filter = filter_terms.get('metadata_filter')
+                    k_filter = filter_terms.get('k_filter', 100)
+                    # The stages of retrieval.search_ids in vector mode, timed one by one
+                    query_vector = timed(samples, 'query_embedding', retrieval.embed_query, vector_store, query)
+                    ids = timed(samples, 'filter_resolution', retrieval.resolve_filter, metadata_index, metadata_filter)
+                    positions, scores = timed(samples, 'vector_search', retrieval.search_vectors, vector_store,
+                                              query_vector, ids, k_filter)[0]
+                    context_df = timed(samples, 'dataframe_build', retrieval.build_results,
+                                       vector_store, positions, scores)
+                    timed(samples, 'context_packing', pack_context, context_df, query)
+                    timed(samples, 'generation', rag_functions.getResponse, query, context_df)
+                    samples.setdefault('end_to_end', []).append(time.perf_counter() - query_start)
+                    timed(samples, 'run_loop', rag_functions_tool_use.run_loop, query, SYSTEM_PROMPT)
+                if phase == 'cold':
+                    break
+            result['queries'][phase] = {stage: percentiles(values) for stage, values in samples.items()}
+
+        from tracing import tracer
+        result['trace_metrics'] = tracer.metrics()
+        result['embedding_cache'] = get_query_embeddings().stats()
+        result['fake_bedrock_calls'] = dict(fake.calls)
+        result['peak_memory_mb'] = peak_memory_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the complaints RAG pipeline.")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="Comma separated corpus sizes")
+    parser.add_argument('--output', default='benchmark_results.json', help="Machine-readable results file")
+    parser.add_argument('--dimension', type=int, default=1024, help="Embedding dimension (Titan v2 is 1024)")
+    parser.add_argument('--embed-latency', type=float, default=0.0, help="Seconds per fake embedding call")
+    parser.add_argument('--converse-latency', type=float, default=0.0, help="Seconds per fake converse call")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=5, help="Passes over the queries in the warm phase")
+    parser.add_argument('--index-type', default='flat', help="Approximate index to build (see ann_index.INDEX_TYPES)")
+    args = parser.parse_args()
+
+    options = {
+        'dimension': args.dimension,
+        'embed_latency': args.embed_latency,
+        'converse_latency': args.converse_latency,
+        'chunk_size': args.chunk_size,
+        'batch_size': args.batch_size,
+        'max_workers': args.max_workers,
+        'repeats': args.repeats,
+        'index_type': args.index_type,
+    }
+    results = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'options': options,
+        'sizes': [],
+    }
+
+    context = multiprocessing.get_context('spawn')
+    for rows in [int(size) for size in args.sizes.split(',')]:
+        print(f"Benchmarking {rows} rows")
+        with context.Pool(1) as pool:
+            size_result = pool.apply(run_size, (rows, options))
+        results['sizes'].append(size_result)
+        print(json.dumps({key: size_result[key] for key in ('rows', 'ingest', 'import_s', 'index_load_s')}, indent=2))
+
+        # Written after every size so a long run keeps its finished sizes
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
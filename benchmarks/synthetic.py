@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+REGIONS = ['MC', 'LC', 'ICB']
+THEMES = ['Digital Channel', 'Payments', 'Customer Service', 'Account Management']
+
+NAME_PREFIXES = ['Alpha', 'Beta', 'Gamma', 'Delta', 'Epsilon', 'Zeta', 'Eta', 'Theta', 'Iota', 'Kappa', 'Lambda',
+                 'Mu', 'Nu', 'Xi', 'Omicron', 'Pi', 'Rho', 'Sigma', 'Tau', 'Upsilon', 'Phi', 'Chi', 'Psi', 'Omega',
+                 'Quantum', 'Global', 'Tech', 'Summit', 'Harbor', 'Vertex', 'Nova', 'Atlas', 'Crest', 'Meridian']
+NAME_MIDDLES = ['Innovations', 'Trade Solutions', 'Holdings', 'Financial Services', 'Enterprises', 'Tech',
+                'Global', 'Solutions', 'Prime', 'Capital', 'Logistics', 'Industries', 'Partners', 'Systems']
+NAME_SUFFIXES = ['Inc.', 'Ltd.', 'Corp.', 'Group.', 'PLC', 'LLC']
+
+COMPLAINT_TEMPLATES = {
+    'Digital Channel': [
+        "The online banking portal has been down for over {n} hours, causing significant delays in our financial operations.",
+        "The mobile banking app crashed {n} times today, preventing us from accessing critical financial information.",
+        "We could not log in to the corporate portal for {n} days after the latest update.",
+    ],
+    'Payments': [
+        "A recent international payment was delayed by {n} days, resulting in penalties from our suppliers.",
+        "A SWIFT transfer of {n} thousand was returned without explanation, disrupting our supply chain.",
+        "We were charged a duplicate fee on {n} outgoing payments this month.",
+    ],
+    'Customer Service': [
+        "The customer service team was unresponsive to our queries regarding account discrepancies for {n} days.",
+        "We have not received a callback from the support team despite {n} attempts.",
+        "Our relationship manager did not respond to {n} emails about a chargeback dispute.",
+    ],
+    'Account Management': [
+        "Our account was mistakenly frozen for {n} days, preventing us from making necessary payments.",
+        "Our account was incorrectly flagged for suspicious activity {n} times, causing unnecessary delays.",
+        "The account statement for the last {n} months contained incorrect balances.",
+    ],
+}
+
+
+def client_names(count, seed=0):
+    """
+    Distinct client names built from prefix/middle/suffix combinations (plus a number once
+    the combinations run out), in the style of complaints_fake.csv.
+    """
+    rng = np.random.default_rng(seed)
+    names = [f'{p} {m} {s}' for p in NAME_PREFIXES for m in NAME_MIDDLES for s in NAME_SUFFIXES]
+    rng.shuffle(names)
+    if count > len(names):
+        names += [f'{names[i % len(names)].rsplit(" ", 1)[0]} {i} {NAME_SUFFIXES[i % len(NAME_SUFFIXES)]}'
+                  for i in range(count - len(names))]
+    return names[:count]
+
+
+def generate_complaints(rows, clients=20000, start_date='2023-01-01', end_date='2024-12-31', seed=0, client_seed=0):
+    """
+    Generates a DataFrame of synthetic complaints with the columns of complaints_fake.csv.
+
+    Parameters:
+    rows (int): Number of complaints.
+    clients (int): Number of distinct clients.
+    start_date (str): First complaint date.
+    end_date (str): Last complaint date.
+    seed (int): Random seed for the complaints.
+    client_seed (int): Random seed for the client names and regions, kept fixed across
+        chunks so a client always has the same region.
+
+    Returns:
+    pd.DataFrame: client_name, client_region, theme, complaint_date, complaint_text.
+    """
+    client_rng = np.random.default_rng(client_seed)
+    names = np.array(client_names(clients, client_seed), dtype=object)
+    # Each client belongs to one region
+    client_regions = np.array(REGIONS, dtype=object)[client_rng.integers(0, len(REGIONS), len(names))]
+
+    rng = np.random.default_rng(seed)
+    client_codes = rng.integers(0, len(names), rows)
+    themes = np.array(THEMES, dtype=object)[rng.integers(0, len(THEMES), rows)]
+
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    days = rng.integers(0, (end - start).days + 1, rows)
+    dates = (start + pd.to_timedelta(days, unit='D')).strftime('%Y-%m-%d')
+
+    template_choice = rng.integers(0, 3, rows)
+    numbers = rng.integers(2, 60, rows)
+    texts = [COMPLAINT_TEMPLATES[theme][choice].format(n=number)
+             for theme, choice, number in zip(themes, template_choice, numbers)]
+
+    return pd.DataFrame({
+        'client_name': names[client_codes],
+        'client_region': client_regions[client_codes],
+        'theme': themes,
+        'complaint_date': dates,
+        'complaint_text': texts,
+    })
+
+
+def write_complaints_csv(path, rows, chunk_rows=100000, **kwargs):
+    """
+    Writes synthetic complaints to a CSV in chunks so large sizes do not need to fit in memory.
+    """
+    written = 0
+    chunk_index = 0
+    while written < rows:
+        chunk = generate_complaints(min(chunk_rows, rows - written), seed=chunk_index + 1, **kwargs)
+        chunk.to_csv(path, index=False, mode='w' if written == 0 else 'a', header=written == 0)
+        written += len(chunk)
+        chunk_index += 1
+    return path
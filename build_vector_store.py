@@ -0,0 +1,559 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+import pandas as pd
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain.embeddings import BedrockEmbeddings
+from langchain_core.documents import Document
+
+import ann_index
+from aggregates import ComplaintAggregates
+from bedrock_client import get_bedrock_client
+from complaint_store import (DOCSTORE_DIR, DOCUMENT_COLUMNS, ID_COLUMN, INDEX_FILE, ColumnarDocstore, ComplaintStore,
+                             read_index, replace_file, write_index)
+from lexical_index import LexicalIndex
+from metadata_index import MetadataIndex
+
+# Columns stored as document metadata, and the column that gets embedded
+METADATA_COLUMNS = ['client_name', 'client_region', 'theme', 'complaint_date']
+TEXT_COLUMN = 'complaint_text'
+
+# Progress file written next to the vector store so an interrupted build can resume
+CHECKPOINT_FILE = 'ingest_checkpoint.json'
+
+# Folder inside the vector store holding the parts of a build in progress
+PARTS_DIR = 'ingest_parts'
+
+# Retries of a failed embedding batch (e.g. Bedrock throttling), see embed_with_retry
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+
+# Pickled langchain docstore written by FAISS.save_local, replaced by the columnar docstore
+PICKLE_FILE = 'index.pkl'
+
+# build  - new store from scratch (resumable via the checkpoint)
+# append - embed and add rows that are not in the store yet
+# upsert - treat the CSV as the full current set: add new/changed rows, drop rows no longer present
+# delete - remove the rows in the CSV from the store
+MODES = ['build', 'append', 'upsert', 'delete']
+
+
+def get_embeddings():
+    """
+    Creates the BedrockEmbeddings instance used to embed the complaints.
+
+    Returns:
+    BedrockEmbeddings: Titan v2 embeddings backed by a bedrock-runtime client.
+    """
+    return BedrockEmbeddings(
+        client=get_bedrock_client(),
+        model_id="amazon.titan-embed-text-v2:0"
+    )
+
+
+def embed_with_retry(embeddings, texts, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+                     max_delay=DEFAULT_MAX_DELAY):
+    """
+    Embeds a batch of texts, retrying with exponential backoff and jitter on failure
+    (e.g. Bedrock throttling).
+
+    Parameters:
+    embeddings: The embeddings instance to call.
+    texts (list): The texts to embed.
+    max_retries (int): Number of retries before the error is raised.
+    base_delay (float): Initial backoff in seconds, doubled on every retry.
+    max_delay (float): Upper bound for a single backoff.
+
+    Returns:
+    list: One embedding vector per text.
+    """
+    attempt = 0
+    while True:
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt >= max_retries:
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            delay = delay * (0.5 + random.random() / 2)
+            print(f"Embedding batch failed ({e!r}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def embed_batches(embeddings, batches, max_workers=8, **retry_kwargs):
+    """
+    Embeds batches over a bounded thread pool and yields the results in input order.
+    At most 2 * max_workers batches are in flight at any time, so memory use does not
+    depend on how many batches are passed in.
+
+    Parameters:
+    embeddings: The embeddings instance to call.
+    batches (iterable): Iterable of (texts, payload) tuples. The payload is passed
+        through untouched so callers can carry metadata alongside the texts.
+    max_workers (int): Number of concurrent embedding calls.
+
+    Yields:
+    tuple: (texts, vectors, payload) for each batch.
+    """
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for texts, payload in batches:
+            future = executor.submit(embed_with_retry, embeddings, texts, **retry_kwargs)
+            in_flight.append((texts, future, payload))
+            if len(in_flight) >= 2 * max_workers:
+                texts_done, future_done, payload_done = in_flight.popleft()
+                yield texts_done, future_done.result(), payload_done
+        while in_flight:
+            texts_done, future_done, payload_done = in_flight.popleft()
+            yield texts_done, future_done.result(), payload_done
+
+
+def read_complaints(csv_path, chunk_size=5000, skip_rows=0):
+    """
+    Reads a complaints_fake.csv shaped file in chunks.
+
+    Parameters:
+    csv_path (str): Path to the CSV file.
+    chunk_size (int): Number of rows per chunk.
+    skip_rows (int): Number of data rows to skip (used when resuming).
+
+    Yields:
+    pd.DataFrame: The next chunk of complaints.
+    """
+    skiprows = range(1, skip_rows + 1) if skip_rows else None
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size, skiprows=skiprows,
+                             usecols=METADATA_COLUMNS + [TEXT_COLUMN], dtype=str):
+        yield chunk.fillna('')
+
+
+def complaint_ids(chunk):
+    """
+    Computes a stable id for each complaint from a hash of all of its fields, so the
+    same complaint always maps to the same docstore id and any edit gives a new one.
+
+    Parameters:
+    chunk (pd.DataFrame): A chunk of complaints.
+
+    Returns:
+    pd.Series: The sha1 hex digest of each row.
+    """
+    payloads = chunk[METADATA_COLUMNS + [TEXT_COLUMN]].astype(str).agg('\x1f'.join, axis=1)
+    return payloads.map(lambda payload: hashlib.sha1(payload.encode('utf-8')).hexdigest())
+
+
+def chunk_to_batches(chunk, ids, batch_size):
+    """
+    Splits a chunk of complaints into embedding batches.
+
+    Parameters:
+    chunk (pd.DataFrame): A chunk of complaints.
+    ids (list): The complaint id of each row.
+    batch_size (int): Number of texts per embedding call.
+
+    Yields:
+    tuple: (texts, (metadatas, ids)) for each batch.
+    """
+    texts = chunk[TEXT_COLUMN].tolist()
+    metadatas = chunk[METADATA_COLUMNS].to_dict('records')
+    for start in range(0, len(texts), batch_size):
+        end = start + batch_size
+        yield texts[start:end], (metadatas[start:end], ids[start:end])
+
+
+def load_vector_store(store_path, embeddings):
+    """
+    Loads a vector store folder as a langchain FAISS store, e.g. to update it. A folder
+    that still has the pickled docstore of FAISS.save_local is loaded from that.
+
+    Parameters:
+    store_path (str): The vector store folder.
+    embeddings: The embeddings instance stored on the vector store.
+
+    Returns:
+    FAISS: The vector store, fully in memory.
+    """
+    if not os.path.isdir(os.path.join(store_path, DOCSTORE_DIR)):
+        return FAISS.load_local(store_path, embeddings, allow_dangerous_deserialization=True)
+
+    index = read_index(os.path.join(store_path, INDEX_FILE), mmap=False)
+    columns = ColumnarDocstore.load(store_path, mmap=False).get_columns([ID_COLUMN] + METADATA_COLUMNS + [TEXT_COLUMN])
+    ids = columns[ID_COLUMN]
+    documents = {
+        doc_id: Document(
+            page_content=columns[TEXT_COLUMN][position],
+            metadata={column: columns[column][position] for column in METADATA_COLUMNS},
+        )
+        for position, doc_id in enumerate(ids)
+    }
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(documents),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+
+
+def save_vector_store(vector_store, store_path):
+    """
+    Saves the FAISS index and the columnar docstore (see complaint_store), which the RAG
+    modules memory-map instead of unpickling. A leftover index.pkl is removed so it cannot
+    go stale.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    write_index(vector_store.index, os.path.join(store_path, INDEX_FILE))
+    ColumnarDocstore.from_vector_store(vector_store).save(store_path, vector_store.index)
+    pickle_path = os.path.join(store_path, PICKLE_FILE)
+    if os.path.exists(pickle_path):
+        os.remove(pickle_path)
+
+
+def convert_store(store_path):
+    """
+    Rewrites a store saved with FAISS.save_local (index.pkl) in the columnar format,
+    without re-embedding anything.
+    """
+    save_vector_store(load_vector_store(store_path, embeddings=None), store_path)
+    print(f"Converted {store_path} to the columnar docstore")
+
+
+def load_checkpoint(store_path):
+    checkpoint_path = os.path.join(store_path, CHECKPOINT_FILE)
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(store_path, checkpoint):
+    def write(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f)
+    replace_file(os.path.join(store_path, CHECKPOINT_FILE), write)
+
+
+def part_path(parts_path, number):
+    return os.path.join(parts_path, f'part-{number:05d}.npz')
+
+
+def save_part(parts_path, number, vectors, docstore):
+    """
+    Saves the vectors and docstore columns of the rows embedded since the last checkpoint.
+    """
+    arrays = {'vectors': vectors}
+    for column, (offsets, data) in docstore.columns.items():
+        arrays[f'{column}.offsets'] = offsets
+        arrays[f'{column}.data'] = data
+
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+    replace_file(part_path(parts_path, number), write)
+
+
+def load_part(parts_path, number):
+    """
+    Returns:
+    tuple: (vectors, ColumnarDocstore) of a part written by save_part.
+    """
+    with np.load(part_path(parts_path, number)) as data:
+        vectors = data['vectors']
+        columns = {column: (data[f'{column}.offsets'], data[f'{column}.data']) for column in [ID_COLUMN] + DOCUMENT_COLUMNS}
+    return vectors, ColumnarDocstore(columns)
+
+
+def build_store(csv_path, store_path, embeddings, chunk_size, batch_size, max_workers, checkpoint_every, resume,
+                retry_options):
+    """
+    Build mode of ingest_csv. Embedded rows are only kept in memory until the next
+    checkpoint, which appends their vectors and columns to the store folder as a new
+    part file, so memory stays flat while embedding and each checkpoint writes only the
+    rows embedded since the previous one. The parts are then assembled into index.faiss
+    and the columnar docstore; only the flat index (4 bytes per dimension per complaint)
+    and the encoded columns are in memory at that point.
+    """
+    parts_path = os.path.join(store_path, PARTS_DIR)
+    checkpoint = load_checkpoint(store_path) if resume else None
+    rows_done, parts = 0, 0
+    if checkpoint and checkpoint['csv_path'] == os.path.abspath(csv_path) and 'parts' in checkpoint:
+        rows_done, parts = checkpoint['rows_done'], checkpoint['parts']
+        print(f"Resuming from row {rows_done}")
+    else:
+        shutil.rmtree(parts_path, ignore_errors=True)
+    os.makedirs(parts_path, exist_ok=True)
+
+    seen_ids = set()
+    for number in range(parts):
+        seen_ids.update(load_part(parts_path, number)[1].get_columns([ID_COLUMN])[ID_COLUMN])
+    pending_vectors, pending_ids, pending_columns = [], [], {column: [] for column in DOCUMENT_COLUMNS}
+
+    def checkpoint_parts():
+        nonlocal parts
+        if pending_ids:
+            docstore = ColumnarDocstore.from_columns(pending_ids, pending_columns)
+            save_part(parts_path, parts, np.concatenate(pending_vectors), docstore)
+            parts += 1
+            pending_vectors.clear()
+            pending_ids.clear()
+            for values in pending_columns.values():
+                values.clear()
+        # Written after the part, so the checkpoint never points past what is on disk
+        save_checkpoint(store_path, {'csv_path': os.path.abspath(csv_path), 'rows_done': rows_done, 'parts': parts})
+
+    start_time = time.time()
+    rows_this_run = 0
+    rows_embedded = 0
+    chunks_since_checkpoint = 0
+    for chunk in read_complaints(csv_path, chunk_size=chunk_size, skip_rows=rows_done):
+        ids = complaint_ids(chunk)
+        rows_done += len(chunk)
+        rows_this_run += len(chunk)
+
+        # Only embed non-empty rows that are not repeated within the CSV
+        new_rows = ~ids.isin(seen_ids) & ~ids.duplicated() & (chunk[TEXT_COLUMN].str.strip() != '')
+        seen_ids.update(ids)
+        chunk, ids = chunk[new_rows], ids[new_rows].tolist()
+
+        batches = chunk_to_batches(chunk, ids, batch_size)
+        for _, vectors, _ in embed_batches(embeddings, batches, max_workers=max_workers, **retry_options):
+            pending_vectors.append(np.asarray(vectors, dtype=np.float32))
+        pending_ids.extend(ids)
+        for column in DOCUMENT_COLUMNS:
+            pending_columns[column].extend(chunk[column].tolist())
+        rows_embedded += len(ids)
+
+        chunks_since_checkpoint += 1
+        if chunks_since_checkpoint >= checkpoint_every:
+            checkpoint_parts()
+            chunks_since_checkpoint = 0
+        elapsed = time.time() - start_time
+        print(f"Read {rows_done} rows, embedded {rows_embedded} ({rows_this_run / max(elapsed, 1e-9):.0f} rows/s)")
+    checkpoint_parts()
+    if not parts:
+        raise ValueError(f"No complaints found in {csv_path}")
+
+    index, docstores = None, []
+    for number in range(parts):
+        vectors, docstore = load_part(parts_path, number)
+        if index is None:
+            index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors)
+        docstores.append(docstore)
+    docstore = ColumnarDocstore.concat(docstores)
+    write_index(index, os.path.join(store_path, INDEX_FILE))
+    docstore.save(store_path, index)
+    pickle_path = os.path.join(store_path, PICKLE_FILE)
+    if os.path.exists(pickle_path):
+        os.remove(pickle_path)
+    # The store is complete: drop the checkpoint before the parts it points to
+    os.remove(os.path.join(store_path, CHECKPOINT_FILE))
+    shutil.rmtree(parts_path)
+
+
+def update_store(csv_path, store_path, embeddings, chunk_size, batch_size, max_workers, mode, retry_options):
+    """
+    append / upsert / delete modes of ingest_csv. The existing store is loaded as a
+    langchain FAISS store (deletes need its docstore), so unlike build mode these hold
+    the whole store in memory; they are meant for incremental updates.
+
+    Returns:
+    tuple: (updated FAISS vector store, updated ComplaintAggregates).
+    """
+    vector_store = load_vector_store(store_path, embeddings)
+    known_ids = set(vector_store.index_to_docstore_id.values())
+    aggregates = ComplaintAggregates.load_or_build(MetadataIndex.load_or_build(vector_store, store_path), store_path)
+    seen_ids = set()
+    # Ordered set: a complaint listed twice in the CSV must only be removed once
+    ids_to_delete = {}
+
+    start_time = time.time()
+    rows_done = 0
+    rows_embedded = 0
+    for chunk in read_complaints(csv_path, chunk_size=chunk_size):
+        ids = complaint_ids(chunk)
+        rows_done += len(chunk)
+
+        if mode == 'delete':
+            ids_to_delete.update(dict.fromkeys(i for i in ids if i in known_ids))
+            continue
+
+        # Only embed non-empty rows that are neither in the store nor repeated within the CSV
+        new_rows = ~ids.isin(known_ids) & ~ids.isin(seen_ids) & ~ids.duplicated() & (chunk[TEXT_COLUMN].str.strip() != '')
+        seen_ids.update(ids)
+        chunk, ids = chunk[new_rows], ids[new_rows].tolist()
+
+        batches = chunk_to_batches(chunk, ids, batch_size)
+        for texts, vectors, (metadatas, batch_ids) in embed_batches(embeddings, batches, max_workers=max_workers,
+                                                                     **retry_options):
+            vector_store.add_embeddings(
+                text_embeddings=zip(texts, vectors),
+                metadatas=metadatas,
+                ids=batch_ids,
+            )
+            aggregates.add(metadatas)
+        rows_embedded += len(ids)
+        elapsed = time.time() - start_time
+        print(f"Read {rows_done} rows, embedded {rows_embedded} ({rows_done / max(elapsed, 1e-9):.0f} rows/s)")
+
+    if mode == 'upsert':
+        ids_to_delete = dict.fromkeys(known_ids - seen_ids)
+    ids_to_delete = list(ids_to_delete)
+    if ids_to_delete:
+        aggregates.remove(vector_store.docstore.search(i).metadata for i in ids_to_delete)
+        vector_store.delete(ids_to_delete)
+        print(f"Deleted {len(ids_to_delete)} complaints")
+    return vector_store, aggregates
+
+
+def ingest_csv(csv_path, store_path='complaints.vs', embeddings=None, chunk_size=5000,
+               batch_size=64, max_workers=8, checkpoint_every=10, resume=True, mode='build', ann_options=None,
+               max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """
+    Builds or updates the complaints vector store from a CSV file. The CSV is read in
+    chunks and each chunk is embedded in batches over a bounded thread pool, retrying
+    failed batches with backoff. Every complaint is keyed by a hash of its fields, so the
+    update modes only embed rows the store has not seen before.
+    In build mode the embedded rows are appended to part files on disk at every
+    checkpoint (see build_store), so memory stays flat and an interrupted build (e.g.
+    after throttling) resumes where it stopped. The metadata and lexical indexes and the
+    aggregates are rebuilt from the new store, and an approximate index, if requested or
+    already present, is (re)built from the exact one at the end.
+
+    Parameters:
+    csv_path (str): Path to the complaints CSV.
+    store_path (str): Folder the vector store is saved to.
+    embeddings: The embeddings instance. Defaults to Titan v2 on Bedrock.
+    chunk_size (int): Number of CSV rows read at a time.
+    batch_size (int): Number of texts per embedding call.
+    max_workers (int): Number of concurrent embedding calls.
+    checkpoint_every (int): In build mode, save the new rows and the checkpoint after this many chunks.
+    resume (bool): In build mode, continue from an existing checkpoint for the same CSV.
+    mode (str): One of MODES.
+    ann_options (dict): Keyword arguments for ann_index.build_ann_index (index_type, nlist,
+        nprobe, ...). If None, an existing approximate index is rebuilt with its saved settings.
+    max_retries (int): Retries of a failed embedding batch before the ingest fails.
+    base_delay (float): Initial backoff in seconds, doubled on every retry.
+    max_delay (float): Upper bound for a single backoff.
+
+    Returns:
+    ComplaintStore or FAISS: The built store (build mode) or the updated langchain store.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+    if embeddings is None:
+        embeddings = get_embeddings()
+    retry_options = {'max_retries': max_retries, 'base_delay': base_delay, 'max_delay': max_delay}
+
+    if mode == 'build':
+        build_store(csv_path, store_path, embeddings, chunk_size, batch_size, max_workers, checkpoint_every, resume,
+                    retry_options)
+        vector_store = ComplaintStore(store_path, read_index(os.path.join(store_path, INDEX_FILE)),
+                                      ColumnarDocstore.load(store_path), embeddings)
+        metadata_index = MetadataIndex.from_vector_store(vector_store)
+        aggregates = ComplaintAggregates.from_metadata_index(metadata_index)
+    else:
+        vector_store, aggregates = update_store(csv_path, store_path, embeddings, chunk_size, batch_size, max_workers,
+                                                mode, retry_options)
+        save_vector_store(vector_store, store_path)
+        metadata_index = MetadataIndex.from_vector_store(vector_store)
+        aggregates.fingerprint = metadata_index.fingerprint
+
+    metadata_index.save(store_path)
+    LexicalIndex.from_vector_store(vector_store).save(store_path)
+    aggregates.save(store_path)
+    if ann_options is not None:
+        ann_index.build_ann_index(store_path, **ann_options)
+    else:
+        ann_index.rebuild_ann_index(store_path)
+    return vector_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the complaints FAISS vector store from a CSV file.")
+    parser.add_argument('csv_path', nargs='?', help="CSV with the same columns as complaints_fake.csv")
+    parser.add_argument('--store-path', default='complaints.vs')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--checkpoint-every', type=int, default=10)
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help="Retries of a failed embedding batch (e.g. throttling) before giving up")
+    parser.add_argument('--base-delay', type=float, default=DEFAULT_BASE_DELAY,
+                        help="Initial retry backoff in seconds, doubled on every retry")
+    parser.add_argument('--max-delay', type=float, default=DEFAULT_MAX_DELAY, help="Longest single retry backoff in seconds")
+    parser.add_argument('--no-resume', action='store_true', help="Ignore any existing checkpoint and start from zero")
+    parser.add_argument('--mode', choices=MODES, default='build',
+                        help="build a new store, or append/upsert/delete rows against the existing one")
+    parser.add_argument('--convert', action='store_true',
+                        help="Only convert an existing store from index.pkl to the columnar docstore")
+    ann_group = parser.add_argument_group('approximate index', "Built next to the exact index and used by the RAG modules")
+    ann_group.add_argument('--index-type', choices=ann_index.INDEX_TYPES,
+                           help="Approximate index to build; flat removes it. Default: keep the current one")
+    ann_group.add_argument('--nlist', type=int, help="IVF clusters (default 4 * sqrt(n))")
+    ann_group.add_argument('--nprobe', type=int, default=ann_index.DEFAULT_NPROBE, help="IVF clusters searched per query")
+    ann_group.add_argument('--hnsw-m', type=int, default=ann_index.DEFAULT_HNSW_M, help="HNSW links per node")
+    ann_group.add_argument('--ef-construction', type=int, default=ann_index.DEFAULT_EF_CONSTRUCTION)
+    ann_group.add_argument('--ef-search', type=int, default=ann_index.DEFAULT_EF_SEARCH)
+    ann_group.add_argument('--pq-m', type=int, default=ann_index.DEFAULT_PQ_M, help="PQ code size in bytes per vector")
+    ann_group.add_argument('--train-size', type=int, help="Vectors sampled for IVF / PQ training")
+    ann_group.add_argument('--recall-k', type=int, default=10)
+    ann_group.add_argument('--recall-queries', type=int, default=200)
+    ann_group.add_argument('--ann-only', action='store_true',
+                           help="Only (re)build the approximate index of the existing store")
+    args = parser.parse_args()
+
+    ann_options = None
+    if args.index_type is not None:
+        ann_options = {
+            'index_type': args.index_type,
+            'nlist': args.nlist,
+            'nprobe': args.nprobe,
+            'hnsw_m': args.hnsw_m,
+            'ef_construction': args.ef_construction,
+            'ef_search': args.ef_search,
+            'pq_m': args.pq_m,
+            'train_size': args.train_size,
+            'recall_k': args.recall_k,
+            'recall_queries': args.recall_queries,
+        }
+
+    if args.convert:
+        convert_store(args.store_path)
+        return
+    if args.ann_only:
+        if ann_options is None:
+            parser.error("--ann-only needs --index-type")
+        ann_index.build_ann_index(args.store_path, **ann_options)
+        return
+    if args.csv_path is None:
+        parser.error("csv_path is required unless --convert or --ann-only is given")
+
+    ingest_csv(
+        args.csv_path,
+        store_path=args.store_path,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        max_workers=args.max_workers,
+        checkpoint_every=args.checkpoint_every,
+        resume=not args.no_resume,
+        mode=args.mode,
+        ann_options=ann_options,
+        max_retries=args.max_retries,
+        base_delay=args.base_delay,
+        max_delay=args.max_delay,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import re
+
+import numpy as np
+
+# Legal-form suffixes ignored when matching, so "Quantum Innovations" finds "Quantum Innovations Inc."
+COMPANY_SUFFIXES = {'inc', 'incorporated', 'ltd', 'limited', 'corp', 'corporation', 'co', 'company',
+                    'llc', 'plc', 'llp', 'lp', 'gmbh', 'ag', 'sa', 'bv', 'nv'}
+
+
+def normalise_name(name):
+    """
+    Lower-cases a company name, drops punctuation and legal-form suffixes.
+
+    Parameters:
+    name (str): The company name.
+
+    Returns:
+    str: The normalised name, e.g. 'quantum innovations'.
+    """
+    words = re.sub(r'[^a-z0-9]+', ' ', str(name).lower()).split()
+    while len(words) > 1 and words[-1] in COMPANY_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ClientNameIndex:
+    """
+    Trigram inverted index over the distinct client names, used for the "like" filters on
+    client_name. A lookup only touches the postings of the query's trigrams, so its cost
+    does not grow with the number of clients the way a per-name string distance does.
+    """
+
+    def __init__(self, names):
+        """
+        Parameters:
+        names (list): Distinct client names; a name's position is the code returned by lookup.
+        """
+        normalised = [normalise_name(name) for name in names]
+        self.exact = {}
+        for code, name in enumerate(normalised):
+            self.exact.setdefault(name, []).append(code)
+
+        postings = {}
+        self.trigram_counts = np.zeros(len(normalised), dtype=np.int32)
+        for code, name in enumerate(normalised):
+            name_trigrams = trigrams(name)
+            self.trigram_counts[code] = len(name_trigrams)
+            for trigram in name_trigrams:
+                postings.setdefault(trigram, []).append(code)
+        self.postings = {trigram: np.array(codes, dtype=np.int32) for trigram, codes in postings.items()}
+
+    def lookup(self, query, threshold=0.6):
+        """
+        Finds the client names matching a possibly mistyped or partial name.
+
+        A name matches when either the Dice similarity of the trigram sets, or the share
+        of the query's trigrams found in the name, reaches the threshold. An exact match
+        on the normalised name short-circuits the fuzzy search.
+
+        Parameters:
+        query (str): The name typed by the user, e.g. 'quantum inovations'.
+        threshold (float): Minimum similarity between 0 and 1.
+
+        Returns:
+        np.ndarray: Codes of the matching names, best match first.
+        """
+        normalised = normalise_name(query)
+        if normalised in self.exact:
+            return np.array(self.exact[normalised], dtype=np.int32)
+
+        query_trigrams = [trigram for trigram in trigrams(normalised) if trigram in self.postings]
+        if not query_trigrams or not normalised:
+            return np.array([], dtype=np.int32)
+
+        shared = np.bincount(
+            np.concatenate([self.postings[trigram] for trigram in query_trigrams]),
+            minlength=len(self.trigram_counts),
+        )
+        candidates = np.flatnonzero(shared)
+        shared = shared[candidates]
+        query_count = len(trigrams(normalised))
+        dice = 2 * shared / (query_count + self.trigram_counts[candidates])
+        containment = shared / query_count
+        scores = np.maximum(dice, containment)
+
+        keep = scores >= threshold
+        codes, scores = candidates[keep], scores[keep]
+        return codes[np.argsort(-scores, kind='stable')].astype(np.int32)
@@ -0,0 +1,397 @@
+import hashlib
+import json
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from aggregates import ComplaintAggregates
+from bedrock_client import get_bedrock_client
+from metadata_index import CATEGORY_COLUMNS, DATE_COLUMN, MetadataIndex
+
+# Default vector store folder, relative to the working directory
+STORE_PATH = 'complaints.vs'
+
+# FAISS index file (same name langchain's save_local uses)
+INDEX_FILE = 'index.faiss'
+
+# Folder inside the vector store holding the columnar docstore
+DOCSTORE_DIR = 'docstore'
+
+# Docstore id of each complaint, followed by the document columns
+ID_COLUMN = 'id'
+TEXT_COLUMN = 'complaint_text'
+DOCUMENT_COLUMNS = CATEGORY_COLUMNS + [DATE_COLUMN, TEXT_COLUMN]
+
+QUERY_EMBEDDING_MODEL = "amazon.titan-embed-text-v2:0"
+
+# Written into the docstore folder: fingerprints of the index and ids it was saved with
+STORE_FINGERPRINT_FILE = 'fingerprint.json'
+
+# Vectors sampled into the fingerprint of a FAISS index
+INDEX_FINGERPRINT_SAMPLES = 64
+
+
+def replace_file(path, write):
+    """
+    Writes a file through a temporary file and renames it into place. Processes that
+    have the old file memory-mapped keep reading the old contents instead of crashing
+    on a truncated mapping.
+    """
+    temp_path = f'{path}.tmp'
+    write(temp_path)
+    os.replace(temp_path, path)
+
+
+def save_array(path, array):
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            np.save(f, array)
+    replace_file(path, write)
+
+
+def write_index(index, index_path):
+    replace_file(index_path, lambda temp_path: faiss.write_index(index, temp_path))
+
+
+def read_index(index_path, mmap=True):
+    """
+    Reads a FAISS index, memory-mapping it rather than copying it into memory when mmap
+    is set. The mapping is read-only, so processes opening the same file share its pages.
+    IVF indexes map their inverted lists (IO_FLAG_MMAP); the others map their flat
+    vectors (IO_FLAG_MMAP_IFC, newer faiss). The two flags cannot be combined.
+    """
+    if not mmap:
+        return faiss.read_index(index_path)
+    with open(index_path, 'rb') as f:
+        fourcc = f.read(4)
+    if fourcc.startswith(b'Iw'):
+        flags = faiss.IO_FLAG_MMAP
+    else:
+        flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+    return faiss.read_index(index_path, flags | faiss.IO_FLAG_READ_ONLY)
+
+
+def id_fingerprint(offsets, data):
+    """
+    Fingerprint of a docstore id column (see ColumnarDocstore.encode_column). Complaint
+    ids are hashes of their fields, so stores with the same fingerprint hold the same
+    complaints at the same positions. The side indexes (metadata, lexical, aggregates,
+    approximate index) record it to tell when they belong to another version of the store.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(offsets, dtype=np.int64))
+    digest.update(np.ascontiguousarray(data, dtype=np.uint8))
+    return digest.hexdigest()
+
+
+def store_fingerprint(vector_store):
+    """
+    Returns:
+    str: The id_fingerprint of a ComplaintStore or langchain FAISS vector store.
+    """
+    if hasattr(vector_store.docstore, 'fingerprint'):
+        return vector_store.docstore.fingerprint()
+    ids = [vector_store.index_to_docstore_id[position] for position in range(vector_store.index.ntotal)]
+    return id_fingerprint(*ColumnarDocstore.encode_column(ids))
+
+
+def index_fingerprint(index):
+    """
+    Fingerprint of a flat FAISS index from its size and a sample of its vectors (hashing
+    every vector would read the whole memory-mapped file on each load).
+    """
+    digest = hashlib.blake2b(f'{index.ntotal},{index.d}'.encode(), digest_size=16)
+    sample = np.linspace(0, index.ntotal - 1, min(index.ntotal, INDEX_FINGERPRINT_SAMPLES))
+    for position in np.unique(sample.astype(np.int64)):
+        digest.update(np.ascontiguousarray(index.reconstruct(int(position)), dtype=np.float32))
+    return digest.hexdigest()
+
+
+class ColumnarDocstore:
+    """
+    On-disk docstore holding each column as one UTF-8 byte array plus an offsets array,
+    aligned with the FAISS index positions. Both arrays are saved as .npy files and
+    memory-mapped when loaded, so opening the store is instant and only the rows that
+    are actually read get paged in.
+    """
+
+    def __init__(self, columns):
+        """
+        Parameters:
+        columns (dict): Column name -> (offsets, data), where offsets is an int64 array of
+            length n + 1 and row i is data[offsets[i]:offsets[i + 1]].
+        """
+        self.columns = columns
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.columns[ID_COLUMN][0]) - 1
+
+    def fingerprint(self):
+        """
+        Returns:
+        str: The id_fingerprint of the id column, computed on first use.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = id_fingerprint(*self.columns[ID_COLUMN])
+        return self._fingerprint
+
+    @staticmethod
+    def encode_column(values):
+        """
+        Encodes a list of strings (None / NaN become '') into (offsets, data) arrays.
+        """
+        encoded = [value.encode('utf-8') if isinstance(value, str) else b'' for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return offsets, data
+
+    @classmethod
+    def from_columns(cls, ids, columns):
+        """
+        Parameters:
+        ids (list): Docstore id of each complaint, in FAISS position order.
+        columns (dict): Column name -> list of values, for DOCUMENT_COLUMNS.
+
+        Returns:
+        ColumnarDocstore: The in-memory docstore.
+        """
+        encoded = {ID_COLUMN: cls.encode_column(ids)}
+        for column in DOCUMENT_COLUMNS:
+            encoded[column] = cls.encode_column(columns[column])
+        return cls(encoded)
+
+    @classmethod
+    def from_vector_store(cls, vector_store):
+        """
+        Converts the docstore of a langchain FAISS vector store.
+
+        Parameters:
+        vector_store (FAISS): The vector store.
+
+        Returns:
+        ColumnarDocstore: The in-memory docstore.
+        """
+        ids = [vector_store.index_to_docstore_id[position] for position in range(vector_store.index.ntotal)]
+        docs = [vector_store.docstore.search(doc_id) for doc_id in ids]
+        columns = {column: [doc.metadata.get(column) for doc in docs] for column in CATEGORY_COLUMNS + [DATE_COLUMN]}
+        columns[TEXT_COLUMN] = [doc.page_content for doc in docs]
+        return cls.from_columns(ids, columns)
+
+    @classmethod
+    def concat(cls, docstores):
+        """
+        Joins docstores end to end, e.g. the parts of a build (see build_vector_store).
+
+        Returns:
+        ColumnarDocstore: The in-memory docstore, rows in the order of docstores.
+        """
+        columns = {}
+        for column in docstores[0].columns:
+            offsets, data, shift = [np.zeros(1, dtype=np.int64)], [], 0
+            for docstore in docstores:
+                part_offsets, part_data = docstore.columns[column]
+                offsets.append(np.asarray(part_offsets[1:], dtype=np.int64) + shift)
+                data.append(np.asarray(part_data, dtype=np.uint8))
+                shift += int(part_offsets[-1])
+            columns[column] = (np.concatenate(offsets), np.concatenate(data))
+        return cls(columns)
+
+    def save(self, store_path, index):
+        """
+        Saves the columns, then the fingerprints of the ids and of the index they were
+        saved with, which ComplaintStore.load checks.
+        """
+        docstore_path = os.path.join(store_path, DOCSTORE_DIR)
+        os.makedirs(docstore_path, exist_ok=True)
+        for column, (offsets, data) in self.columns.items():
+            save_array(os.path.join(docstore_path, f'{column}.offsets.npy'), offsets)
+            save_array(os.path.join(docstore_path, f'{column}.data.npy'), data)
+
+        fingerprints = {'ids': self.fingerprint(), 'index': index_fingerprint(index)}
+        def write_fingerprints(temp_path):
+            with open(temp_path, 'w') as f:
+                json.dump(fingerprints, f)
+        replace_file(os.path.join(docstore_path, STORE_FINGERPRINT_FILE), write_fingerprints)
+
+    @staticmethod
+    def saved_fingerprints(store_path):
+        """
+        Returns:
+        dict: {'ids', 'index'} fingerprints written by save, or None for stores saved
+        before fingerprints were recorded.
+        """
+        fingerprint_path = os.path.join(store_path, DOCSTORE_DIR, STORE_FINGERPRINT_FILE)
+        if not os.path.exists(fingerprint_path):
+            return None
+        with open(fingerprint_path) as f:
+            return json.load(f)
+
+    @classmethod
+    def load(cls, store_path, mmap=True):
+        docstore_path = os.path.join(store_path, DOCSTORE_DIR)
+        mmap_mode = 'r' if mmap else None
+        columns = {}
+        for column in [ID_COLUMN] + DOCUMENT_COLUMNS:
+            offsets = np.load(os.path.join(docstore_path, f'{column}.offsets.npy'), mmap_mode=mmap_mode)
+            data_path = os.path.join(docstore_path, f'{column}.data.npy')
+            try:
+                data = np.load(data_path, mmap_mode=mmap_mode)
+            except ValueError:
+                # An all-empty column cannot be memory-mapped
+                data = np.load(data_path)
+            columns[column] = (offsets, data)
+        return cls(columns)
+
+    def get_columns(self, columns=None, positions=None):
+        """
+        Reads columns for a set of rows.
+
+        Parameters:
+        columns (list): Columns to read. Defaults to DOCUMENT_COLUMNS.
+        positions (np.ndarray): FAISS positions to read. Defaults to all rows.
+
+        Returns:
+        dict: Column name -> list of str, in the order of positions.
+        """
+        if positions is None:
+            positions = np.arange(len(self))
+        positions = np.asarray(positions, dtype=np.int64)
+        result = {}
+        for column in columns or DOCUMENT_COLUMNS:
+            offsets, data = self.columns[column]
+            starts, ends = offsets[positions], offsets[positions + 1]
+            result[column] = [data[start:end].tobytes().decode('utf-8') for start, end in zip(starts, ends)]
+        return result
+
+
+class ComplaintStore:
+    """
+    Read-only, query-time view of a complaints vector store folder: the FAISS index
+    memory-mapped from index.faiss (plus the approximate index, if one was built, see
+    ann_index) and the columnar docstore. Exposes index,
+    embedding_function and _normalize_L2 like the langchain FAISS store, so the retrieval
+    functions can embed and search the same way. The metadata index, aggregates and
+    lexical index are loaded the first time they are used.
+    """
+
+    def __init__(self, store_path, index, docstore, embedding_function=None, ann_index=None, ann_config=None):
+        """
+        Parameters:
+        store_path (str): The vector store folder.
+        index (faiss.Index): The exact FAISS index.
+        docstore (ColumnarDocstore): The docstore, aligned with the index positions.
+        embedding_function: Embeddings used for queries. Defaults to get_query_embeddings().
+        ann_index (faiss.Index): Optional approximate index over the same positions.
+        ann_config (dict): Settings of the approximate index (see ann_index.build_ann_index).
+        """
+        self.store_path = store_path
+        # index is what unfiltered queries search; flat_index is always the exact one
+        self.index = ann_index if ann_index is not None else index
+        self.flat_index = index
+        self.ann_config = ann_config if ann_index is not None else None
+        self.docstore = docstore
+        self._embedding_function = embedding_function
+        self._normalize_L2 = False
+        self._metadata_index = None
+        self._aggregates = None
+        self._lexical_index = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, store_path=STORE_PATH, embedding_function=None, mmap=True):
+        """
+        Opens a vector store folder written by build_vector_store.
+
+        Parameters:
+        store_path (str): The vector store folder.
+        embedding_function: Embeddings used for queries. Defaults to get_query_embeddings().
+        mmap (bool): Memory-map the index and docstore rather than reading them into memory.
+
+        Returns:
+        ComplaintStore: The store.
+        """
+        # Imported here because ann_index uses the index helpers of this module
+        from ann_index import load_ann_index
+
+        index = read_index(os.path.join(store_path, INDEX_FILE), mmap=mmap)
+        docstore = ColumnarDocstore.load(store_path, mmap=mmap)
+        if len(docstore) != index.ntotal:
+            raise ValueError(f"{store_path} docstore has {len(docstore)} rows but the index has {index.ntotal}")
+        fingerprints = ColumnarDocstore.saved_fingerprints(store_path)
+        if fingerprints is not None and (fingerprints['ids'] != docstore.fingerprint()
+                                         or fingerprints['index'] != index_fingerprint(index)):
+            raise ValueError(f"{store_path} docstore and index were not saved together; rebuild the store")
+        ann_index, ann_config = load_ann_index(store_path, docstore.fingerprint(), mmap=mmap)
+        return cls(store_path, index, docstore, embedding_function, ann_index, ann_config)
+
+    @property
+    def embedding_function(self):
+        if self._embedding_function is None:
+            self._embedding_function = get_query_embeddings()
+        return self._embedding_function
+
+    @property
+    def metadata_index(self):
+        if self._metadata_index is None:
+            with self._lock:
+                if self._metadata_index is None:
+                    self._metadata_index = MetadataIndex.load_or_build(self, self.store_path)
+        return self._metadata_index
+
+    @property
+    def aggregates(self):
+        if self._aggregates is None:
+            metadata_index = self.metadata_index
+            with self._lock:
+                if self._aggregates is None:
+                    self._aggregates = ComplaintAggregates.load_or_build(metadata_index, self.store_path)
+        return self._aggregates
+
+    @property
+    def lexical_index(self):
+        if self._lexical_index is None:
+            # Imported here because lexical_index uses the file helpers of this module
+            from lexical_index import LexicalIndex
+            with self._lock:
+                if self._lexical_index is None:
+                    self._lexical_index = LexicalIndex.load_or_build(self, self.store_path)
+        return self._lexical_index
+
+
+_embeddings = None
+_stores = {}
+_lock = threading.Lock()
+
+
+def get_query_embeddings():
+    """
+    Returns the process-wide query embeddings (Titan v2 behind the embedding cache),
+    creating them and the Bedrock client on first use.
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                # Imported here so importing the RAG modules does not pay for langchain
+                from langchain.embeddings import BedrockEmbeddings
+                from embedding_cache import CachedEmbeddings
+                _embeddings = CachedEmbeddings(BedrockEmbeddings(
+                    client=get_bedrock_client(),
+                    model_id=QUERY_EMBEDDING_MODEL
+                ))
+    return _embeddings
+
+
+def get_complaint_store(store_path=STORE_PATH):
+    """
+    Returns the process-wide ComplaintStore for store_path, opening it on first use.
+    """
+    if store_path not in _stores:
+        with _lock:
+            if store_path not in _stores:
+                _stores[store_path] = ComplaintStore.load(store_path)
+    return _stores[store_path]
@@ -0,0 +1,133 @@
+import math
+import re
+
+import pandas as pd
+
+TEXT_COLUMN = 'complaint_text'
+
+# Default token budget for the <context> block of the RAG prompt
+DEFAULT_MAX_TOKENS = 6000
+
+# Metadata columns are only sent when the query mentions one of their keywords
+COLUMN_KEYWORDS = {
+    'client_name': r'client|company|companies|customer|name|who|which',
+    'client_region': r'region|\bmc\b|\blc\b|\bicb\b|corporate|segment',
+    'theme': r'theme|topic|categor|type|kind|area|issue',
+    'complaint_date': r'date|when|day|week|month|year|quarter|trend|recent|latest|oldest|time|since|before|after',
+}
+
+
+def estimate_tokens(text):
+    """
+    Rough token count for Nova/Titan style tokenisers (about 4 characters per token).
+    """
+    return math.ceil(len(text) / 4)
+
+
+def row_tokens(context_df, columns):
+    """
+    Token count of each row as pack_context writes it: the values of columns joined by
+    commas, plus one for the line break.
+
+    Returns:
+    list: One count per row, in row order.
+    """
+    return [estimate_tokens(','.join(map(str, row))) + 1 for row in context_df[columns].itertuples(index=False)]
+
+
+def shingles(text):
+    words = re.findall(r'[a-z0-9]+', str(text).lower())
+    if len(words) < 3:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def select_columns(context_df, user_prompt, keep_columns=None):
+    """
+    Picks the columns the query needs: complaint_text plus any metadata column the query
+    refers to (or that is listed in keep_columns).
+    """
+    prompt = str(user_prompt).lower()
+    columns = []
+    for column in context_df.columns:
+        if column == TEXT_COLUMN or (keep_columns and column in keep_columns):
+            columns.append(column)
+        elif column in COLUMN_KEYWORDS and re.search(COLUMN_KEYWORDS[column], prompt):
+            columns.append(column)
+    return columns
+
+
+def pack_context(context_df, user_prompt, max_tokens=DEFAULT_MAX_TOKENS, dedupe_threshold=0.8, keep_columns=None):
+    """
+    Assembles the context for the RAG prompt within a token budget.
+
+    Rows are taken in retrieval order (best score first), near-duplicate complaints are
+    collapsed into the first occurrence with a count of similar complaints, columns the
+    query does not need are dropped, and columns with a single value across the kept
+    rows are written once above the table instead of on every row.
+
+    Parameters:
+    context_df (pd.DataFrame): The retrieved complaints, as returned by getContext.
+    user_prompt (str): The user's query, used to decide which columns to keep.
+    max_tokens (int): Token budget for the packed context.
+    dedupe_threshold (float): Word-shingle Jaccard similarity at which two complaints
+        count as near duplicates.
+    keep_columns (list): Metadata columns to always keep.
+
+    Returns:
+    tuple: (context text, stats dict with rows/tokens before and after packing).
+    """
+    stats = {
+        'rows_in': len(context_df),
+        'rows_out': 0,
+        'duplicates_collapsed': 0,
+        'tokens_before': estimate_tokens(context_df.to_csv(index=False)),
+    }
+    if 'score' in context_df.columns:
+        context_df = context_df.sort_values('score', kind='stable')
+    columns = select_columns(context_df, user_prompt, keep_columns)
+    context_df = context_df[columns]
+
+    kept_rows = []
+    kept_shingles = []
+    similar_counts = []
+    used_tokens = 0
+    truncated = False
+    for row, tokens in zip(context_df.itertuples(index=False), row_tokens(context_df, columns)):
+        row_shingles = shingles(getattr(row, TEXT_COLUMN, ''))
+        duplicate_of = None
+        for i, other in enumerate(kept_shingles):
+            overlap = len(row_shingles & other) / max(len(row_shingles | other), 1)
+            if overlap >= dedupe_threshold:
+                duplicate_of = i
+                break
+        if duplicate_of is not None:
+            similar_counts[duplicate_of] += 1
+            stats['duplicates_collapsed'] += 1
+            continue
+
+        if kept_rows and used_tokens + tokens > max_tokens:
+            truncated = True
+            break
+        kept_rows.append(row)
+        kept_shingles.append(row_shingles)
+        similar_counts.append(0)
+        used_tokens += tokens
+
+    packed_df = pd.DataFrame(kept_rows, columns=columns)
+    if any(similar_counts):
+        packed_df['similar_complaints'] = similar_counts
+
+    header = []
+    if len(packed_df) > 1:
+        for column in columns:
+            if column != TEXT_COLUMN and packed_df[column].nunique(dropna=False) == 1:
+                header.append(f"{column}: {packed_df[column].iloc[0]} (all rows)")
+                packed_df = packed_df.drop(columns=column)
+
+    context = '\n'.join(header + [packed_df.to_csv(index=False)]) if len(packed_df) else ''
+    stats['rows_out'] = len(packed_df)
+    stats['tokens_after'] = estimate_tokens(context)
+    stats['tokens_saved'] = stats['tokens_before'] - stats['tokens_after']
+    stats['truncated'] = truncated
+    return context, stats
@@ -0,0 +1,195 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Default location of the persistent cache, relative to the working directory
+DEFAULT_CACHE_PATH = 'embedding_cache.db'
+
+# Last-access times of cache hits are kept in memory and written in batches of this size
+ACCESS_FLUSH_SIZE = 256
+
+
+def normalise_text(text):
+    """
+    Normalises text for cache lookups: case-folded with whitespace collapsed, so
+    "Summarise  the complaints" and "summarise the complaints" share an entry.
+    """
+    return ' '.join(str(text).split()).casefold()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings instance with a two-tier cache: a bounded in-process LRU in front
+    of a persistent SQLite store. Entries are keyed by model id and normalised text, so
+    repeated queries skip the Bedrock call entirely, including across restarts.
+    Hits only record their access time in memory; the times are written to disk in
+    batches (and before evicting), so lookups do not wait on a commit. The cache is best
+    effort: a SQLite error is reported and the embedding is returned uncached.
+    """
+
+    def __init__(self, embeddings, model_id=None, cache_path=DEFAULT_CACHE_PATH,
+                 max_memory_entries=1024, max_disk_entries=100000):
+        """
+        Parameters:
+        embeddings: The embeddings instance to wrap (e.g. BedrockEmbeddings).
+        model_id (str): Model id used in the cache key. Defaults to embeddings.model_id.
+        cache_path (str): SQLite file for the persistent tier, or None for memory only.
+        max_memory_entries (int): Size of the in-process LRU.
+        max_disk_entries (int): Maximum entries kept on disk; least recently used are evicted.
+        """
+        self.embeddings = embeddings
+        self.model_id = model_id or getattr(embeddings, 'model_id', type(embeddings).__name__)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._accessed = {}
+        self._lock = threading.Lock()
+
+        self._db = None
+        if cache_path:
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+            self._db.commit()
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text):
+        return hashlib.sha256(f'{self.model_id}\x00{normalise_text(text)}'.encode('utf-8')).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self._touch(key)
+                return self._memory[key]
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error as e:
+                    print(f"Embedding cache read failed ({e!r})")
+                    row = None
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    self._touch(key)
+                    return vector
+            self.misses += 1
+            return None
+
+    def _touch(self, key):
+        # Caller holds the lock
+        if self._db is None:
+            return
+        self._accessed[key] = time.time()
+        if len(self._accessed) >= ACCESS_FLUSH_SIZE:
+            self._write(self._flush_accesses)
+
+    def _flush_accesses(self):
+        if self._accessed:
+            self._db.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                 [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def _write(self, write):
+        """
+        Runs write on the database and commits, or rolls back and reports a failure
+        without raising: the cache must never fail the query that uses it.
+        """
+        try:
+            write()
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Embedding cache write failed ({e!r})")
+            self._accessed.clear()
+            try:
+                self._db.rollback()
+                self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            except sqlite3.Error:
+                pass
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _put(self, key, vector):
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is None:
+                return
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+
+            def write():
+                inserted = self._db.execute(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                    (key, blob, time.time()),
+                ).rowcount
+                if self._disk_count + inserted > self.max_disk_entries:
+                    # Evict by the latest access times, including the ones not yet written
+                    self._flush_accesses()
+                    self._db.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                        (self._disk_count + inserted - self.max_disk_entries,),
+                    )
+                    self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                else:
+                    self._disk_count += inserted
+            self._write(write)
+
+    def flush(self):
+        """
+        Writes the pending last-access times to disk.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._write(self._flush_accesses)
+
+    def embed_query(self, text):
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._put(key, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        vectors = [self._get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                self._put(keys[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def stats(self):
+        """
+        Returns:
+        dict: Hit/miss counters and current sizes of both tiers.
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_entries': self._disk_count if self._db is not None else 0,
+            }
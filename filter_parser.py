@@ -0,0 +1,262 @@
+import calendar
+import re
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from client_name_index import normalise_name
+from embedding_cache import normalise_text
+
+DEFAULT_K = 100
+
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+MONTHS['sept'] = 9
+MONTH_PATTERN = '|'.join(sorted(MONTHS, key=len, reverse=True))
+
+# Region codes and the long names users type for them
+REGIONS = {
+    'mc': 'MC', 'mid corporate': 'MC', 'mid-corporate': 'MC',
+    'lc': 'LC', 'large corporate': 'LC', 'large-corporate': 'LC',
+    'icb': 'ICB', 'international corporate': 'ICB', 'international-corporate': 'ICB',
+}
+REGION_PATTERN = re.compile(r'\b(' + '|'.join(sorted(map(re.escape, REGIONS), key=len, reverse=True)) + r')\b')
+
+DATE_PATTERN = (
+    r'(?:\d{4}-\d{1,2}-\d{1,2}'
+    r'|\d{1,2}(?:st|nd|rd|th)?\s+(?:of\s+)?(?:' + MONTH_PATTERN + r')\.?,?\s+\d{4}'
+    r'|(?:' + MONTH_PATTERN + r')\.?\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4}'
+    r'|\d{1,2}/\d{1,2}/\d{4})'
+)
+DATE_RANGE_PATTERN = re.compile(
+    r'\b(?:between|from)\s+(' + DATE_PATTERN + r')\s+(?:and|to|until|till)\s+(' + DATE_PATTERN + r')'
+)
+DATE_CONDITION_PATTERN = re.compile(
+    r'\b(?:(after|since|from|before|prior to|until|till|on|up to)\s+)?(' + DATE_PATTERN + r')'
+)
+MONTH_YEAR_PATTERN = re.compile(r'\b(?:in|during)\s+(' + MONTH_PATTERN + r')\.?\s+(\d{4})\b')
+YEAR_PATTERN = re.compile(r'\b(?:in|during)\s+(\d{4})(?![-/\d])')
+DATE_PREFIXES = {None: '', 'on': '', 'after': '>', 'since': '>=', 'from': '>=',
+                 'before': '<', 'prior to': '<', 'until': '<=', 'till': '<=', 'up to': '<='}
+
+# A count, but not a year such as "2024 complaints", which is left for the LLM
+COUNT_NUMBER = r'(?!(?:19|20)\d\d\b)\d+'
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+                'eight': 8, 'nine': 9, 'ten': 10, 'twenty': 20, 'fifty': 50, 'hundred': 100}
+COUNT_PATTERN = re.compile(
+    r'\b(?:(?:show|give|list|find|get|return|fetch|pull)(?:\s+me)?\s+(?:the\s+)?(?:top\s+|first\s+|last\s+)?'
+    r'|top\s+)(' + COUNT_NUMBER + '|' + '|'.join(NUMBER_WORDS) + r')\b'
+    r'|\b(' + COUNT_NUMBER + '|' + '|'.join(NUMBER_WORDS) + r')\s+(?:complaints?|records?|examples?|rows?|results?)\b'
+)
+
+# Words left over after parsing that suggest a filter the rules did not understand
+UNRESOLVED_PATTERN = re.compile(
+    r'\b(?:' + MONTH_PATTERN + r')\b|\d'
+    r'|\b(?:after|before|since|until|till|between|prior|dated?|year|month|week|quarter|today|yesterday'
+    r'|recent|latest|oldest|newest|client|clients|company|companies)\b'
+    # Negations: the rules would return exactly the rows the user excluded
+    r'|\b(?:not|except|excluding|exclude|other\s+than|outside|apart\s+from)\b'
+)
+
+STOPWORDS = {'a', 'an', 'the', 'me', 'all', 'show', 'give', 'list', 'find', 'get', 'about', 'for', 'from',
+             'of', 'in', 'on', 'and', 'or', 'with', 'by', 'to', 'complaint', 'complaints', 'what', 'are',
+             'is', 'summarise', 'summarize', 'any', 'there', 'we', 'have', 'has', 'our', 'their'}
+
+
+def parse_date(text):
+    """
+    Parses the date formats matched by DATE_PATTERN (day/month order is UK style).
+
+    Returns:
+    str: The date as 'YYYY-MM-DD', or None if it is not a valid date.
+    """
+    text = re.sub(r'(\d)(st|nd|rd|th)\b', r'\1', text.lower()).replace(',', ' ').replace('.', ' ').replace(' of ', ' ')
+    try:
+        if re.fullmatch(r'\d{4}-\d{1,2}-\d{1,2}', text.strip()):
+            year, month, day = map(int, text.strip().split('-'))
+        elif '/' in text:
+            day, month, year = map(int, text.strip().split('/'))
+        else:
+            words = text.split()
+            if words[0].isdigit():
+                day, month, year = int(words[0]), MONTHS[words[1]], int(words[2])
+            else:
+                month, day, year = MONTHS[words[0]], int(words[1]), int(words[2])
+        return date(year, month, day).isoformat()
+    except (ValueError, KeyError, IndexError):
+        return None
+
+
+class FilterParser:
+    """
+    Deterministic parser for the common filter patterns in complaint queries: region
+    codes, explicit dates and date ranges, "show me N complaints" and known client names.
+    It returns None when the prompt contains something that looks like a filter it
+    could not parse, so the caller can fall back to the LLM.
+    """
+
+    def __init__(self, metadata_index=None, max_name_words=6, name_threshold=0.75):
+        """
+        Parameters:
+        metadata_index (MetadataIndex): Used to recognise client names. Optional.
+        max_name_words (int): Longest client name (in words) looked for in a prompt.
+        name_threshold (float): Similarity above which an unrecognised phrase is treated
+            as a possibly mistyped client name (and the parser defers to the LLM).
+        """
+        self.metadata_index = metadata_index
+        self.max_name_words = max_name_words
+        self.name_threshold = name_threshold
+
+    def _client_names(self, text, consumed):
+        if self.metadata_index is None:
+            return []
+        name_index = self.metadata_index.fuzzy_index('client_name')
+        names = self.metadata_index.categories['client_name']
+        tokens = list(re.finditer(r'[a-z0-9]+', text))
+        used = [any(start <= token.start() < end for start, end in consumed) for token in tokens]
+        found = []
+        for size in range(min(self.max_name_words, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                if any(used[start:start + size]):
+                    continue
+                window = ' '.join(token.group() for token in tokens[start:start + size])
+                if window in STOPWORDS:
+                    continue
+                codes = name_index.exact.get(normalise_name(window))
+                if codes:
+                    used[start:start + size] = [True] * size
+                    consumed.append((tokens[start].start(), tokens[start + size - 1].end()))
+                    found.extend(names[code] for code in codes)
+        return found
+
+    def _possible_name(self, leftover):
+        """
+        Checks whether leftover text contains a phrase close to a client name, e.g. a typo.
+        """
+        if self.metadata_index is None:
+            return False
+        name_index = self.metadata_index.fuzzy_index('client_name')
+        words = [word for word in re.findall(r'[a-z0-9]+', leftover) if word not in STOPWORDS]
+        for start in range(len(words)):
+            for size in (2, 1):
+                window = words[start:start + size]
+                if len(window) < size or (size == 1 and len(window[0]) < 5):
+                    continue
+                if len(name_index.lookup(' '.join(window), threshold=self.name_threshold)):
+                    return True
+        return False
+
+    def parse(self, user_prompt):
+        """
+        Parses the filters out of a prompt.
+
+        Parameters:
+        user_prompt (str): The user's query.
+
+        Returns:
+        dict: {'metadata_filter': {...}, 'k_filter': int}, or None if not confident.
+        """
+        return self.parse_with_leftover(user_prompt)[0]
+
+    def parse_with_leftover(self, user_prompt):
+        """
+        Same as parse, also returning the words of the prompt that are not part of a
+        filter or count (STOPWORDS dropped), e.g. the topic of the question.
+
+        Returns:
+        tuple: (filter terms or None, list of leftover words).
+        """
+        text = normalise_text(user_prompt)
+        consumed = []
+        metadata_filter = {}
+
+        dates = []
+        for match in DATE_RANGE_PATTERN.finditer(text):
+            start, end = parse_date(match.group(1)), parse_date(match.group(2))
+            if start is None or end is None:
+                return None, []
+            dates.append({'$gte': start, '$lte': end})
+            consumed.append(match.span())
+        for match in MONTH_YEAR_PATTERN.finditer(text):
+            year, month = int(match.group(2)), MONTHS[match.group(1)]
+            last_day = calendar.monthrange(year, month)[1]
+            dates.append({'$gte': date(year, month, 1).isoformat(), '$lte': date(year, month, last_day).isoformat()})
+            consumed.append(match.span())
+        for match in YEAR_PATTERN.finditer(text):
+            year = int(match.group(1))
+            dates.append({'$gte': f'{year}-01-01', '$lte': f'{year}-12-31'})
+            consumed.append(match.span())
+        for match in DATE_CONDITION_PATTERN.finditer(text):
+            if any(start <= match.start() < end for start, end in consumed):
+                continue
+            parsed = parse_date(match.group(2))
+            if parsed is None:
+                return None, []
+            dates.append(DATE_PREFIXES[match.group(1)] + parsed)
+            consumed.append(match.span())
+        if sum(isinstance(condition, dict) for condition in dates) > 1:
+            # Conditions in a list are combined with AND (except plain days), so "in may or
+            # in june" cannot be written as one; leave it to the LLM
+            return None, []
+        if dates:
+            metadata_filter['complaint_date'] = dates[0] if len(dates) == 1 else dates
+
+        k_filter = DEFAULT_K
+        for match in COUNT_PATTERN.finditer(text):
+            if any(start <= match.start() < end for start, end in consumed):
+                continue
+            number = match.group(1) or match.group(2)
+            k_filter = int(number) if number.isdigit() else NUMBER_WORDS[number]
+            consumed.append(match.span())
+            break
+
+        regions = []
+        for match in REGION_PATTERN.finditer(text):
+            region = REGIONS[match.group(1)]
+            if region not in regions:
+                regions.append(region)
+            consumed.append(match.span())
+        if regions:
+            metadata_filter['client_region'] = regions[0] if len(regions) == 1 else regions
+
+        client_names = self._client_names(text, consumed)
+        if client_names:
+            metadata_filter['client_name'] = client_names[0] if len(client_names) == 1 else client_names
+
+        leftover = text
+        for start, end in consumed:
+            leftover = leftover[:start] + ' ' * (end - start) + leftover[end:]
+        if client_names:
+            leftover = re.sub(r'\b(?:client|clients|company|companies)\b', ' ', leftover)
+        words = [word for word in re.findall(r'[a-z0-9]+', leftover) if word not in STOPWORDS]
+        if UNRESOLVED_PATTERN.search(leftover) or self._possible_name(leftover):
+            return None, words
+
+        return {'metadata_filter': metadata_filter, 'k_filter': k_filter}, words
+
+
+class FilterCache:
+    """
+    Thread-safe LRU cache of parsed filters keyed by the normalised prompt.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_prompt):
+        key = normalise_text(user_prompt)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, user_prompt, filter_terms):
+        key = normalise_text(user_prompt)
+        with self._lock:
+            self._entries[key] = filter_terms
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
@@ -0,0 +1,99 @@
+import re
+
+from filter_parser import DEFAULT_K
+from lexical_index import LexicalIndex, tokenize
+from metadata_index import CATEGORY_COLUMNS, DATE_COLUMN, MetadataIndex
+from retrieval import PHRASE_PATTERN
+
+# Prompts that refer back to the previous answer ("now only the MC ones", "summarise that",
+# "show me 5 of those") rather than asking a new question
+FOLLOW_UP_PATTERN = re.compile(
+    r'^\s*(?:now|then|and|also|only|just|ok|okay|so)\b'
+    r'|\b(?:those|these|them|ones|the same|the above|the previous|the last)\b'
+    r'|\b(?:summari[sz]e|explain|expand on|break down|tell me more about|more on)\s+(?:that|this|it)\b'
+)
+
+# Words that point at the previous complaints rather than at a new topic
+BACK_REFERENCE_PATTERN = re.compile(r'\b(?:those|these|them|ones|that|this|it|the same|the above|the previous|the last)\b')
+
+# Words of a follow-up that carry no topic ("now only the ones", "tell me more about that")
+FOLLOW_UP_WORDS = frozenset({
+    'now', 'then', 'also', 'only', 'just', 'ok', 'okay', 'so', 'those', 'these', 'them', 'ones', 'one',
+    'same', 'above', 'previous', 'last', 'that', 'this', 'it', 'explain', 'expand', 'break', 'down', 'tell',
+    'more', 'please', 'can', 'could', 'you', 'again', 'instead', 'but', 'region', 'regions',
+    'rows', 'results', 'records', 'examples', 'top', 'first', 'keep', 'filter', 'narrow',
+})
+
+
+def is_follow_up(user_prompt):
+    """
+    Checks whether a prompt refers back to the complaints of the previous answer.
+    """
+    return FOLLOW_UP_PATTERN.search(user_prompt.lower()) is not None
+
+
+def refers_back(user_prompt):
+    """
+    Checks whether a prompt points at the previous complaints ("those", "the ones") rather
+    than only opening with a follow-up word ("also show me ...").
+    """
+    return BACK_REFERENCE_PATTERN.search(user_prompt.lower()) is not None
+
+
+def follow_up_terms(leftover_words):
+    """
+    Returns the topic terms of a follow-up: the words the filter parser left over, minus
+    the words every follow-up uses. An empty list means the follow-up only changes the
+    filter or the count.
+    """
+    return [term for term in tokenize(' '.join(leftover_words)) if term not in FOLLOW_UP_WORDS]
+
+
+def merge_filters(previous_filter, metadata_filter):
+    """
+    Combines the filter of the previous retrieval with the conditions of a follow-up;
+    a follow-up condition on the same column replaces the previous one.
+    """
+    merged = dict(previous_filter or {})
+    merged.update(metadata_filter or {})
+    return merged
+
+
+def refine_context(context_df, user_prompt, filter_terms, terms=None):
+    """
+    Applies a follow-up to the previous context locally instead of retrieving again: rows
+    are filtered by the follow-up's metadata conditions (same syntax and matching as
+    getContext, including fuzzy client names), by its quoted phrases, and cut to its
+    count if it asks for one. The retrieval order is kept, unless the follow-up names a
+    topic: then only the rows mentioning its terms are kept, ranked by BM25 (the score
+    column becomes the negated BM25 score, so lower is still better).
+
+    Parameters:
+    context_df (pd.DataFrame): The complaints retrieved for the previous prompt.
+    user_prompt (str): The follow-up prompt.
+    filter_terms (dict): {'metadata_filter': {...}, 'k_filter': int} parsed from the follow-up.
+    terms (list): Topic terms of the follow-up, see follow_up_terms.
+
+    Returns:
+    pd.DataFrame: The refined complaints (possibly empty).
+    """
+    refined = context_df
+    metadata_filter = filter_terms.get('metadata_filter')
+    if metadata_filter and len(refined):
+        records = refined[CATEGORY_COLUMNS + [DATE_COLUMN]].to_dict('records')
+        refined = refined.iloc[MetadataIndex.from_records(records).resolve(metadata_filter)]
+
+    phrases = [' '.join(tokenize(first or second)) for first, second in PHRASE_PATTERN.findall(user_prompt)]
+    phrases = [phrase for phrase in phrases if phrase]
+    if phrases and len(refined):
+        texts = refined['complaint_text'].map(lambda text: f" {' '.join(tokenize(text))} ")
+        refined = refined[texts.map(lambda text: all(f' {phrase} ' in text for phrase in phrases)).to_numpy(dtype=bool)]
+
+    if terms and len(refined):
+        positions, scores = LexicalIndex.from_texts(refined['complaint_text']).search(terms, k=None)
+        refined = refined.iloc[positions].copy()
+        refined['score'] = -scores
+
+    if filter_terms.get('k_filter', DEFAULT_K) != DEFAULT_K:
+        refined = refined.head(int(filter_terms['k_filter']))
+    return refined.reset_index(drop=True)
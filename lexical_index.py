@@ -0,0 +1,247 @@
+import array
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from complaint_store import TEXT_COLUMN, replace_file, save_array, store_fingerprint
+
+# Folder inside the vector store holding the inverted index over complaint_text
+LEXICAL_INDEX_DIR = 'lexical_index'
+VOCABULARY_FILE = 'vocabulary.txt'
+FINGERPRINT_FILE = 'fingerprint.txt'
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Words too common to help a keyword search
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'been', 'but', 'by', 'for', 'from', 'had', 'has', 'have',
+    'i', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'our', 's', 'that', 'the', 'their', 'this', 'to',
+    'was', 'we', 'were', 'which', 'with',
+})
+
+# Usual BM25 parameters: term frequency saturation and document length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Term frequencies are stored as uint16
+MAX_TERM_FREQUENCY = np.iinfo(np.uint16).max
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase alphanumeric terms, dropping STOPWORDS.
+
+    Returns:
+    list: The terms, in text order.
+    """
+    return [term for term in TOKEN_PATTERN.findall(str(text).lower()) if term not in STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    Inverted index over complaint_text, aligned with the FAISS index positions. The
+    postings of all terms are held in flat arrays (CSR layout: the postings of term t are
+    positions[term_offsets[t]:term_offsets[t + 1]], sorted, with their term frequencies),
+    saved as .npy files and memory-mapped when loaded. Keyword queries are scored with
+    BM25 without any embedding call.
+    """
+
+    def __init__(self, vocabulary, term_offsets, positions, term_frequencies, doc_lengths, fingerprint=None):
+        """
+        Parameters:
+        vocabulary (dict): Term -> term id.
+        term_offsets (np.ndarray): int64 array of length len(vocabulary) + 1.
+        positions (np.ndarray): int32 FAISS positions of the postings, grouped by term.
+        term_frequencies (np.ndarray): uint16 count of the term in each posting.
+        doc_lengths (np.ndarray): int32 number of terms of each complaint, one per FAISS position.
+        fingerprint (str): complaint_store.store_fingerprint of the store it was built from.
+        """
+        self.fingerprint = fingerprint
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.positions = positions
+        self.term_frequencies = term_frequencies
+        self.doc_lengths = doc_lengths
+        self.average_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @classmethod
+    def from_texts(cls, texts):
+        """
+        Builds the index from complaint texts listed in FAISS position order.
+
+        Parameters:
+        texts (iterable): One complaint_text per FAISS position.
+
+        Returns:
+        LexicalIndex: The built index.
+        """
+        vocabulary = {}
+        term_ids, doc_ids, frequencies, lengths = array.array('i'), array.array('i'), array.array('i'), array.array('i')
+        for position, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(position)
+                frequencies.append(count)
+
+        term_ids = np.frombuffer(term_ids, dtype=np.int32)
+        # Postings were added in position order, so a stable sort by term keeps each list sorted
+        order = np.argsort(term_ids, kind='stable')
+        term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=term_offsets[1:])
+        positions = np.frombuffer(doc_ids, dtype=np.int32)[order]
+        term_frequencies = np.minimum(np.frombuffer(frequencies, dtype=np.int32)[order], MAX_TERM_FREQUENCY)
+        return cls(vocabulary, term_offsets, positions, term_frequencies.astype(np.uint16),
+                   np.frombuffer(lengths, dtype=np.int32).copy())
+
+    @classmethod
+    def from_vector_store(cls, vector_store):
+        """
+        Builds the index from the docstore of a langchain FAISS vector store, or of a
+        ComplaintStore.
+
+        Parameters:
+        vector_store (FAISS or ComplaintStore): The vector store.
+
+        Returns:
+        LexicalIndex: The built index.
+        """
+        if hasattr(vector_store.docstore, 'get_columns'):
+            lexical_index = cls.from_texts(vector_store.docstore.get_columns([TEXT_COLUMN])[TEXT_COLUMN])
+        else:
+            lexical_index = cls.from_texts(
+                vector_store.docstore.search(vector_store.index_to_docstore_id[position]).page_content
+                for position in range(vector_store.index.ntotal)
+            )
+        lexical_index.fingerprint = store_fingerprint(vector_store)
+        return lexical_index
+
+    def save(self, store_path):
+        index_path = os.path.join(store_path, LEXICAL_INDEX_DIR)
+        os.makedirs(index_path, exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+
+        def write_vocabulary(temp_path):
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(terms))
+        replace_file(os.path.join(index_path, VOCABULARY_FILE), write_vocabulary)
+        for name in ('term_offsets', 'positions', 'term_frequencies', 'doc_lengths'):
+            save_array(os.path.join(index_path, f'{name}.npy'), getattr(self, name))
+
+        # Written last, so a stale fingerprint can only make the index be rebuilt
+        def write_fingerprint(temp_path):
+            with open(temp_path, 'w') as f:
+                f.write(self.fingerprint or '')
+        replace_file(os.path.join(index_path, FINGERPRINT_FILE), write_fingerprint)
+
+    @classmethod
+    def load(cls, store_path, mmap=True):
+        index_path = os.path.join(store_path, LEXICAL_INDEX_DIR)
+        with open(os.path.join(index_path, VOCABULARY_FILE), encoding='utf-8') as f:
+            text = f.read()
+        vocabulary = {term: term_id for term_id, term in enumerate(text.split('\n'))} if text else {}
+        fingerprint_path = os.path.join(index_path, FINGERPRINT_FILE)
+        fingerprint = None
+        if os.path.exists(fingerprint_path):
+            with open(fingerprint_path) as f:
+                fingerprint = f.read().strip() or None
+        arrays = {}
+        for name in ('term_offsets', 'positions', 'term_frequencies', 'doc_lengths'):
+            path = os.path.join(index_path, f'{name}.npy')
+            try:
+                arrays[name] = np.load(path, mmap_mode='r' if mmap else None)
+            except ValueError:
+                # An empty array cannot be memory-mapped
+                arrays[name] = np.load(path)
+        return cls(vocabulary, fingerprint=fingerprint, **arrays)
+
+    @classmethod
+    def load_or_build(cls, vector_store, store_path):
+        """
+        Loads the saved index for a vector store, rebuilding (and saving) it from the
+        docstore if it is missing or was built for other complaints (its fingerprint
+        differs from complaint_store.store_fingerprint).
+
+        Parameters:
+        vector_store (FAISS or ComplaintStore): The loaded vector store.
+        store_path (str): The vector store folder.
+
+        Returns:
+        LexicalIndex: The index.
+        """
+        if os.path.exists(os.path.join(store_path, LEXICAL_INDEX_DIR, VOCABULARY_FILE)):
+            lexical_index = cls.load(store_path)
+            if lexical_index.fingerprint == store_fingerprint(vector_store):
+                return lexical_index
+        lexical_index = cls.from_vector_store(vector_store)
+        try:
+            lexical_index.save(store_path)
+        except OSError:
+            pass
+        return lexical_index
+
+    def postings(self, term):
+        """
+        Returns:
+        tuple: (positions, term frequencies) of the complaints containing term.
+        """
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return np.array([], dtype=np.int32), np.array([], dtype=np.uint16)
+        start, stop = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        return self.positions[start:stop], self.term_frequencies[start:stop]
+
+    def search(self, terms, ids=None, k=100, required_terms=None):
+        """
+        Scores the complaints containing any of the terms with BM25.
+
+        Parameters:
+        terms (list): Query terms, see tokenize.
+        ids (np.ndarray): Sorted FAISS ids to search, from retrieval.resolve_filter, or None for all.
+        k (int): Number of complaints to return, or None for all matches.
+        required_terms (list): Terms every result must contain (e.g. the terms of a quoted phrase).
+
+        Returns:
+        tuple: (positions, scores) arrays, highest BM25 score first.
+        """
+        required_terms = set(required_terms or [])
+        query_terms = list(dict.fromkeys(list(terms) + sorted(required_terms)))
+        if any(term not in self.vocabulary for term in required_terms):
+            query_terms = []
+        all_positions, all_weights, all_required = [], [], []
+        for term in query_terms:
+            positions, frequencies = self.postings(term)
+            if not len(positions):
+                continue
+            idf = math.log(1 + (len(self) - len(positions) + 0.5) / (len(positions) + 0.5))
+            if ids is not None:
+                keep = np.isin(positions, ids, assume_unique=True)
+                positions, frequencies = positions[keep], frequencies[keep]
+            frequencies = frequencies.astype(np.float32)
+            lengths = self.doc_lengths[positions] / max(self.average_length, 1e-9)
+            weights = idf * frequencies * (BM25_K1 + 1) / (frequencies + BM25_K1 * (1 - BM25_B + BM25_B * lengths))
+            all_positions.append(positions)
+            all_weights.append(weights)
+            all_required.append(np.full(len(positions), term in required_terms))
+        if not all_positions:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        matched, inverse = np.unique(np.concatenate(all_positions), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_weights)).astype(np.float32)
+        if required_terms:
+            hits = np.bincount(inverse, weights=np.concatenate(all_required))
+            keep = hits == len(required_terms)
+            matched, scores = matched[keep], scores[keep]
+
+        if k is not None and k < len(matched):
+            top = np.argpartition(-scores, k - 1)[:k]
+            matched, scores = matched[top], scores[top]
+        order = np.lexsort((matched, -scores))
+        return matched[order].astype(np.int64), scores[order]
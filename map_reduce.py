@@ -0,0 +1,175 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from context_packer import pack_context, row_tokens, select_columns
+from tracing import tracer
+
+# Token budget of each shard's context in the map step
+DEFAULT_SHARD_TOKENS = 4000
+
+# Number of shard / merge calls in flight at once
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Number of partial summaries merged by a single reduce call
+DEFAULT_FAN_IN = 4
+
+# Share of the retrieved rows pack_context must drop before the context is summarised with
+# map-reduce; below it the truncated context is answered in one call
+MIN_DROPPED_SHARE = 0.5
+
+MAP_SYSTEM_MESSAGE = """
+    System: You are an AI assistant in a corporate bank. You are given one part of a larger set of complaints.
+    Summarise only what in this part is relevant to the user's query: the key issues, the clients, regions and themes affected,
+    and how many complaints mention each issue. Be concise and do not speculate beyond the complaints given.
+    Human: Here is the part of the complaints, contained in <context> tags:
+
+    <context>
+    {context}
+    </context>
+    """
+
+REDUCE_SYSTEM_MESSAGE = """
+    System: You are an AI assistant in a corporate bank. You are given partial summaries, each covering a different part of a set of complaints.
+    Merge them into a single summary relevant to the user's query. Add up the counts for the same issue across summaries and keep the key details.
+    Human: Here are the partial summaries, contained in <summaries> tags:
+
+    <summaries>
+    {summaries}
+    </summaries>
+    """
+
+FINAL_SYSTEM_MESSAGE = """
+    System: You are an AI assistant in a corporate bank and your job is to answer the users query around complaints.
+    The complaints were too many to read at once, so they were summarised in parts. Answer using only these summaries.
+    Human: Here are the summaries, contained in <summaries> tags:
+
+    <summaries>
+    {summaries}
+    </summaries>
+
+     If you don't know the answer, just say that you don't know, don't try to make up an answer.
+    """
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing calls at least 1 / requests_per_second seconds apart.
+    """
+
+    def __init__(self, requests_per_second=None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def needs_map_reduce(pack_stats, min_dropped_share=MIN_DROPPED_SHARE):
+    """
+    Decides from the pack_context stats whether a context is worth map-reduce: several
+    extra calls and a later first token, for rows the budgeted prompt had to leave out.
+    Near duplicates that were collapsed do not count as dropped.
+
+    Returns:
+    bool: True if at least min_dropped_share of the rows did not fit.
+    """
+    if not pack_stats['truncated'] or not pack_stats['rows_in']:
+        return False
+    dropped = pack_stats['rows_in'] - pack_stats['rows_out'] - pack_stats['duplicates_collapsed']
+    return dropped / pack_stats['rows_in'] >= min_dropped_share
+
+
+def shard_context(context_df, user_prompt, shard_tokens=DEFAULT_SHARD_TOKENS):
+    """
+    Splits the context rows into consecutive shards of at most shard_tokens each (a row
+    larger than that gets a shard of its own), counting only the columns the query needs
+    and with the same token estimate as pack_context, so every shard packs whole.
+
+    Returns:
+    list: The shard DataFrames.
+    """
+    shards = []
+    start, used = 0, 0
+    for i, tokens in enumerate(row_tokens(context_df, select_columns(context_df, user_prompt))):
+        if i > start and used + tokens > shard_tokens:
+            shards.append(context_df.iloc[start:i])
+            start, used = i, 0
+        used += tokens
+    if len(context_df):
+        shards.append(context_df.iloc[start:])
+    return shards
+
+
+def map_reduce_partials(user_prompt, context_df, generate, shard_tokens=DEFAULT_SHARD_TOKENS,
+                        max_concurrency=DEFAULT_MAX_CONCURRENCY, requests_per_second=None, fan_in=DEFAULT_FAN_IN,
+                        rate_limiter=None):
+    """
+    Summarises a large context in parallel: every shard is summarised concurrently (map),
+    then the partial summaries are merged in groups of fan_in, level by level, until at
+    most fan_in remain (reduce). The caller turns those into the final answer with
+    build_final_system_message, which keeps that last call streamable.
+
+    Parameters:
+    user_prompt (str): The user's query.
+    context_df (pd.DataFrame): The full retrieved context.
+    generate (callable): generate(system_prompt, user_prompt) -> str, one LLM call.
+    shard_tokens (int): Token budget per shard.
+    max_concurrency (int): Maximum number of LLM calls in flight.
+    requests_per_second (float): Optional cap on the LLM call rate.
+    fan_in (int): Number of summaries merged per reduce call.
+    rate_limiter (RateLimiter): Limiter shared with the caller's other LLM calls, used
+        instead of requests_per_second.
+
+    Returns:
+    list: At most fan_in partial summaries.
+    """
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(requests_per_second)
+
+    def call(system_prompt):
+        rate_limiter.acquire()
+        return generate(system_prompt, user_prompt)
+
+    def summarise_shard(shard_df):
+        context, stats = pack_context(shard_df, user_prompt, max_tokens=shard_tokens)
+        if stats['truncated']:
+            # shard_context sizes shards to fit, so dropping rows here would be a bug
+            raise RuntimeError(f"Shard of {len(shard_df)} rows did not fit in {shard_tokens} tokens")
+        return call(MAP_SYSTEM_MESSAGE.format(context=context))
+
+    def merge(summaries):
+        return call(REDUCE_SYSTEM_MESSAGE.format(summaries=format_summaries(summaries)))
+
+    with tracer.span('map_reduce', rows=len(context_df)) as span:
+        shards = shard_context(context_df, user_prompt, shard_tokens)
+        span.set(shards=len(shards))
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            partials = list(executor.map(tracer.propagate(summarise_shard), shards))
+            levels = 0
+            while len(partials) > fan_in:
+                groups = [partials[i:i + fan_in] for i in range(0, len(partials), fan_in)]
+                partials = list(executor.map(tracer.propagate(merge), groups))
+                levels += 1
+        span.set(reduce_levels=levels)
+    return partials
+
+
+def format_summaries(summaries):
+    return '\n\n'.join(f'Summary {i + 1}:\n{summary}' for i, summary in enumerate(summaries))
+
+
+def build_final_system_message(partials):
+    """
+    Builds the system prompt for the final answer from the partial summaries.
+    """
+    return FINAL_SYSTEM_MESSAGE.format(summaries=format_summaries(partials))
+
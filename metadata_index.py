@@ -0,0 +1,274 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from client_name_index import ClientNameIndex
+from tracing import tracer
+
+# Saved next to index.faiss and the docstore in the vector store folder
+METADATA_INDEX_FILE = 'metadata_index.npz'
+
+CATEGORY_COLUMNS = ['client_name', 'client_region', 'theme']
+
+# Columns where a value with no exact match falls back to a fuzzy ("like") lookup
+FUZZY_COLUMNS = ['client_name']
+DATE_COLUMN = 'complaint_date'
+
+# Prefix operators accepted in date filters, e.g. ">2024-06-15"
+DATE_PREFIX_OPERATORS = [('>=', '$gte'), ('<=', '$lte'), ('>', '$gt'), ('<', '$lt'), ('==', '$eq'), ('=', '$eq')]
+
+# Rows without a parseable complaint_date never match a date filter
+MISSING_DAY = np.iinfo(np.int32).min
+
+
+def to_days(dates):
+    """
+    Converts dates to int32 days since 1970-01-01. Unparseable dates become MISSING_DAY.
+
+    Parameters:
+    dates (list): Date strings such as '2024-06-15'.
+
+    Returns:
+    np.ndarray: The day numbers.
+    """
+    parsed = pd.to_datetime(pd.Series(dates, dtype=object), errors='coerce')
+    days = (parsed - pd.Timestamp('1970-01-01')).dt.days
+    return days.fillna(MISSING_DAY).to_numpy(dtype=np.int32)
+
+
+class MetadataIndex:
+    """
+    Columnar index over the complaint metadata, aligned with the FAISS index positions.
+    client_name, client_region and theme are stored as category codes and complaint_date
+    as int days with a sorted copy, so metadata filters resolve to the set of matching
+    FAISS ids without touching the docstore.
+    """
+
+    def __init__(self, codes, categories, days, fingerprint=None):
+        """
+        Parameters:
+        codes (dict): Column name -> int32 array of category codes, one per FAISS position.
+        categories (dict): Column name -> array of category values (code i is categories[i]).
+        days (np.ndarray): complaint_date as int32 days, one per FAISS position.
+        fingerprint (str): complaint_store.store_fingerprint of the store it was built from.
+        """
+        self.fingerprint = fingerprint
+        self.codes = codes
+        self.categories = categories
+        self.days = days
+        self.date_order = np.argsort(days, kind='stable')
+        self.sorted_days = days[self.date_order]
+        self._lookup = {
+            column: {str(value).lower(): code for code, value in enumerate(values)}
+            for column, values in categories.items()
+        }
+        self._fuzzy = {}
+
+    def __len__(self):
+        return len(self.days)
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Builds the index from metadata dicts listed in FAISS position order.
+
+        Parameters:
+        records (list): One metadata dict per FAISS position.
+
+        Returns:
+        MetadataIndex: The built index.
+        """
+        df = pd.DataFrame.from_records(records, columns=CATEGORY_COLUMNS + [DATE_COLUMN])
+        codes = {}
+        categories = {}
+        for column in CATEGORY_COLUMNS:
+            column_codes, values = pd.factorize(df[column].fillna('').astype(str))
+            codes[column] = column_codes.astype(np.int32)
+            categories[column] = np.asarray(values, dtype=object)
+        return cls(codes, categories, to_days(df[DATE_COLUMN].tolist()))
+
+    @classmethod
+    def from_vector_store(cls, vector_store):
+        """
+        Builds the index from the docstore of a langchain FAISS vector store, or of a
+        ComplaintStore (whose columnar docstore is read column by column).
+
+        Parameters:
+        vector_store (FAISS or ComplaintStore): The vector store.
+
+        Returns:
+        MetadataIndex: The built index.
+        """
+        # Imported here because complaint_store builds on this module
+        from complaint_store import store_fingerprint
+
+        if hasattr(vector_store.docstore, 'get_columns'):
+            columns = vector_store.docstore.get_columns(CATEGORY_COLUMNS + [DATE_COLUMN])
+            metadata_index = cls.from_records(pd.DataFrame(columns).to_dict('records'))
+        else:
+            metadata_index = cls.from_records([
+                vector_store.docstore.search(vector_store.index_to_docstore_id[position]).metadata
+                for position in range(vector_store.index.ntotal)
+            ])
+        metadata_index.fingerprint = store_fingerprint(vector_store)
+        return metadata_index
+
+    def save(self, store_path):
+        # Imported here because complaint_store builds on this module
+        from complaint_store import replace_file
+
+        arrays = {'days': self.days, 'fingerprint': np.array(self.fingerprint or '')}
+        for column in CATEGORY_COLUMNS:
+            arrays[f'codes_{column}'] = self.codes[column]
+            arrays[f'categories_{column}'] = self.categories[column].astype(str)
+
+        def write(temp_path):
+            # Through a file object, so np.savez does not append .npz to the temp name
+            with open(temp_path, 'wb') as f:
+                np.savez(f, **arrays)
+        replace_file(os.path.join(store_path, METADATA_INDEX_FILE), write)
+
+    @classmethod
+    def load(cls, store_path):
+        with np.load(os.path.join(store_path, METADATA_INDEX_FILE)) as data:
+            codes = {column: data[f'codes_{column}'] for column in CATEGORY_COLUMNS}
+            categories = {column: data[f'categories_{column}'].astype(object) for column in CATEGORY_COLUMNS}
+            days = data['days']
+            fingerprint = str(data['fingerprint']) if 'fingerprint' in data.files else None
+        return cls(codes, categories, days, fingerprint or None)
+
+    @classmethod
+    def load_or_build(cls, vector_store, store_path):
+        """
+        Loads the saved index for a vector store, rebuilding (and saving) it from the
+        docstore if it is missing or was built for other complaints (its fingerprint
+        differs from complaint_store.store_fingerprint).
+
+        Parameters:
+        vector_store (FAISS or ComplaintStore): The loaded vector store.
+        store_path (str): The vector store folder.
+
+        Returns:
+        MetadataIndex: The index.
+        """
+        # Imported here because complaint_store builds on this module
+        from complaint_store import store_fingerprint
+
+        if os.path.exists(os.path.join(store_path, METADATA_INDEX_FILE)):
+            metadata_index = cls.load(store_path)
+            if metadata_index.fingerprint == store_fingerprint(vector_store):
+                return metadata_index
+        metadata_index = cls.from_vector_store(vector_store)
+        try:
+            metadata_index.save(store_path)
+        except OSError:
+            pass
+        return metadata_index
+
+    def fuzzy_index(self, column):
+        """
+        Returns the trigram index over the distinct values of a column, built on first use.
+        """
+        if column not in self._fuzzy:
+            self._fuzzy[column] = ClientNameIndex(self.categories[column])
+        return self._fuzzy[column]
+
+    def _category_mask(self, column, value):
+        like = False
+        if isinstance(value, dict):
+            if '$in' in value:
+                value = value['$in']
+            elif '$eq' in value:
+                value = value['$eq']
+            elif '$like' in value and column in FUZZY_COLUMNS:
+                value, like = value['$like'], True
+            else:
+                raise ValueError(f"Unsupported operator for {column}: {value}")
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        lookup = self._lookup[column]
+        wanted = []
+        for v in values:
+            if not like and str(v).lower() in lookup:
+                wanted.append(lookup[str(v).lower()])
+            elif column in FUZZY_COLUMNS:
+                wanted.extend(self.fuzzy_index(column).lookup(v))
+        return np.isin(self.codes[column], wanted)
+
+    def _date_conditions(self, value):
+        """
+        Turns a complaint_date filter value into a list of (operator, day) conditions
+        that must all hold. Accepts '2024-06-15', '>2024-06-15', {'$gte': '2024-01-01'}
+        or a list of these (combined with AND).
+        """
+        if isinstance(value, dict):
+            return [(operator, to_days([date])[0]) for operator, date in value.items()]
+        if isinstance(value, (list, tuple)):
+            return [condition for item in value for condition in self._date_conditions(item)]
+        text = str(value).strip()
+        for prefix, operator in DATE_PREFIX_OPERATORS:
+            if text.startswith(prefix):
+                return [(operator, to_days([text[len(prefix):].strip()])[0])]
+        return [('$eq', to_days([text])[0])]
+
+    def _date_range(self, operator, day):
+        """
+        Returns the [start, stop) slice of sorted_days matching a single condition.
+        """
+        if operator not in ('$gt', '$gte', '$lt', '$lte', '$eq'):
+            raise ValueError(f"Unsupported operator for {DATE_COLUMN}: {operator}")
+        if day == MISSING_DAY:
+            raise ValueError("Could not parse date in complaint_date filter")
+        start = np.searchsorted(self.sorted_days, MISSING_DAY, side='right')
+        stop = len(self.sorted_days)
+        if operator in ('$gt', '$gte', '$eq'):
+            start = max(start, np.searchsorted(self.sorted_days, day, side='right' if operator == '$gt' else 'left'))
+        if operator in ('$lt', '$lte', '$eq'):
+            stop = min(stop, np.searchsorted(self.sorted_days, day, side='left' if operator == '$lt' else 'right'))
+        return start, stop
+
+    def _date_mask(self, value):
+        # A list of plain dates means "any of these days"; anything else is a range
+        if isinstance(value, (list, tuple)) and all(self._date_conditions(v)[0][0] == '$eq' for v in value):
+            ranges = [self._date_range('$eq', self._date_conditions(v)[0][1]) for v in value]
+        else:
+            start, stop = 0, len(self.sorted_days)
+            for operator, day in self._date_conditions(value):
+                condition_start, condition_stop = self._date_range(operator, day)
+                start, stop = max(start, condition_start), min(stop, condition_stop)
+            ranges = [(start, stop)]
+        mask = np.zeros(len(self.days), dtype=bool)
+        for start, stop in ranges:
+            if start < stop:
+                mask[self.date_order[start:stop]] = True
+        return mask
+
+    def resolve(self, metadata_filter):
+        """
+        Resolves a metadata filter to the FAISS positions of the matching complaints.
+        Conditions on different columns are combined with AND. Unknown columns are ignored.
+        client_name values without an exact match (or given as {'$like': ...}) are matched
+        fuzzily against the distinct client names.
+
+        Parameters:
+        metadata_filter (dict): e.g. {'client_region': ['MC', 'LC'], 'complaint_date': '>2024-06-15'}
+
+        Returns:
+        np.ndarray: Sorted int64 FAISS positions, or None if the filter is empty.
+        """
+        mask = None
+        ignored_columns = []
+        for column, value in (metadata_filter or {}).items():
+            if column in self.codes:
+                column_mask = self._category_mask(column, value)
+            elif column == DATE_COLUMN:
+                column_mask = self._date_mask(value)
+            else:
+                ignored_columns.append(column)
+                continue
+            mask = column_mask if mask is None else mask & column_mask
+        if ignored_columns:
+            tracer.annotate(ignored_filter_columns=ignored_columns)
+        if mask is None:
+            return None
+        return np.flatnonzero(mask).astype(np.int64)
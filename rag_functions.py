@@ -1,24 +1,44 @@
-import boto3, json, math
+import json, math
+import threading
 import faiss
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.vectorstores import FAISS
-from langchain.embeddings import BedrockEmbeddings
 import pandas as pd
+from bedrock_client import get_bedrock_client
+from complaint_store import get_complaint_store, get_query_embeddings
+from context_packer import pack_context
+from embedding_cache import normalise_text
+from filter_parser import DEFAULT_K, FilterCache, FilterParser
+from follow_up import follow_up_terms, is_follow_up, merge_filters, refine_context, refers_back
+from map_reduce import build_final_system_message, map_reduce_partials, needs_map_reduce
+from result_store import RetrievalCache
+from retrieval import search_mode
+from retrieval_service import get_retrieval_client, retrieve
+from tracing import tracer
 
-# Initialize the Bedrock runtime client
-bedrock_client = boto3.client(
-    service_name="bedrock-runtime",
-    region_name='us-east-1',
-)
+# Nothing is loaded at import: the Bedrock client, the complaints store (memory-mapped from
+# complaints.vs) and the filter parser are created the first time a function needs them
 
-# Create an instance of BedrockEmbeddings using the Bedrock client
-embeddings = BedrockEmbeddings(
-    client=bedrock_client, 
-    model_id="amazon.titan-embed-text-v2:0"
-)
+# Rule-based filter extraction, with extracted filters cached by normalised prompt
+_filter_parser = None
+_filter_parser_lock = threading.Lock()
+filter_cache = FilterCache()
 
-# Load the previously created FAISS vector store for complaints
-vector_store = FAISS.load_local('complaints.vs', embeddings, allow_dangerous_deserialization=True)
+# Retrieved contexts shared by every chat session of this process
+result_cache = RetrievalCache()
+
+# Keys of the chat session state used by getSessionContext
+SESSION_CACHE_KEY = 'retrieval_cache'
+LAST_RETRIEVAL_KEY = 'last_retrieval'
+
+def get_filter_parser():
+    """
+    Returns the rule-based filter parser, building it from the metadata index on first use.
+    """
+    global _filter_parser
+    if _filter_parser is None:
+        with _filter_parser_lock:
+            if _filter_parser is None:
+                _filter_parser = FilterParser(get_complaint_store().metadata_index)
+    return _filter_parser
 
 # Define the tool list for identifying complaints filters
 # This tool is used to determine if the user's query requires filtering the complaints based on metadata
@@ -27,7 +47,7 @@ tool_list =[
         "toolSpec": {
             "name": "identify_complaints_filters",
             "description": """Your job is to first look at the query's query and determine if it requires filtering the complaints first based off the following columns 
-            client_name - name of the company making the complaint, you will need to use the like filter since users might not type if the exact name
+            client_name - name of the company making the complaint, you will need to use the like filter since users might not type if the exact name e.g. {"client_name": {"$like": "quantum innovations"}}
             client_region - possible values ['MC','LC','ICB'] where MC= mid-corporate, LC = Large corporate, ICB = International corporate
             complaint_date - date of the complaint
 
@@ -82,28 +102,55 @@ def call_bedrock(message_list, system_prompts, extract_filter=True):
     dict: The response from the Bedrock service.
     """
     
-    # Create a boto3 session
-    session = boto3.Session()
+    # Reuse the shared Bedrock runtime client (and its connection pool)
+    bedrock = get_bedrock_client()
+    
+    with tracer.span('llm_generation', tools=extract_filter) as span:
+        # Check if extract_filter is True to decide whether to include tool configuration
+        if extract_filter:
+            # Call the Bedrock converse API with tool configuration
+            response = bedrock.converse(
+                modelId="amazon.nova-pro-v1:0",  # ID of the model to use
+                messages=message_list,  # Messages to send to the model
+                system=[{ 'text': system_prompts }],  # System prompts
+                inferenceConfig={  # Inference configuration
+                    "maxTokens": 2000,  # Maximum number of tokens to generate
+                    "temperature": 0.1  # Temperature for response randomness
+                },
+                toolConfig={ "tools": tool_list }  # Tool configuration
+            )
+        else:
+            # Call the Bedrock converse API without tool configuration
+            response = bedrock.converse(
+                modelId="amazon.nova-pro-v1:0",  # ID of the model to use
+                messages=message_list,  # Messages to send to the model
+                system=[{ 'text': system_prompts }],  # System prompts
+                inferenceConfig={  # Inference configuration
+                    "maxTokens": 2000,  # Maximum number of tokens to generate
+                    "temperature": 0.1  # Temperature for response randomness
+                }
+            )
+        # Record token usage and model latency
+        span.record_usage(response)
+        span.set(stop_reason=response.get('stopReason'))
+    
+    # Return the response from the Bedrock service
+    return response
 
-    # Initialize the Bedrock runtime client
-    bedrock = session.client(service_name='bedrock-runtime')
+def call_bedrock_stream(message_list, system_prompts):
+    """
+    This function calls the Bedrock streaming API (converse_stream) and yields the generated text as it arrives.
+
+    Parameters:
+    message_list (list): A list of messages to send to the model.
+    system_prompts (str): System prompts to guide the model's response.
+
+    Yields:
+    str: The next text delta generated by the model.
+    """
     
-    # Check if extract_filter is True to decide whether to include tool configuration
-    if extract_filter:
-        # Call the Bedrock converse API with tool configuration
-        response = bedrock.converse(
-            modelId="amazon.nova-pro-v1:0",  # ID of the model to use
-            messages=message_list,  # Messages to send to the model
-            system=[{ 'text': system_prompts }],  # System prompts
-            inferenceConfig={  # Inference configuration
-                "maxTokens": 2000,  # Maximum number of tokens to generate
-                "temperature": 0.1  # Temperature for response randomness
-            },
-            toolConfig={ "tools": tool_list }  # Tool configuration
-        )
-    else:
-        # Call the Bedrock converse API without tool configuration
-        response = bedrock.converse(
+    with tracer.span('llm_generation', tools=False, stream=True) as span:
+        response = get_bedrock_client().converse_stream(
             modelId="amazon.nova-pro-v1:0",  # ID of the model to use
             messages=message_list,  # Messages to send to the model
             system=[{ 'text': system_prompts }],  # System prompts
@@ -112,25 +159,225 @@ def call_bedrock(message_list, system_prompts, extract_filter=True):
                 "temperature": 0.1  # Temperature for response randomness
             }
         )
+        
+        # Yield the text deltas from the event stream, recording time to first token and the final usage
+        for event in response['stream']:
+            if 'contentBlockDelta' in event:
+                text = event['contentBlockDelta']['delta'].get('text')
+                if text:
+                    if 'first_token_ms' not in span.attributes:
+                        span.set(first_token_ms=span.elapsed_ms())
+                    yield text
+            elif 'metadata' in event:
+                span.record_usage(event['metadata'])
+
+def extract_filters(user_prompt:str):
+    """
+    This function extracts the metadata filter and number of documents to return from the user's query.
+    Simple queries are parsed locally; the LLM (tool identify_complaints_filters) is only called when the
+    rule-based parser is not confident. Results are cached by normalised prompt.
+
+    Parameters:
+    user_prompt (str): The user's query.
+
+    Returns:
+    dict: {'metadata_filter': dict, 'k_filter': int}, or None if no filters could be extracted.
+    """
     
-    # Return the response from the Bedrock service
-    return response
+    with tracer.span('filter_extraction') as span:
+        filter_terms = _extract_filters(user_prompt, span)
+        span.set(k=filter_terms['k_filter'] if filter_terms else None,
+                 filter_columns=sorted(filter_terms['metadata_filter'] or {}) if filter_terms else None)
+    return filter_terms
+
+def _extract_filters(user_prompt:str, span):
+    # Reuse the filters already extracted for the same prompt
+    filter_terms = filter_cache.get(user_prompt)
+    if filter_terms is not None:
+        span.set(source='cache')
+        return filter_terms
+    
+    # Try the local rule-based parser before spending an LLM call
+    filter_terms = get_filter_parser().parse(user_prompt)
+    span.set(source='rules')
+    
+    if filter_terms is None:
+        span.set(source='llm')
+        system_message_filter = """You are an AI assistant within a corporate bank in the Complaints team. Your role is to retrieve back the complaints based off the user query. 
+        Your first job is always to breakdown the user query (using the tool identify_complaints_filters) """
+        
+        message_list = [
+                {
+                    "role": "user",
+                    "content": [ { "text": user_prompt } ]
+                }
+            ]
+
+        # Call the Bedrock service to get the filter response
+        filter_response = call_bedrock(message_list=message_list,system_prompts=system_message_filter,extract_filter=True)
+        
+        try:
+            # Extract the metadata filter and the number of documents to return from the tool use block
+            content = filter_response['output']['message']['content']
+            tool_input = next(block['toolUse']['input'] for block in content if 'toolUse' in block)
+            filter_terms = {'metadata_filter': tool_input['x'], 'k_filter': tool_input['y']}
+        except (KeyError, TypeError, StopIteration):
+            span.set(source='failed')
+            return None
+    
+    filter_cache.put(user_prompt, filter_terms)
+    return filter_terms
 
-def getContext(user_prompt:str):
+def cached_retrieve(user_prompt:str, metadata_filter=None, k=100, session_cache=None):
     """
-    This function retrieves the context (complaints) based on the user's query.
+    Retrieves complaints through the result caches: the session's own cache (if given),
+    then the process-wide result_cache, then retrieve(). Results are keyed by the
+    normalised filter and the query embedding, or by the normalised text for lexical
+    queries and when a retrieval service is configured (the service embeds the query
+    itself, so embedding it here as well would double the embedding calls).
 
     Parameters:
     user_prompt (str): The user's query.
-    vector_store: The FAISS vector store containing the complaints.
-    tool_list (list): The list of tools to use for filtering.
+    metadata_filter (dict): Optional metadata filter.
+    k (int): Number of complaints to return.
+    session_cache (RetrievalCache): Optional cache of the chat session.
+
+    Returns:
+    pd.DataFrame: The retrieved complaints with their scores.
+    """
+    mode = search_mode(user_prompt)
+    if mode == 'lexical' or get_retrieval_client() is not None:
+        query_vector, query_text = None, normalise_text(user_prompt)
+    else:
+        # Served from the embedding cache when the same prompt is searched below
+        query_vector, query_text = get_query_embeddings().embed_query(user_prompt), None
+    caches = [('session', session_cache), ('shared', result_cache)]
+    caches = [(name, cache) for name, cache in caches if cache is not None]
+
+    with tracer.span('result_cache', mode=mode) as span:
+        for level, (name, cache) in enumerate(caches):
+            context_df = cache.get(metadata_filter, k, mode, query_vector, query_text)
+            if context_df is not None:
+                span.set(source=name)
+                # Copy the hit into the caches in front of it
+                for _, front_cache in caches[:level]:
+                    front_cache.put(metadata_filter, k, context_df, mode, query_vector, query_text)
+                return context_df
+        span.set(source='retrieved')
+
+    context_df = retrieve(user_prompt, metadata_filter, k, mode)
+    for _, cache in caches:
+        cache.put(metadata_filter, k, context_df, mode, query_vector, query_text)
+    return context_df
+
+def retrieve_context(user_prompt:str, session_cache=None):
+    """
+    Extracts the filters of the user's query and retrieves the matching complaints.
 
     Returns:
-    pd.DataFrame: A DataFrame containing the retrieved complaints.
+    tuple: (context DataFrame, metadata filter used, k used).
     """
+    with tracer.span('get_context') as span:
+        filter_terms = extract_filters(user_prompt)
+        
+        try:
+            metadata_filter = filter_terms['metadata_filter']
+            k_filter = int(filter_terms['k_filter'])
+            if metadata_filter is not None and not isinstance(metadata_filter, dict):
+                raise TypeError(f"metadata_filter must be a dict, got {metadata_filter!r}")
+        except (KeyError, TypeError, ValueError):
+            span.set(default_filters=True)
+            # Search all complaints with default settings if filters cannot be extracted
+            metadata_filter, k_filter = None, DEFAULT_K
+        span.set(metadata_filter=metadata_filter, k=k_filter)
+
+        # Retrieval errors (throttling, the retrieval service, FAISS) reach the caller
+        master_df = cached_retrieve(user_prompt, metadata_filter, k_filter, session_cache)
+        span.set(rows=len(master_df))
     
-    system_message_filter = """You are an AI assistant within a corporate bank in the Complaints team. Your role is to retrieve back the complaints based off the user query. 
-    Your first job is always to breakdown the user query (using the tool identify_complaints_filters) """
+    return master_df, metadata_filter, k_filter
+
+def getContext(user_prompt:str, session_cache=None):
+    """
+    This function retrieves the context (complaints) based on the user's query.
+
+    Parameters:
+    user_prompt (str): The user's query.
+    session_cache (RetrievalCache): Optional result cache of the chat session.
+
+    Returns:
+    pd.DataFrame: A DataFrame containing the retrieved complaints and their scores.
+    """
+    master_df, _, _ = retrieve_context(user_prompt, session_cache)
+    return master_df
+
+def getSessionContext(user_prompt:str, session):
+    """
+    getContext for a chat session. A follow-up to the previous answer ("now only the MC
+    ones", "summarise that") refines the previous complaints locally, without another
+    filter extraction, embedding or search; one that also names a topic ("the ones about
+    card fraud") keeps and ranks the previous complaints mentioning it. Other prompts,
+    including ones that only open like a follow-up ("also show me complaints about the
+    mobile app"), go through the session's result cache and the process-wide one.
+
+    Parameters:
+    user_prompt (str): The user's query.
+    session (dict): Per-session state, e.g. st.session_state. Holds the session's result
+        cache and its last retrieval.
+
+    Returns:
+    pd.DataFrame: A DataFrame containing the retrieved complaints and their scores.
+    """
+    if SESSION_CACHE_KEY not in session:
+        session[SESSION_CACHE_KEY] = RetrievalCache(max_entries=32)
+    session_cache = session[SESSION_CACHE_KEY]
+    previous = session.get(LAST_RETRIEVAL_KEY)
+
+    with tracer.span('session_context') as span:
+        # Follow-ups are parsed by the rules only; anything they cannot parse is a new question
+        filter_terms, terms = None, []
+        if previous and is_follow_up(user_prompt):
+            filter_terms, leftover = get_filter_parser().parse_with_leftover(user_prompt)
+            terms = follow_up_terms(leftover)
+            if terms and not refers_back(user_prompt):
+                # A new topic that does not point at the previous complaints
+                filter_terms = None
+        if filter_terms is not None:
+            query = ' '.join([previous['query']] + terms)
+            metadata_filter = merge_filters(previous['metadata_filter'], filter_terms['metadata_filter'])
+            k_filter = filter_terms['k_filter'] if filter_terms['k_filter'] != DEFAULT_K else previous['k']
+            master_df = refine_context(previous['context_df'], user_prompt, filter_terms, terms)
+            span.set(follow_up=True, source='refined', terms=len(terms))
+            if len(master_df) == 0 and (terms or metadata_filter != previous['metadata_filter']):
+                # None of the previous complaints match: search the previous question, narrowed by
+                # the follow-up's topic and filter
+                master_df = cached_retrieve(query, metadata_filter, k_filter, session_cache)
+                span.set(source='retrieved')
+        else:
+            query = user_prompt
+            master_df, metadata_filter, k_filter = retrieve_context(user_prompt, session_cache)
+            span.set(follow_up=False)
+        span.set(rows=len(master_df))
+
+    session[LAST_RETRIEVAL_KEY] = {
+        'query': query,
+        'metadata_filter': metadata_filter or {},
+        'k': k_filter,
+        'context_df': master_df,
+    }
+    return master_df
+
+def generate_text(system_prompts, user_prompt:str):
+    """
+    This function makes a single model call without tools and returns the generated text.
+
+    Parameters:
+    system_prompts (str): System prompts to guide the model's response.
+    user_prompt (str): The user's query.
+
+    Returns:
+    str: The generated text.
+    """
     
     message_list = [
             {
@@ -138,44 +385,55 @@ def getContext(user_prompt:str):
                 "content": [ { "text": user_prompt } ]
             }
         ]
+    response = call_bedrock(message_list=message_list,system_prompts=system_prompts,extract_filter=False)
+    return response['output']['message']['content'][0]['text']
+
+def build_rag_system_message(user_prompt:str,context_df,rate_limiter=None):
+    """
+    This function builds the system prompt containing the retrieved context, packed to fit the context token budget.
+    If most of the context does not fit (see needs_map_reduce), it is summarised with map-reduce and the prompt
+    contains the summaries instead.
+
+    Parameters:
+    user_prompt (str): The user's query, used to pick the columns to send.
+    context_df (pd.DataFrame): The DataFrame containing the retrieved context.
+    rate_limiter (RateLimiter): Optional limiter the map-reduce calls go through.
 
-    # Call the Bedrock service to get the filter response
-    filter_response = call_bedrock(message_list=message_list,system_prompts=system_message_filter,extract_filter=True)
-    print(filter_response)
+    Returns:
+    str: The system prompt.
+    """
     
-    try:
-        # Extract the metadata filter and the number of documents to return from the filter response
-        metadata_filter = filter_response['output']['message']['content'][1]['toolUse']['input']['x']
-        k_filter = filter_response['output']['message']['content'][1]['toolUse']['input']['y']
-        print(f"filter by metadata: {metadata_filter} and k: {k_filter}")
-        
-        # Create a retriever with the extracted filters
-        retriever = vector_store.as_retriever(search_kwargs={'filter': metadata_filter, 'k':k_filter})
-    except:
-        print('cannot extract out filters so going default')
-        # Create a retriever with default settings if filters cannot be extracted
-        retriever = vector_store.as_retriever(search_kwargs= {'k':100})
-
-    # Retrieve the documents using the retriever
-    docs = retriever.invoke(user_prompt)
-    
-    # Create a DataFrame to store the retrieved complaints
-    master_df = pd.DataFrame()
-    for doc in docs:
-        test=doc.metadata
-        test.update({'complaint_text':doc.page_content})
-        temp_df = pd.DataFrame([test.values()],columns=test.keys())
-        master_df = pd.concat([master_df,temp_df])
+    # Rank, de-duplicate and trim the context to the token budget
+    with tracer.span('context_serialisation') as span:
+        context, pack_stats = pack_context(context_df, user_prompt)
+        span.set(**pack_stats)
     
-    return master_df
+    # Far too many complaints for one prompt: summarise them in parallel shards; when only a
+    # few rows were dropped the budgeted context is answered directly
+    if needs_map_reduce(pack_stats):
+        partials = map_reduce_partials(user_prompt, context_df, generate=generate_text, rate_limiter=rate_limiter)
+        return build_final_system_message(partials)
+    
+    return f"""
+    System: You are an AI assistant in a corporate bank and your job is to answer the users query around complaints using only the context only you should mainly use the complaint_text column to generate answer but can use other columns to check the user query. 
+    Human: Here is a set of context, contained in <context> tags:
+    
+    <context>
+    {context}
+    </context>
+    
+     If you don't know the answer, just say that you don't know, don't try to make up an answer.
+    """
 
-def getResponse(user_prompt:str,context_df):
+def getResponse(user_prompt:str,context_df,rate_limiter=None):
     """
     This function generates a response to the user's query using the retrieved context.
 
     Parameters:
     user_prompt (str): The user's query.
     context_df (pd.DataFrame): The DataFrame containing the retrieved context.
+    rate_limiter (RateLimiter): Optional limiter every model call of the response goes through
+        (including the map-reduce calls for a large context).
 
     Returns:
     str: The generated response.
@@ -189,19 +447,37 @@ def getResponse(user_prompt:str,context_df):
         ]
     
     # Create a system message with the context
-    rag_system_message = f"""
-    System: You are an AI assistant in a corporate bank and your job is to answer the users query around complaints using only the context only you should mainly use the complaint_text column to generate answer but can use other columns to check the user query. 
-    Human: Here is a set of context, contained in <context> tags:
-    
-    <context>
-    {context_df.to_csv(index=False)}
-    </context>
-    
-     If you don't know the answer, just say that you don't know, don't try to make up an answer.
-    """
+    rag_system_message = build_rag_system_message(user_prompt,context_df,rate_limiter)
     
     # Call the Bedrock service to get the response
+    if rate_limiter is not None:
+        rate_limiter.acquire()
     response = call_bedrock(message_list=message_list,system_prompts=rag_system_message,extract_filter=False)
     
     # Return the generated text response
-    return response['output']['message']['content'][0]['text']
\ No newline at end of file
+    return response['output']['message']['content'][0]['text']
+
+def getResponseStream(user_prompt:str,context_df):
+    """
+    This function is the streaming variant of getResponse: it yields the response text as the model generates it.
+
+    Parameters:
+    user_prompt (str): The user's query.
+    context_df (pd.DataFrame): The DataFrame containing the retrieved context.
+
+    Yields:
+    str: The next piece of the generated response.
+    """
+    
+    message_list = [
+            {
+                "role": "user",
+                "content": [ { "text": user_prompt } ]
+            }
+        ]
+    
+    # Create a system message with the context
+    rag_system_message = build_rag_system_message(user_prompt,context_df)
+    
+    # Stream the response from the Bedrock service
+    yield from call_bedrock_stream(message_list=message_list,system_prompts=rag_system_message)
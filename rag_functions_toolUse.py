@@ -1,26 +1,30 @@
-import boto3
 import json
 import math
+from concurrent.futures import ThreadPoolExecutor
 import faiss
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.vectorstores import FAISS
-from langchain.embeddings import BedrockEmbeddings
 import pandas as pd
+from aggregates import GROUP_BY_COLUMNS
+from bedrock_client import get_bedrock_client
+from complaint_store import get_complaint_store
+from context_packer import pack_context
+from map_reduce import build_final_system_message, map_reduce_partials, needs_map_reduce
+from metadata_index import CATEGORY_COLUMNS
+from result_store import ResultStore, preview_records
+from retrieval_service import retrieve
+from tracing import tracer
 
-# Initialize the Bedrock runtime client
-bedrock_client = boto3.client(
-    service_name="bedrock-runtime",
-    region_name='us-east-1',
-)
+# The Bedrock client and the complaints store (memory-mapped from complaints.vs, with its
+# metadata index and precomputed counts) are created the first time a tool needs them
 
-# Create an instance of BedrockEmbeddings using the Bedrock client
-embeddings = BedrockEmbeddings(
-    client=bedrock_client,
-    model_id="amazon.titan-embed-text-v2:0"
-)
+# Retrieved context is kept here and referred to by handle in tool results
+result_store = ResultStore()
 
-# Load the previously created FAISS vector store for complaints
-vector_store = FAISS.load_local('complaints.vs', embeddings, allow_dangerous_deserialization=True)
+# Bounded pool for running the tool calls of a single model turn concurrently
+MAX_TOOL_WORKERS = 4
+tool_executor = ThreadPoolExecutor(max_workers=MAX_TOOL_WORKERS)
+
+# Groups returned by get_complaintsStats for a category column when the model sets no top
+MAX_STATS_GROUPS = 20
 
 def getContext(user_prompt: str, filter_terms: dict) -> pd.DataFrame:
     """
@@ -31,27 +35,69 @@ def getContext(user_prompt: str, filter_terms: dict) -> pd.DataFrame:
     filter_terms (dict): Dictionary containing metadata filter and k_filter.
 
     Returns:
-    pd.DataFrame: A DataFrame containing the retrieved complaints.
+    pd.DataFrame: A DataFrame containing the retrieved complaints and their scores.
     """
-    try:
-        metadata_filter = filter_terms['metadata_filter']
-        k_filter = filter_terms['k_filter']
-        print(f"Filter by metadata: {metadata_filter} and k: {k_filter}")
-        retriever = vector_store.as_retriever(search_kwargs={'filter': metadata_filter, 'k': k_filter})
-    except Exception as e:
-        print('Cannot extract filters, using default settings.')
-        retriever = vector_store.as_retriever(search_kwargs={'k': 100})
+    with tracer.span('get_context') as span:
+        try:
+            metadata_filter = filter_terms['metadata_filter']
+            k_filter = filter_terms['k_filter']
+            span.set(metadata_filter=metadata_filter, k=k_filter)
+            master_df = retrieve(user_prompt, metadata_filter, k_filter)
+        except Exception as e:
+            span.set(default_filters=True)
+            master_df = retrieve(user_prompt, k=100)
+        span.set(rows=len(master_df))
 
-    docs = retriever.invoke(user_prompt)
-    master_df = pd.DataFrame()
+    return master_df
 
-    for doc in docs:
-        test = doc.metadata
-        test.update({'complaint_text': doc.page_content})
-        temp_df = pd.DataFrame([test.values()], columns=test.keys())
-        master_df = pd.concat([master_df, temp_df])
+def getComplaintStats(group_by: list, filter_terms: dict = None, top: int = None) -> pd.DataFrame:
+    """
+    Counts all complaints matching the filters, grouped by the given columns.
 
-    return master_df
+    Parameters:
+    group_by (list): Columns to group by, from GROUP_BY_COLUMNS.
+    filter_terms (dict): Optional dictionary containing the metadata filter.
+    top (int): Optional number of largest groups to return. Grouping by a category
+        column returns at most MAX_STATS_GROUPS groups by default.
+
+    Returns:
+    pd.DataFrame: The group_by columns and complaint_count; the groups left out are
+        summed in one 'other' row.
+    """
+    metadata_filter = (filter_terms or {}).get('metadata_filter')
+    group_columns = [group_by] if isinstance(group_by, str) else list(group_by or [])
+    if not top and any(column in CATEGORY_COLUMNS for column in group_columns):
+        # e.g. per client_name: one row per client would flood the model's context
+        top = MAX_STATS_GROUPS
+    with tracer.span('complaint_stats', group_by=group_by, metadata_filter=metadata_filter) as span:
+        stats_df = get_complaint_store().aggregates.query(group_by, metadata_filter, top)
+        span.set(groups=len(stats_df))
+    return stats_df
+
+def generate_text(system_prompts: str, user_prompt: str) -> str:
+    """
+    Makes a single model call without tools and returns the generated text.
+
+    Parameters:
+    system_prompts (str): System prompts to guide the model's response.
+    user_prompt (str): The user's query.
+
+    Returns:
+    str: The generated text.
+    """
+    with tracer.span('llm_generation', tools=False) as span:
+        response = get_bedrock_client().converse(
+            modelId="amazon.nova-pro-v1:0",
+            messages=[{"role": "user", "content": [{"text": user_prompt}]}],
+            system=[{'text': system_prompts}],
+            inferenceConfig={
+                "maxTokens": 2000,
+                "temperature": 0.1
+            }
+        )
+        span.record_usage(response)
+
+    return response['output']['message']['content'][0]['text']
 
 def getResponse(user_prompt: str, context_df: pd.DataFrame) -> str:
     """
@@ -71,27 +117,40 @@ def getResponse(user_prompt: str, context_df: pd.DataFrame) -> str:
         }
     ]
 
+    # Rank, de-duplicate and trim the context to the token budget
+    with tracer.span('context_serialisation') as span:
+        context, pack_stats = pack_context(context_df, user_prompt)
+        span.set(**pack_stats)
+
+    # Far too many complaints for one prompt: summarise them in parallel shards; when only a
+    # few rows were dropped the budgeted context is answered directly
+    if needs_map_reduce(pack_stats):
+        partials = map_reduce_partials(user_prompt, context_df, generate=generate_text)
+        return generate_text(build_final_system_message(partials), user_prompt)
+
     rag_system_message = f"""
     System: You are an AI assistant in a corporate bank. Your job is to answer the user's query around complaints using only the provided context. 
     Mainly use the complaint_text column to generate answers but can use other columns to check the user query. 
     Human: Here is a set of context, contained in <context> tags:
     
     <context>
-    {context_df.to_csv(index=None)}
+    {context}
     </context>
     
     If you don't know the answer, just say that you don't know, don't try to make up an answer.
     """
 
-    response = bedrock_client.converse(
-        modelId="amazon.nova-pro-v1:0",
-        messages=message_list,
-        system=[{'text': rag_system_message}],
-        inferenceConfig={
-            "maxTokens": 2000,
-            "temperature": 0.1
-        }
-    )
+    with tracer.span('llm_generation', tools=False) as span:
+        response = get_bedrock_client().converse(
+            modelId="amazon.nova-pro-v1:0",
+            messages=message_list,
+            system=[{'text': rag_system_message}],
+            inferenceConfig={
+                "maxTokens": 2000,
+                "temperature": 0.1
+            }
+        )
+        span.record_usage(response)
 
     return response['output']['message']['content'][0]['text']
 
@@ -107,16 +166,19 @@ def call_bedrock(message_list, system_prompts, tool_list) -> dict:
     Returns:
     dict: The response from the Bedrock service.
     """
-    response = bedrock_client.converse(
-        modelId="amazon.nova-pro-v1:0",
-        messages=message_list,
-        system=[{'text': system_prompts}],
-        inferenceConfig={
-            "maxTokens": 2000,
-            "temperature": 0.1
-        },
-        toolConfig={"tools": tool_list}
-    )
+    with tracer.span('llm_generation', tools=True) as span:
+        response = get_bedrock_client().converse(
+            modelId="amazon.nova-pro-v1:0",
+            messages=message_list,
+            system=[{'text': system_prompts}],
+            inferenceConfig={
+                "maxTokens": 2000,
+                "temperature": 0.1
+            },
+            toolConfig={"tools": tool_list}
+        )
+        span.record_usage(response)
+        span.set(stop_reason=response.get('stopReason'))
 
     return response
 
@@ -143,7 +205,7 @@ tool_list = [
     {
         "toolSpec": {
             "name": "get_complaintsData",
-            "description": """Retrieve the context (complaints) based on the user's query.""",
+            "description": """Retrieve the context (complaints) based on the user's query. Returns a context_handle referring to the retrieved complaints, the row_count and a short preview of the first rows.""",
             "inputSchema": {
                 "json": {
                     "type": "object",
@@ -162,6 +224,33 @@ tool_list = [
             }
         }
     },
+    {
+        "toolSpec": {
+            "name": "get_complaintsStats",
+            "description": """Count ALL complaints (not just retrieved ones) grouped by one or more columns. Use this instead of get_complaintsData for count, breakdown or trend questions, e.g. 'Summarise the complaints by the client region' or 'How many complaints per month for LC'.""",
+            "inputSchema": {
+                "json": {
+                    "type": "object",
+                    "properties": {
+                        "group_by": {
+                            "type": "array",
+                            "items": {"type": "string", "enum": GROUP_BY_COLUMNS},
+                            "description": """Columns to group by e.g. ['client_region'] or ['month']"""
+                        },
+                        "filter_terms": {
+                            "type": "dict",
+                            "description": """Optional filter terms from the output of tool identify_complaints_filters"""
+                        },
+                        "top": {
+                            "type": "integer",
+                            "description": """Optional number of largest groups to return; the rest are counted in an 'other' row"""
+                        }
+                    },
+                    "required": ["group_by"]
+                }
+            }
+        }
+    },
     {
         "toolSpec": {
             "name": "generateResponse",
@@ -174,21 +263,90 @@ tool_list = [
                             "type": "str",
                             "description": """Original user query"""
                         },
-                        "context_df": {
+                        "context_handle": {
                             "type": "string",
-                            "description": """Context DataFrame from the output of tool get_complaintsData"""
+                            "description": """The context_handle returned by tool get_complaintsData, e.g. ctx_3f9a1c2b"""
                         }
                     },
-                    "required": ["user_query", "context_df"]
+                    "required": ["user_query", "context_handle"]
                 }
             }
         }
     }
 ]
 
+def run_tool(tool_use_block):
+    """
+    Runs a single tool requested by the model.
+
+    Parameters:
+    tool_use_block (dict): The toolUse block from the model response.
+
+    Returns:
+    dict: The toolResult content block, or None if the tool is unknown.
+    """
+    with tracer.span('tool_call', tool=tool_use_block['name']) as span:
+        tool_result = _run_tool(tool_use_block)
+        span.set(status=tool_result['toolResult'].get('status', 'success') if tool_result else 'unknown')
+    return tool_result
+
+def _run_tool(tool_use_block):
+    try:
+        if tool_use_block['name'] == 'identify_complaints_filters':
+            content = [{"json": {"filter_terms": tool_use_block['input']}}]
+
+        elif tool_use_block['name'] == 'get_complaintsData':
+            user_query = tool_use_block['input']['user_query']
+            filter_terms = tool_use_block['input']['filter_terms']
+            context_df = getContext(user_query, filter_terms)
+            # Keep the rows server-side; the model only sees a handle and a preview
+            content = [{"json": {
+                "context_handle": result_store.put(context_df),
+                "row_count": len(context_df),
+                "preview": preview_records(context_df),
+            }}]
+
+        elif tool_use_block['name'] == 'get_complaintsStats':
+            stats_df = getComplaintStats(
+                tool_use_block['input']['group_by'],
+                tool_use_block['input'].get('filter_terms'),
+                tool_use_block['input'].get('top'),
+            )
+            # Only the compact aggregate table goes back to the model
+            content = [{"json": {
+                "total_complaints": int(stats_df['complaint_count'].sum()),
+                "counts": stats_df.to_dict('records'),
+            }}]
+
+        elif tool_use_block['name'] == 'generateResponse':
+            user_query = tool_use_block['input']['user_query']
+            context_df = result_store.get(tool_use_block['input']['context_handle'])
+            response = getResponse(user_query, context_df)
+            content = [{"text": response}]
+
+        else:
+            return None
+    except Exception as e:
+        return {
+            "toolResult": {
+                "toolUseId": tool_use_block['toolUseId'],
+                "content": [{"text": repr(e)}],
+                "status": "error"
+            }
+        }
+
+    return {
+        "toolResult": {
+            "toolUseId": tool_use_block['toolUseId'],
+            "content": content
+        }
+    }
+
 def handle_response(response_message):
     """
     Handles the response from the Bedrock service and prepares follow-up content blocks.
+    When the model requests several tools in one turn they run concurrently, and the
+    results are returned in the order the tools were requested.
 
     Parameters:
     response_message (dict): The response message from the Bedrock service.
@@ -196,75 +354,18 @@ def handle_response(response_message):
     Returns:
     dict: The follow-up message to be sent to the Bedrock service.
     """
-    response_content_blocks = response_message['content']
-    follow_up_content_blocks = []
-
-    for content_block in response_content_blocks:
-        if 'toolUse' in content_block:
-            tool_use_block = content_block['toolUse']
-
-            if tool_use_block['name'] == 'identify_complaints_filters':
-                try:
-                    follow_up_content_blocks.append({
-                        "toolResult": {
-                            "toolUseId": tool_use_block['toolUseId'],
-                            "content": [
-                                {"json": {"filter_terms": tool_use_block['input']}}
-                            ]
-                        }
-                    })
-                except Exception as e:
-                    follow_up_content_blocks.append({
-                        "toolResult": {
-                            "toolUseId": tool_use_block['toolUseId'],
-                            "content": [{"text": repr(e)}],
-                            "status": "error"
-                        }
-                    })
-
-            if tool_use_block['name'] == 'get_complaintsData':
-                user_query = tool_use_block['input']['user_query']
-                filter_terms = tool_use_block['input']['filter_terms']
-                try:
-                    context_df = getContext(user_query, filter_terms)
-                    follow_up_content_blocks.append({
-                        "toolResult": {
-                            "toolUseId": tool_use_block['toolUseId'],
-                            "content": [
-                                {"json": {"context_df": context_df.to_csv(index=None)}}
-                            ]
-                        }
-                    })
-                except Exception as e:
-                    follow_up_content_blocks.append({
-                        "toolResult": {
-                            "toolUseId": tool_use_block['toolUseId'],
-                            "content": [{"text": repr(e)}],
-                            "status": "error"
-                        }
-                    })
-
-            if tool_use_block['name'] == 'generateResponse':
-                user_query = tool_use_block['input']['user_query']
-                context_df_str = tool_use_block['input']['context_df']
-                try:
-                    response = getResponse(user_query,context_df_str)
-                    follow_up_content_blocks.append({
-                        "toolResult": {
-                            "toolUseId": tool_use_block['toolUseId'],
-                            "content": [
-                                {"text": response}
-                            ]
-                        }
-                    })
-                except Exception as e:
-                    follow_up_content_blocks.append({
-                        "toolResult": {
-                            "toolUseId": tool_use_block['toolUseId'],
-                            "content": [{"text": repr(e)}],
-                            "status": "error"
-                        }
-                    })
+    tool_use_blocks = [
+        content_block['toolUse']
+        for content_block in response_message['content']
+        if 'toolUse' in content_block
+    ]
+
+    if len(tool_use_blocks) > 1:
+        tool_results = list(tool_executor.map(tracer.propagate(run_tool), tool_use_blocks))
+    else:
+        tool_results = [run_tool(tool_use_block) for tool_use_block in tool_use_blocks]
+
+    follow_up_content_blocks = [tool_result for tool_result in tool_results if tool_result is not None]
 
     if follow_up_content_blocks:
         follow_up_message = {
@@ -298,21 +399,26 @@ def run_loop(prompt, system_prompts):
         }
     ]
 
-    while continue_loop:
-        response = call_bedrock(message_list, system_prompts, tool_list)
-        response_message = response['output']['message']
-        message_list.append(response_message)
-        loop_count += 1
-
-        if loop_count >= MAX_LOOPS:
-            print(f"Hit loop limit: {loop_count}")
-            break
-
-        follow_up_message = handle_response(response_message)
-
-        if follow_up_message is None:
-            continue_loop = False
-        else:
-            message_list.append(follow_up_message)
+    with tracer.span('run_loop') as loop_span:
+        while continue_loop:
+            with tracer.span('run_loop_iteration', iteration=loop_count + 1) as span:
+                response = call_bedrock(message_list, system_prompts, tool_list)
+                response_message = response['output']['message']
+                message_list.append(response_message)
+                loop_count += 1
+                span.record_usage(response)
+                span.set(tools_requested=sum('toolUse' in block for block in response_message['content']))
+
+                if loop_count >= MAX_LOOPS:
+                    loop_span.set(hit_loop_limit=True)
+                    break
+
+                follow_up_message = handle_response(response_message)
+
+                if follow_up_message is None:
+                    continue_loop = False
+                else:
+                    message_list.append(follow_up_message)
+        loop_span.set(iterations=loop_count)
 
     return message_list
\ No newline at end of file
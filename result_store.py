@@ -0,0 +1,183 @@
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResultStore:
+    """
+    In-process store for retrieved context DataFrames. Tools hand the model a short
+    handle instead of the full CSV, and later tools resolve the handle locally, so the
+    retrieved complaints never pass through the model's input or output tokens.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600):
+        """
+        Parameters:
+        max_entries (int): Maximum number of results kept; least recently used are dropped.
+        ttl_seconds (float): Time after which a result expires.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, context_df):
+        """
+        Stores a result and returns its handle, e.g. 'ctx_3f9a1c2b'.
+        """
+        handle = f'ctx_{uuid.uuid4().hex[:8]}'
+        with self._lock:
+            self._entries[handle] = (time.monotonic(), context_df)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return handle
+
+    def get(self, handle):
+        """
+        Resolves a handle to its DataFrame.
+
+        Raises:
+        KeyError: If the handle is unknown or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._entries.pop(handle, None)
+                raise KeyError(f"Unknown or expired context handle: {handle}")
+            self._entries.move_to_end(handle)
+            return entry[1]
+
+
+def normalise_filter(metadata_filter):
+    """
+    Canonical form of a metadata filter for cache keys: keys sorted, strings case-folded
+    and lists sorted, so filters that resolve to the same complaints share a key (category
+    values match case-insensitively, see MetadataIndex.resolve).
+
+    Returns:
+    str: JSON text of the normalised filter ('{}' for no filter).
+    """
+    def normalise(value):
+        if isinstance(value, dict):
+            return {str(key): normalise(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple, set)):
+            return sorted((normalise(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+        if isinstance(value, str):
+            return ' '.join(value.split()).casefold()
+        return value
+    return json.dumps(normalise(metadata_filter or {}), sort_keys=True, default=str)
+
+
+class RetrievalCache:
+    """
+    TTL + LRU cache of retrieved context DataFrames, keyed by the normalised metadata
+    filter, the search mode and the query. Queries are compared by embedding: a lookup
+    hits an entry whose query embedding is nearly identical (cosine similarity of at least
+    min_similarity), so rephrasings that embed the same reuse the result. Lexical queries
+    have no embedding and are compared by their normalised text. An entry serves any k up
+    to the k it was retrieved with.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=900, min_similarity=0.98):
+        """
+        Parameters:
+        max_entries (int): Maximum number of results kept; least recently used are dropped.
+        ttl_seconds (float): Time after which a result expires.
+        min_similarity (float): Cosine similarity two query embeddings need to share a result.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.min_similarity = min_similarity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(query_vector):
+        if query_vector is None:
+            return None
+        vector = np.asarray(query_vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _matches(self, entry, key, unit, query_text, k):
+        if entry['key'] != key or entry['k'] < k:
+            return False
+        if unit is None or entry['unit'] is None:
+            return unit is None and entry['unit'] is None and entry['query_text'] == query_text
+        return float(entry['unit'] @ unit) >= self.min_similarity
+
+    def get(self, metadata_filter, k, mode='vector', query_vector=None, query_text=None):
+        """
+        Looks up a result.
+
+        Parameters:
+        metadata_filter (dict): The metadata filter of the query.
+        k (int): Number of complaints wanted.
+        mode (str): The search mode (see retrieval.SEARCH_MODES).
+        query_vector (np.ndarray): The query embedding, or None for lexical queries.
+        query_text (str): The normalised query, compared when there is no embedding.
+
+        Returns:
+        pd.DataFrame: The first k rows of the cached result, or None.
+        """
+        key = (normalise_filter(metadata_filter), mode)
+        unit = self._unit(query_vector)
+        now = time.monotonic()
+        with self._lock:
+            for entry_id, entry in list(self._entries.items()):
+                if now - entry['time'] > self.ttl_seconds:
+                    del self._entries[entry_id]
+                elif self._matches(entry, key, unit, query_text, k):
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry['context_df'].head(k)
+            self.misses += 1
+            return None
+
+    def put(self, metadata_filter, k, context_df, mode='vector', query_vector=None, query_text=None):
+        """
+        Stores the result of a query (see get for the parameters).
+        """
+        entry = {
+            'key': (normalise_filter(metadata_filter), mode),
+            'k': k,
+            'unit': self._unit(query_vector),
+            'query_text': query_text,
+            'time': time.monotonic(),
+            'context_df': context_df,
+        }
+        with self._lock:
+            self._entries[next(self._ids)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def preview_records(context_df, rows=3, max_chars=200):
+    """
+    Small JSON-safe preview of a result for the model: the first rows with the complaint
+    text shortened and the score column left out.
+
+    Parameters:
+    context_df (pd.DataFrame): The retrieved complaints.
+    rows (int): Number of rows in the preview.
+    max_chars (int): Maximum length of each complaint_text.
+
+    Returns:
+    list: One dict of strings per preview row.
+    """
+    preview = context_df.head(rows).drop(columns=['score'], errors='ignore').astype(str)
+    if 'complaint_text' in preview.columns:
+        preview['complaint_text'] = preview['complaint_text'].str.slice(0, max_chars)
+    return preview.to_dict('records')
@@ -0,0 +1,377 @@
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from ann_index import search_parameters
+from complaint_store import TEXT_COLUMN
+from lexical_index import tokenize
+from metadata_index import CATEGORY_COLUMNS, DATE_COLUMN
+from tracing import tracer
+
+# Columns of the DataFrame returned by search_complaints
+RESULT_COLUMNS = CATEGORY_COLUMNS + [DATE_COLUMN, 'complaint_text', 'score']
+
+# Filters matching at most this many complaints are searched on the exact index even when
+# the store has an approximate one: graph / cluster search misses too much under narrow filters
+EXACT_SEARCH_MAX_CANDIDATES = 50000
+
+# vector  - Titan embedding similarity (one embedding call per query)
+# lexical - BM25 over the inverted index of complaint_text (see lexical_index), no embedding call
+# hybrid  - both rankings fused with reciprocal rank fusion
+SEARCH_MODES = ['vector', 'lexical', 'hybrid']
+
+# Set to one of SEARCH_MODES to change the default. Vector stays the default so scores
+# remain L2 distances unless lexical or hybrid search is asked for
+SEARCH_MODE_ENV = 'COMPLAINTS_SEARCH_MODE'
+DEFAULT_SEARCH_MODE = 'vector'
+
+# Reciprocal rank fusion constant, and how deep each ranking is read before fusing
+RRF_K = 60
+HYBRID_CANDIDATES = 200
+
+# Quoted phrases ("supply chain") must appear literally in the results
+PHRASE_PATTERN = re.compile(r'"([^"]+)"|\u201c([^\u201d]+)\u201d')
+
+
+def embed_query(vector_store, user_prompt):
+    """
+    Embeds a query the same way the langchain FAISS store does (including L2
+    normalisation when the store was built with it).
+
+    Returns:
+    np.ndarray: float32 array of shape (1, d).
+    """
+    with tracer.span('query_embedding', chars=len(user_prompt)):
+        query_vector = np.array([vector_store.embedding_function.embed_query(user_prompt)], dtype=np.float32)
+        if vector_store._normalize_L2:
+            faiss.normalize_L2(query_vector)
+    return query_vector
+
+
+def embed_queries(vector_store, user_prompts, max_workers=8):
+    """
+    Embeds several queries. Titan takes one text per request, so the distinct texts are
+    embedded concurrently rather than in one call, and repeated texts only once.
+
+    Returns:
+    np.ndarray: float32 array of shape (len(user_prompts), d).
+    """
+    unique_prompts = list(dict.fromkeys(user_prompts))
+    if not unique_prompts:
+        return np.zeros((0, vector_store.index.d), dtype=np.float32)
+    with tracer.span('query_embedding', queries=len(user_prompts), unique_queries=len(unique_prompts)):
+        embed = vector_store.embedding_function.embed_query
+        if len(unique_prompts) == 1:
+            vectors = [embed(unique_prompts[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_prompts))) as executor:
+                vectors = list(executor.map(embed, unique_prompts))
+        by_prompt = dict(zip(unique_prompts, vectors))
+        query_vectors = np.array([by_prompt[prompt] for prompt in user_prompts], dtype=np.float32)
+        if vector_store._normalize_L2:
+            faiss.normalize_L2(query_vectors)
+    return query_vectors
+
+
+def resolve_filter(metadata_index, metadata_filter):
+    """
+    Resolves a metadata filter to the sorted FAISS ids of the matching complaints.
+
+    Returns:
+    np.ndarray: The ids, or None when there is no filter (all complaints match).
+    """
+    with tracer.span('metadata_filter') as span:
+        ids = metadata_index.resolve(metadata_filter) if metadata_filter else None
+        span.set(filtered=ids is not None, candidates=len(ids) if ids is not None else None)
+    return ids
+
+
+def search_vectors(vector_store, query_vectors, ids=None, k=100):
+    """
+    Searches several query vectors restricted to the same ids with a single
+    index.search call. The ids are passed to FAISS as an id selector, so only matching
+    rows are scored and each query gets min(k, len(ids)) results. If the store has an
+    approximate index it is used for unfiltered and broad searches; narrow filters are
+    searched exactly.
+
+    Parameters:
+    vector_store (ComplaintStore): The complaints vector store.
+    query_vectors (np.ndarray): float32 array of shape (n, d).
+    ids (np.ndarray): FAISS ids to search, from resolve_filter, or None for all.
+    k (int): Number of complaints to return per query.
+
+    Returns:
+    list: One (positions, scores) pair of arrays per query, most similar first. Scores
+        are L2 distances (approximate for product-quantised indexes).
+    """
+    limit = vector_store.index.ntotal if ids is None else len(ids)
+    k = min(int(k), limit)
+    if k <= 0:
+        return [(np.array([], dtype=np.int64), np.array([], dtype=np.float32)) for _ in range(len(query_vectors))]
+
+    exact = vector_store.ann_config is None or (ids is not None and len(ids) <= EXACT_SEARCH_MAX_CANDIDATES)
+    with tracer.span('vector_search', k=k, candidates=limit, exact=exact, queries=len(query_vectors)) as span:
+        index = vector_store.flat_index if exact else vector_store.index
+        selector = faiss.IDSelectorBatch(ids) if ids is not None else None
+        params = search_parameters(None if exact else vector_store.ann_config, selector)
+        distances, positions = index.search(query_vectors, k, params=params)
+        found = positions != -1
+        span.set(results=int(found.sum()))
+    return [(positions[i][found[i]], distances[i][found[i]]) for i in range(len(query_vectors))]
+
+
+def search_mode(user_prompt, mode=None):
+    """
+    Picks the search mode of a query: the given mode, else lexical for queries with
+    quoted phrases, else COMPLAINTS_SEARCH_MODE or DEFAULT_SEARCH_MODE.
+
+    Returns:
+    str: One of SEARCH_MODES.
+    """
+    if mode is None:
+        if PHRASE_PATTERN.search(user_prompt):
+            mode = 'lexical'
+        else:
+            mode = os.environ.get(SEARCH_MODE_ENV, DEFAULT_SEARCH_MODE)
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"mode must be one of {SEARCH_MODES}, got {mode!r}")
+    return mode
+
+
+def candidate_count(mode, k):
+    """
+    Returns:
+    int: Number of vector results a query needs before fusing (k unless hybrid).
+    """
+    return max(int(k), HYBRID_CANDIDATES) if mode == 'hybrid' else int(k)
+
+
+def match_phrases(vector_store, positions, scores, phrases, k):
+    """
+    Keeps the results whose text contains every phrase (as consecutive terms), reading
+    the texts in rank order until k results are found.
+    """
+    kept = []
+    step = max(2 * k, 100)
+    for start in range(0, len(positions), step):
+        texts = vector_store.docstore.get_columns([TEXT_COLUMN], positions[start:start + step])[TEXT_COLUMN]
+        for offset, text in enumerate(texts):
+            terms = f" {' '.join(tokenize(text))} "
+            if all(f" {' '.join(phrase)} " in terms for phrase in phrases):
+                kept.append(start + offset)
+        if len(kept) >= k:
+            break
+    kept = np.array(kept[:k], dtype=np.int64)
+    return positions[kept], scores[kept]
+
+
+def search_lexical(vector_store, user_prompt, ids=None, k=100):
+    """
+    BM25 search over complaint_text, restricted to the ids. Needs no embedding call.
+    Quoted phrases in the query must appear in every result.
+
+    Parameters:
+    vector_store (ComplaintStore): The complaints vector store.
+    user_prompt (str): The user's query.
+    ids (np.ndarray): FAISS ids to search, from resolve_filter, or None for all.
+    k (int): Number of complaints to return.
+
+    Returns:
+    tuple: (positions, BM25 scores) arrays, best match first.
+    """
+    phrases = [tokenize(first or second) for first, second in PHRASE_PATTERN.findall(user_prompt)]
+    phrases = [phrase for phrase in phrases if phrase]
+    with tracer.span('lexical_search', k=k, phrases=len(phrases)) as span:
+        required = [term for phrase in phrases for term in phrase]
+        check_order = any(len(phrase) > 1 for phrase in phrases)
+        positions, scores = vector_store.lexical_index.search(
+            tokenize(user_prompt), ids, None if check_order else k, required)
+        span.set(matches=len(positions))
+        if check_order:
+            positions, scores = match_phrases(vector_store, positions, scores, phrases, k)
+        span.set(results=len(positions))
+    return positions, scores
+
+
+def fuse_rankings(rankings, k, rrf_k=RRF_K):
+    """
+    Reciprocal rank fusion: each complaint scores the sum of 1 / (rrf_k + rank) over the
+    rankings it appears in, so complaints ranked well by both searches come first.
+
+    Parameters:
+    rankings (list): Arrays of FAISS positions, best first.
+    k (int): Number of complaints to return.
+
+    Returns:
+    tuple: (positions, fused scores) arrays, best first.
+    """
+    rankings = [np.asarray(ranking, dtype=np.int64) for ranking in rankings]
+    if not sum(len(ranking) for ranking in rankings):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+    weights = np.concatenate([1.0 / (rrf_k + np.arange(1, len(ranking) + 1)) for ranking in rankings])
+    positions, inverse = np.unique(np.concatenate(rankings), return_inverse=True)
+    scores = np.bincount(inverse, weights=weights).astype(np.float32)
+    order = np.lexsort((positions, -scores))[:k]
+    return positions[order], scores[order]
+
+
+def finish_search(vector_store, user_prompt, mode, ids, k, vector_hits=None):
+    """
+    Turns the vector search results of a query into its final results, running the
+    lexical search (and the fusion) that lexical and hybrid mode need.
+
+    Parameters:
+    vector_store (ComplaintStore): The complaints vector store.
+    user_prompt (str): The user's query.
+    mode (str): One of SEARCH_MODES.
+    ids (np.ndarray): FAISS ids to search, from resolve_filter, or None for all.
+    k (int): Number of complaints to return.
+    vector_hits (tuple): (positions, scores) from search_vectors with candidate_count(mode, k)
+        results, or None in lexical mode.
+
+    Returns:
+    tuple: (positions, scores) arrays, best first. Lower scores are better in every mode:
+        L2 distance for vector, negated BM25 for lexical and negated RRF score for hybrid.
+    """
+    k = int(k)
+    if mode == 'vector':
+        positions, scores = vector_hits
+        return positions[:k], scores[:k]
+    lexical_positions, lexical_scores = search_lexical(vector_store, user_prompt, ids, candidate_count(mode, k))
+    if mode == 'lexical':
+        return lexical_positions[:k], -lexical_scores[:k]
+    positions, scores = fuse_rankings([vector_hits[0], lexical_positions], k)
+    return positions, -scores
+
+
+def search_ids(vector_store, metadata_index, user_prompt, metadata_filter=None, k=100, mode=None):
+    """
+    Searches the complaints, restricted up front to the rows matching the metadata
+    filter, by vector similarity (see search_vectors), BM25 or both (see SEARCH_MODES).
+
+    Parameters:
+    vector_store (ComplaintStore): The complaints vector store.
+    metadata_index (MetadataIndex): Metadata index aligned with the vector store.
+    user_prompt (str): The user's query.
+    metadata_filter (dict): Optional metadata filter, see MetadataIndex.resolve.
+    k (int): Number of complaints to return.
+    mode (str): One of SEARCH_MODES, defaults to search_mode(user_prompt).
+
+    Returns:
+    tuple: (positions, scores) arrays, best first (lower scores are better).
+    """
+    mode = search_mode(user_prompt, mode)
+    ids = resolve_filter(metadata_index, metadata_filter)
+    if int(k) <= 0 or (ids is not None and len(ids) == 0):
+        # Nothing can match, so skip the embedding call
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+    vector_hits = None
+    if mode != 'lexical':
+        query_vector = embed_query(vector_store, user_prompt)
+        vector_hits = search_vectors(vector_store, query_vector, ids, candidate_count(mode, k))[0]
+    return finish_search(vector_store, user_prompt, mode, ids, k, vector_hits)
+
+
+def search_many(vector_store, metadata_index, queries, max_workers=8):
+    """
+    Runs many searches together: the distinct texts of the queries that need an embedding
+    are embedded concurrently (see embed_queries), and queries sharing a metadata filter
+    are searched with a single index.search call. A query that fails (e.g. on a bad
+    filter) does not fail the others.
+
+    Parameters:
+    vector_store (ComplaintStore): The complaints vector store.
+    metadata_index (MetadataIndex): Metadata index aligned with the vector store.
+    queries (list): (user_prompt, metadata_filter, k, mode) tuples; a mode of None picks
+        search_mode(user_prompt).
+    max_workers (int): Number of concurrent embedding calls.
+
+    Returns:
+    list: For each query, its (positions, scores) arrays as search_ids returns them, or the
+        exception it raised.
+    """
+    results = [None] * len(queries)
+    modes, ks = [None] * len(queries), [0] * len(queries)
+    groups = {}
+    for i, (user_prompt, metadata_filter, k, mode) in enumerate(queries):
+        try:
+            modes[i], ks[i] = search_mode(user_prompt, mode), int(k)
+        except (TypeError, ValueError) as e:
+            results[i] = e
+            continue
+        groups.setdefault(json.dumps(metadata_filter or {}, sort_keys=True, default=str), []).append(i)
+
+    empty = (np.array([], dtype=np.int64), np.array([], dtype=np.float32))
+    with tracer.span('batch_search', queries=len(queries), filter_groups=len(groups)):
+        group_ids = {}
+        for key, members in list(groups.items()):
+            try:
+                group_ids[key] = resolve_filter(metadata_index, queries[members[0]][1])
+            except Exception as e:
+                for i in groups.pop(key):
+                    results[i] = e
+
+        # Lexical queries, and queries that cannot match anything, need no embedding
+        to_embed = [i for key, members in groups.items()
+                    if group_ids[key] is None or len(group_ids[key])
+                    for i in members if modes[i] != 'lexical' and ks[i] > 0]
+        query_vectors = embed_queries(vector_store, [queries[i][0] for i in to_embed], max_workers=max_workers)
+        vector_row = {i: row for row, i in enumerate(to_embed)}
+
+        for key, members in groups.items():
+            ids = group_ids[key]
+            vector_hits = {}
+            vector_members = [i for i in members if i in vector_row]
+            if vector_members:
+                k = max(candidate_count(modes[i], ks[i]) for i in vector_members)
+                rows = [vector_row[i] for i in vector_members]
+                vector_hits = dict(zip(vector_members, search_vectors(vector_store, query_vectors[rows], ids, k)))
+            for i in members:
+                if ks[i] <= 0 or (ids is not None and not len(ids)):
+                    results[i] = empty
+                else:
+                    results[i] = finish_search(vector_store, queries[i][0], modes[i], ids, ks[i], vector_hits.get(i))
+    return results
+
+
+def build_results(vector_store, positions, scores):
+    """
+    Builds the result DataFrame for a set of FAISS positions, reading just those rows
+    straight from the columns of the docstore.
+
+    Parameters:
+    vector_store (ComplaintStore): The complaints vector store.
+    positions (np.ndarray): FAISS positions of the results.
+    scores (np.ndarray): Score of each result.
+
+    Returns:
+    pd.DataFrame: One row per result with the metadata, complaint_text and score columns.
+    """
+    with tracer.span('dataframe_build', rows=len(positions)):
+        columns = vector_store.docstore.get_columns(RESULT_COLUMNS[:-1], positions)
+        columns['score'] = np.asarray(scores, dtype=np.float32)
+        return pd.DataFrame(columns, columns=RESULT_COLUMNS)
+
+
+def search_complaints(vector_store, metadata_index, user_prompt, metadata_filter=None, k=100, mode=None):
+    """
+    Retrieves the complaints that best match the query and match the metadata filter.
+
+    Parameters:
+    vector_store (ComplaintStore): The complaints vector store.
+    metadata_index (MetadataIndex): Metadata index aligned with the vector store.
+    user_prompt (str): The user's query.
+    metadata_filter (dict): Optional metadata filter, see MetadataIndex.resolve.
+    k (int): Number of complaints to return.
+    mode (str): One of SEARCH_MODES, defaults to search_mode(user_prompt).
+
+    Returns:
+    pd.DataFrame: The retrieved complaints with their scores, best first.
+    """
+    positions, scores = search_ids(vector_store, metadata_index, user_prompt, metadata_filter, k, mode)
+    return build_results(vector_store, positions, scores)
@@ -0,0 +1,336 @@
+"""
+Local retrieval service that owns the complaints index and batches concurrent queries.
+
+Queries arriving within a short window are handled together: their distinct texts are
+embedded concurrently (Titan takes one text per request) and queries sharing the same
+metadata filter are searched with a single index.search call. Lexical queries skip the
+embedding altogether. The RAG modules use the
+service as a client when COMPLAINTS_RETRIEVAL_URL is set, and search in-process otherwise.
+
+Usage:
+    python retrieval_service.py --port 8765                       # COMPLAINTS_RETRIEVAL_URL=http://127.0.0.1:8765
+    python retrieval_service.py --socket /tmp/complaints.sock     # COMPLAINTS_RETRIEVAL_URL=unix:///tmp/complaints.sock
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from complaint_store import STORE_PATH, get_complaint_store
+from retrieval import RESULT_COLUMNS, build_results, search_complaints, search_many, search_mode
+from tracing import tracer
+
+# Set to the service address (http://host:port or unix:///path) to retrieve through it
+RETRIEVAL_URL_ENV = 'COMPLAINTS_RETRIEVAL_URL'
+
+DEFAULT_PORT = 8765
+
+# How long the first query of a batch waits for others to join it
+DEFAULT_BATCH_WINDOW_MS = 5
+DEFAULT_MAX_BATCH_SIZE = 64
+
+# Listen backlog; the socketserver default of 5 refuses bursts of concurrent clients
+REQUEST_QUEUE_SIZE = 128
+
+
+class QueryBatcher:
+    """
+    Collects queries from many threads and runs them in batches on one worker thread.
+    A batch closes when the window since its first query has passed or it is full, and
+    while a batch runs the next one fills up, so batches grow with the load.
+    """
+
+    def __init__(self, vector_store, window_seconds=DEFAULT_BATCH_WINDOW_MS / 1000,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE, embed_workers=8):
+        self.vector_store = vector_store
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.embed_workers = embed_workers
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='query-batcher', daemon=True)
+        self._worker.start()
+
+    def search(self, user_prompt, metadata_filter=None, k=100, mode=None):
+        """
+        Queues a query and waits for its batch.
+
+        Returns:
+        tuple: (positions, scores) arrays, as retrieval.search_ids.
+        """
+        future = Future()
+        self._queue.put(((user_prompt, metadata_filter, int(k), search_mode(user_prompt, mode)), future))
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, batch):
+        with tracer.span('service_batch', batch_size=len(batch)):
+            results = search_many(self.vector_store, self.vector_store.metadata_index,
+                                  [query for query, _ in batch], max_workers=self.embed_workers)
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class RetrievalRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /search with {"query": str, "metadata_filter": dict, "k": int, "mode": str} returns the
+    search_complaints columns as JSON. GET /health and GET /metrics (tracer histograms)
+    are also served.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'complaints': self.server.batcher.vector_store.index.ntotal})
+        elif self.path == '/metrics':
+            self._send_json(200, tracer.metrics())
+        else:
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/search':
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            positions, scores = self.server.batcher.search(
+                request['query'], request.get('metadata_filter'), request.get('k', 100), request.get('mode'))
+            results = build_results(self.server.batcher.vector_store, positions, scores)
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_json(400, {'error': repr(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': repr(e)})
+            return
+        columns = {column: results[column].tolist() for column in RESULT_COLUMNS}
+        self._send_json(200, {'columns': columns})
+
+    def log_message(self, format, *args):
+        # Request logging is left to the tracer
+        pass
+
+
+class RetrievalHTTPServer(ThreadingHTTPServer):
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('unix', 0)
+
+
+def serve(store_path=STORE_PATH, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None,
+          batch_window_ms=DEFAULT_BATCH_WINDOW_MS, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    """
+    Opens the complaints store and serves queries until interrupted.
+
+    Parameters:
+    store_path (str): The vector store folder.
+    host (str): Address to listen on over TCP.
+    port (int): TCP port.
+    socket_path (str): Listen on this Unix socket instead of TCP.
+    batch_window_ms (float): How long the first query of a batch waits for others.
+    max_batch_size (int): Maximum queries per batch.
+    """
+    vector_store = get_complaint_store(store_path)
+    # Load everything up front so the first queries do not pay for it
+    vector_store.metadata_index
+    vector_store.lexical_index
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, RetrievalRequestHandler)
+        address = f'unix://{socket_path}'
+    else:
+        server = RetrievalHTTPServer((host, port), RetrievalRequestHandler)
+        address = f'http://{host}:{server.server_address[1]}'
+    server.batcher = QueryBatcher(vector_store, batch_window_ms / 1000, max_batch_size)
+    print(f"Serving {vector_store.index.ntotal} complaints from {store_path} at {address}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RetrievalClient:
+    """
+    Client for the retrieval service. Keeps one persistent connection per thread.
+    """
+
+    def __init__(self, url, timeout=60):
+        """
+        Parameters:
+        url (str): http://host:port or unix:///path/to/socket.
+        timeout (float): Socket timeout in seconds.
+        """
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.url.startswith('unix://'):
+                connection = UnixHTTPConnection(self.url[len('unix://'):], timeout=self.timeout)
+            else:
+                host = self.url.split('://', 1)[-1].rstrip('/')
+                connection = http.client.HTTPConnection(host, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload, default=str) if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = json.loads(response.read())
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server may have closed an idle keep-alive connection; reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"Retrieval service error {response.status}: {data.get('error')}")
+        return data
+
+    def search(self, user_prompt, metadata_filter=None, k=100, mode=None):
+        """
+        Same as retrieval.search_complaints, answered by the service.
+
+        Returns:
+        pd.DataFrame: The retrieved complaints with their scores, best first.
+        """
+        data = self._request('POST', '/search', {'query': user_prompt, 'metadata_filter': metadata_filter,
+                                                 'k': k, 'mode': mode})
+        df = pd.DataFrame(data['columns'], columns=RESULT_COLUMNS)
+        df['score'] = df['score'].astype(np.float32)
+        return df
+
+    def health(self):
+        return self._request('GET', '/health')
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_retrieval_client():
+    """
+    Returns the process-wide client for the service at COMPLAINTS_RETRIEVAL_URL, or
+    None if it is not set.
+    """
+    global _client
+    url = os.environ.get(RETRIEVAL_URL_ENV)
+    if not url:
+        return None
+    if _client is None or _client.url != url:
+        with _client_lock:
+            if _client is None or _client.url != url:
+                _client = RetrievalClient(url)
+    return _client
+
+
+def retrieve(user_prompt, metadata_filter=None, k=100, mode=None):
+    """
+    Retrieves complaints through the retrieval service if one is configured, otherwise
+    from the complaints store in this process.
+
+    Parameters:
+    user_prompt (str): The user's query.
+    metadata_filter (dict): Optional metadata filter, see MetadataIndex.resolve.
+    k (int): Number of complaints to return.
+    mode (str): One of retrieval.SEARCH_MODES, defaults to retrieval.search_mode(user_prompt).
+
+    Returns:
+    pd.DataFrame: The retrieved complaints with their scores, best first.
+    """
+    client = get_retrieval_client()
+    if client is not None:
+        with tracer.span('retrieval_service_call', k=k):
+            return client.search(user_prompt, metadata_filter, k, mode)
+    vector_store = get_complaint_store()
+    return search_complaints(vector_store, vector_store.metadata_index, user_prompt, metadata_filter, k, mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve complaint retrieval with cross-request batching.")
+    parser.add_argument('--store-path', default=STORE_PATH)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--socket', help="Listen on this Unix socket instead of TCP")
+    parser.add_argument('--batch-window-ms', type=float, default=DEFAULT_BATCH_WINDOW_MS)
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    serve(args.store_path, args.host, args.port, args.socket, args.batch_window_ms, args.max_batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import streamlit as st
-from rag_functions import getContext, getResponse
+from rag_functions import getResponseStream, getSessionContext
 def main():
     st.title("Complaint Query Chatbot")
     
@@ -15,12 +15,13 @@ def main():
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        context = getContext(prompt.lower())
-        response = getResponse(prompt.lower(),context)
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        # Follow-ups refine the previous complaints; repeated questions come from the result caches
+        context = getSessionContext(prompt.lower(), st.session_state)
         
+        # Render the answer as it is generated, then keep the full text in the history
         with st.chat_message("assistant"):
-            st.markdown(response)
+            response = st.write_stream(getResponseStream(prompt.lower(),context))
+        st.session_state.messages.append({"role": "assistant", "content": response})
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
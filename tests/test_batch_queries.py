@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import batch_queries
+from filter_parser import DEFAULT_K
+
+QUERIES = [
+    {'id': 'q1', 'query': "late payments in MC"},
+    {'id': 'q2', 'query': "bad query that always fails"},
+    {'id': 'q3', 'query': "portal outages"},
+]
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    searched = []
+
+    def search_many(vector_store, metadata_index, requests):
+        searched.append([request[0] for request in requests])
+        if any(request[0].startswith('bad') for request in requests):
+            raise RuntimeError("search failed")
+        return [(np.array([0]), np.array([0.5], dtype=np.float32)) for _ in requests]
+
+    def build_results(vector_store, positions, scores):
+        return pd.DataFrame({'complaint_text': ['Payment delayed'], 'score': scores})
+
+    monkeypatch.setattr(batch_queries, 'get_complaint_store', lambda: type('Store', (), {'metadata_index': None})())
+    monkeypatch.setattr(batch_queries, 'search_many', search_many)
+    monkeypatch.setattr(batch_queries, 'build_results', build_results)
+    monkeypatch.setattr(batch_queries, 'extract_all_filters',
+                        lambda queries, rate_limiter: [(None, DEFAULT_K) for _ in queries])
+    monkeypatch.setattr(batch_queries.rag_functions, 'getResponse',
+                        lambda query, context_df, rate_limiter=None: f"answer to {query}")
+    return searched
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_failing_query_is_recorded_and_retried(tmp_path, fake_pipeline):
+    output_path = str(tmp_path / 'answers.jsonl')
+    summary = batch_queries.run_batch(QUERIES, output_path)
+
+    assert (summary['answered'], summary['failed']) == (2, 1)
+    records = {record['id']: record for record in read_records(output_path)}
+    assert records['q1']['answer'] == "answer to late payments in MC"
+    assert records['q3']['rows'] == 1
+    assert set(records['q2']) == {'id', 'query', 'error'}
+    assert 'search failed' in records['q2']['error']
+    assert batch_queries.completed_ids(output_path) == {'q1', 'q3'}
+
+    # A rerun only retries the failed query
+    fake_pipeline.clear()
+    summary = batch_queries.run_batch(QUERIES, output_path)
+    assert (summary['skipped'], summary['answered'], summary['failed']) == (2, 0, 1)
+    assert {query for requests in fake_pipeline for query in requests} == {QUERIES[1]['query']}
+    assert [record['id'] for record in read_records(output_path)].count('q2') == 2
+
+
+def test_rerun_after_fix_answers_remaining_query(tmp_path, fake_pipeline):
+    output_path = str(tmp_path / 'answers.jsonl')
+    batch_queries.run_batch(QUERIES, output_path)
+    fixed = [dict(query, query="good query") if query['id'] == 'q2' else query for query in QUERIES]
+    summary = batch_queries.run_batch(fixed, output_path)
+    assert (summary['answered'], summary['failed']) == (1, 0)
+    assert batch_queries.completed_ids(output_path) == {'q1', 'q2', 'q3'}
+
+
+def test_read_queries_formats(tmp_path):
+    (tmp_path / 'q.txt').write_text("# monthly\nlate payments\n\nportal outages\n", encoding='utf-8')
+    (tmp_path / 'q.jsonl').write_text('{"id": "a", "query": "late payments"}\n', encoding='utf-8')
+    (tmp_path / 'q.csv').write_text('id,query\nb,portal outages\n', encoding='utf-8')
+    assert batch_queries.read_queries(str(tmp_path / 'q.txt')) == [
+        {'id': '0', 'query': 'late payments'}, {'id': '1', 'query': 'portal outages'}]
+    assert batch_queries.read_queries(str(tmp_path / 'q.jsonl')) == [{'id': 'a', 'query': 'late payments'}]
+    assert batch_queries.read_queries(str(tmp_path / 'q.csv')) == [{'id': 'b', 'query': 'portal outages'}]
+    with pytest.raises(ValueError):
+        batch_queries.normalise_queries([{'id': 'x', 'query': 'a'}, {'id': 'x', 'query': 'b'}])
@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+from aggregates import OTHER_GROUP, ComplaintAggregates
+from benchmarks.fake_bedrock import hash_embedding
+from build_vector_store import METADATA_COLUMNS, TEXT_COLUMN, ingest_csv
+from complaint_store import ComplaintStore
+
+DIMENSION = 16
+
+ROWS = [
+    ('Alpha Prime Inc.', 'MC', 'Payments', '2024-05-03', 'Payment to a supplier was delayed by three days.'),
+    ('Beta Holdings Ltd.', 'LC', 'Digital Channel', '2024-05-20', 'The online portal was down all morning.'),
+    ('Alpha Prime Inc.', 'MC', 'Payments', '2024-06-10', 'An international transfer was returned without reason.'),
+    ('Gamma Group', 'ICB', 'Customer Service', '2024-07-01', 'Nobody answered the support line for two days.'),
+    ('Beta Holdings Ltd.', 'LC', 'Payments', '2023-12-31', 'A direct debit was taken twice this month.'),
+]
+
+
+class HashEmbeddings:
+    """
+    Deterministic stand-in for BedrockEmbeddings.
+    """
+
+    def embed_documents(self, texts):
+        return [hash_embedding(text, DIMENSION) for text in texts]
+
+    def embed_query(self, text):
+        return hash_embedding(text, DIMENSION)
+
+
+def write_csv(path, rows):
+    pd.DataFrame(rows, columns=METADATA_COLUMNS + [TEXT_COLUMN]).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    store_path = str(tmp_path / 'complaints.vs')
+    ingest_csv(write_csv(tmp_path / 'build.csv', ROWS), store_path, embeddings=HashEmbeddings(), resume=False)
+    return store_path
+
+
+def test_build(store_path):
+    store = ComplaintStore.load(store_path, HashEmbeddings())
+    assert store.index.ntotal == len(ROWS)
+    assert store.docstore.get_columns([TEXT_COLUMN])[TEXT_COLUMN] == [row[-1] for row in ROWS]
+
+
+def test_delete_with_duplicate_rows(tmp_path, store_path):
+    # The same complaint twice in one chunk and again in the next one
+    csv_path = write_csv(tmp_path / 'delete.csv', [ROWS[0], ROWS[0], ROWS[3], ROWS[0]])
+    ingest_csv(csv_path, store_path, embeddings=HashEmbeddings(), mode='delete', chunk_size=3)
+
+    store = ComplaintStore.load(store_path, HashEmbeddings())
+    assert store.index.ntotal == len(ROWS) - 2
+    assert store.docstore.get_columns([TEXT_COLUMN])[TEXT_COLUMN] == [ROWS[1][-1], ROWS[2][-1], ROWS[4][-1]]
+    counts = store.aggregates.query(['client_region'])
+    assert dict(zip(counts['client_region'], counts['complaint_count'])) == {'LC': 2, 'MC': 1}
+
+
+@pytest.mark.parametrize('mode, rows', [
+    ('append', [('Delta Partners', 'MC', 'Payments', '2024-08-02', 'Card payments were declined at the terminal.')]),
+    ('upsert', ROWS[1:] + [('Delta Partners', 'MC', 'Payments', '2024-08-02', 'Card payments were declined.')]),
+    ('delete', [ROWS[0], ROWS[4]]),
+])
+def test_aggregates_after_update(tmp_path, store_path, mode, rows):
+    ingest_csv(write_csv(tmp_path / f'{mode}.csv', rows), store_path, embeddings=HashEmbeddings(), mode=mode)
+
+    store = ComplaintStore.load(store_path, HashEmbeddings())
+    total = store.index.ntotal
+    counts = store.aggregates.query(['client_name'], top=1)
+    assert len(counts) == 2 and counts['client_name'].iloc[-1] == OTHER_GROUP
+    assert counts['complaint_count'].sum() == total
+    filtered = store.aggregates.query(['theme'], {'client_region': 'MC'}, top=1)
+    assert filtered['complaint_count'].sum() == len(store.metadata_index.resolve({'client_region': 'MC'}))
+    # The incrementally updated counts match counts rebuilt from the store
+    assert store.aggregates.counts == ComplaintAggregates.from_metadata_index(store.metadata_index).counts
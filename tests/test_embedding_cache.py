@@ -0,0 +1,87 @@
+import pytest
+
+from benchmarks.fake_bedrock import hash_embedding
+from embedding_cache import ACCESS_FLUSH_SIZE, CachedEmbeddings
+
+
+class CountingEmbeddings:
+    model_id = 'test-model'
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return hash_embedding(text, 8)
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [hash_embedding(text, 8) for text in texts]
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'embeddings.db')
+
+
+def test_miss_then_hits(cache_path):
+    embeddings = CountingEmbeddings()
+    cache = CachedEmbeddings(embeddings, cache_path=cache_path)
+    vector = cache.embed_query("Late payments")
+    assert cache.embed_query("late   PAYMENTS") == pytest.approx(vector)
+    assert embeddings.calls == 1
+    assert (cache.misses, cache.memory_hits) == (1, 1)
+
+    # A new process finds it on disk
+    reopened = CachedEmbeddings(embeddings, cache_path=cache_path)
+    assert reopened.embed_query("late payments") == pytest.approx(vector)
+    assert (reopened.disk_hits, embeddings.calls) == (1, 1)
+
+
+def test_embed_documents_only_embeds_misses(cache_path):
+    embeddings = CountingEmbeddings()
+    cache = CachedEmbeddings(embeddings, cache_path=cache_path)
+    cache.embed_query("a")
+    vectors = cache.embed_documents(["a", "b", "c"])
+    assert vectors == [pytest.approx(hash_embedding(text, 8)) for text in "abc"]
+    assert embeddings.calls == 2 and cache.stats()['disk_entries'] == 3
+
+
+def test_eviction_uses_pending_access_times(cache_path):
+    embeddings = CountingEmbeddings()
+    cache = CachedEmbeddings(embeddings, cache_path=cache_path, max_memory_entries=1, max_disk_entries=2)
+    cache.embed_query("first")
+    cache.embed_query("second")
+    # Read "first" from disk; its access time is only held in memory so far
+    cache.embed_query("first")
+    assert cache.disk_hits == 1
+    cache.embed_query("third")
+
+    assert cache.stats()['disk_entries'] == 2
+    reopened = CachedEmbeddings(embeddings, cache_path=cache_path)
+    calls = embeddings.calls
+    reopened.embed_documents(["first", "third"])
+    assert embeddings.calls == calls
+    reopened.embed_query("second")
+    assert embeddings.calls == calls + 1
+
+
+def test_access_times_are_flushed_in_batches(cache_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), cache_path=cache_path)
+    cache.embed_query("a")
+    for _ in range(ACCESS_FLUSH_SIZE - 2):
+        cache.embed_query("a")
+    assert len(cache._accessed) == 1
+    cache.flush()
+    assert not cache._accessed
+
+
+def test_write_failure_still_returns_embedding(cache_path, capsys):
+    embeddings = CountingEmbeddings()
+    cache = CachedEmbeddings(embeddings, cache_path=cache_path)
+    cache._db.execute("DROP TABLE embeddings")
+    assert cache.embed_query("late payments") == pytest.approx(hash_embedding("late payments", 8))
+    assert "Embedding cache write failed" in capsys.readouterr().out
+    # Still served from memory
+    cache.embed_query("late payments")
+    assert embeddings.calls == 1
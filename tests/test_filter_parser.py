@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from filter_parser import DEFAULT_K, FilterParser
+from metadata_index import MetadataIndex
+
+RECORDS = [
+    {'client_name': 'Alpha Prime Inc.', 'client_region': 'MC', 'theme': 'Payments', 'complaint_date': '2024-05-03'},
+    {'client_name': 'Beta Holdings Ltd.', 'client_region': 'LC', 'theme': 'Digital Channel', 'complaint_date': '2024-05-20'},
+    {'client_name': 'Alpha Prime Inc.', 'client_region': 'MC', 'theme': 'Payments', 'complaint_date': '2024-06-10'},
+    {'client_name': 'Gamma Group', 'client_region': 'ICB', 'theme': 'Customer Service', 'complaint_date': '2024-07-01'},
+    {'client_name': 'Beta Holdings Ltd.', 'client_region': 'LC', 'theme': 'Payments', 'complaint_date': '2023-12-31'},
+]
+
+
+@pytest.fixture(scope='module')
+def metadata_index():
+    return MetadataIndex.from_records(RECORDS)
+
+
+@pytest.fixture(scope='module')
+def parser(metadata_index):
+    return FilterParser(metadata_index)
+
+
+@pytest.mark.parametrize('prompt, expected', [
+    ("show me all complaints in region mc", {'client_region': 'MC'}),
+    ("complaints from mid corporate and large corporate", {'client_region': ['MC', 'LC']}),
+    ("complaints in may 2024", {'complaint_date': {'$gte': '2024-05-01', '$lte': '2024-05-31'}}),
+    ("complaints in 2024", {'complaint_date': {'$gte': '2024-01-01', '$lte': '2024-12-31'}}),
+    ("complaints between 2024-05-01 and 2024-05-10", {'complaint_date': {'$gte': '2024-05-01', '$lte': '2024-05-10'}}),
+    ("complaints after 15th june 2024 in lc", {'complaint_date': '>2024-06-15', 'client_region': 'LC'}),
+    ("complaints on 2024-05-03 or on 2024-06-10", {'complaint_date': ['2024-05-03', '2024-06-10']}),
+    ("complaints from alpha prime inc", {'client_name': 'Alpha Prime Inc.'}),
+    ("what are the main issues with payments?", {}),
+])
+def test_parse_filters(parser, prompt, expected):
+    assert parser.parse(prompt) == {'metadata_filter': expected, 'k_filter': DEFAULT_K}
+
+
+@pytest.mark.parametrize('prompt, k', [
+    ("show me 5 complaints in region mc", 5),
+    ("give me the top ten complaints", 10),
+    ("20 complaints about payments", 20),
+    ("show me 1000 complaints", 1000),
+])
+def test_parse_count(parser, prompt, k):
+    assert parser.parse(prompt)['k_filter'] == k
+
+
+@pytest.mark.parametrize('prompt', [
+    # More than one month or year range: the rules cannot express OR across ranges
+    "complaints in may 2024 or in june 2024",
+    "complaints in 2023 or in 2024",
+    # Looks like a filter the rules do not understand
+    "complaints last month",
+    "complaints from the latest quarter",
+    "complaints from alpha prme inc",
+    "complaints on 31/02/2024",
+    # Negations: the rules would filter on the excluded value
+    "show me complaints not in MC",
+    "complaints excluding LC region",
+    "complaints from clients other than alpha prime inc",
+    "complaints outside large corporate",
+    "all complaints apart from ICB",
+    "complaints except payments in mc",
+    # A year, not a count
+    "show me 2024 complaints",
+])
+def test_parse_defers_to_llm(parser, prompt):
+    assert parser.parse(prompt) is None
+
+
+def test_parse_with_leftover(parser):
+    filter_terms, leftover = parser.parse_with_leftover("now only the mc ones about card fraud")
+    assert filter_terms['metadata_filter'] == {'client_region': 'MC'}
+    assert leftover == ['now', 'only', 'ones', 'card', 'fraud']
+
+
+@pytest.mark.parametrize('metadata_filter, expected', [
+    ({'client_region': 'MC'}, [0, 2]),
+    ({'client_region': ['MC', 'ICB']}, [0, 2, 3]),
+    ({'client_region': 'LC', 'theme': 'Payments'}, [4]),
+    ({'client_name': 'alpha prime'}, [0, 2]),
+    ({'complaint_date': '>2024-05-20'}, [2, 3]),
+    ({'complaint_date': '>=2024-05-20'}, [1, 2, 3]),
+    ({'complaint_date': {'$gte': '2024-05-01', '$lte': '2024-05-31'}}, [0, 1]),
+    ({'complaint_date': ['>2024-05-01', '<2024-06-30']}, [0, 1, 2]),
+    ({'complaint_date': ['2024-05-03', '2024-07-01']}, [0, 3]),
+    ({'client_region': 'ICB', 'complaint_date': '<2024-01-01'}, []),
+])
+def test_resolve(metadata_index, metadata_filter, expected):
+    np.testing.assert_array_equal(metadata_index.resolve(metadata_filter), expected)
+
+
+def test_resolve_without_conditions(metadata_index):
+    assert metadata_index.resolve(None) is None
+    assert metadata_index.resolve({}) is None
+
+
+def test_resolve_parsed_filter(parser, metadata_index):
+    filter_terms = parser.parse("show me 2 complaints from large corporate in may 2024")
+    assert filter_terms['k_filter'] == 2
+    np.testing.assert_array_equal(metadata_index.resolve(filter_terms['metadata_filter']), [1])
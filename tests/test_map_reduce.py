@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from context_packer import pack_context, row_tokens, select_columns
+from map_reduce import RateLimiter, map_reduce_partials, needs_map_reduce, shard_context
+
+QUERY = "what are the main issues with payments"
+
+
+def make_context(rows, words=40):
+    texts = [f"complaint {i} " + ' '.join(f"word{i}x{j}" for j in range(words)) for i in range(rows)]
+    return pd.DataFrame({
+        'client_name': [f'Client {i}' for i in range(rows)],
+        'client_region': ['MC'] * rows,
+        'theme': ['Payments'] * rows,
+        'complaint_date': ['2024-05-01'] * rows,
+        'complaint_text': texts,
+        'score': [float(i) for i in range(rows)],
+    })
+
+
+class RecordingGenerate:
+    def __init__(self):
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def __call__(self, system_prompt, user_prompt):
+        with self._lock:
+            self.prompts.append(system_prompt)
+            return f"summary {len(self.prompts)}"
+
+    def count(self, kind):
+        return sum(kind in prompt for prompt in self.prompts)
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.calls += 1
+
+
+def test_shard_context_covers_rows_within_budget():
+    context_df = make_context(60)
+    shards = shard_context(context_df, QUERY, shard_tokens=500)
+    assert len(shards) > 1
+    assert pd.concat(shards).index.tolist() == context_df.index.tolist()
+    columns = select_columns(context_df, QUERY)
+    for shard in shards:
+        assert sum(row_tokens(shard, columns)) <= 500
+        assert not pack_context(shard, QUERY, max_tokens=500)[1]['truncated']
+
+
+def test_shard_context_oversized_row_gets_own_shard():
+    context_df = make_context(3, words=400)
+    assert [len(shard) for shard in shard_context(context_df, QUERY, shard_tokens=100)] == [1, 1, 1]
+
+
+def test_shard_context_empty():
+    assert shard_context(make_context(0), QUERY) == []
+
+
+@pytest.mark.parametrize('fan_in, reduce_calls, partials', [(4, 3, 3), (2, 10, 2), (20, 0, 10)])
+def test_map_reduce_fan_in(fan_in, reduce_calls, partials):
+    context_df = make_context(10, words=40)
+    generate = RecordingGenerate()
+    limiter = CountingLimiter()
+    # One shard per row
+    result = map_reduce_partials(QUERY, context_df, generate, shard_tokens=60, fan_in=fan_in, rate_limiter=limiter)
+    assert generate.count('one part of a larger set') == 10
+    assert generate.count('partial summaries') == reduce_calls
+    assert len(result) == partials
+    # Every call, map and reduce, goes through the limiter
+    assert limiter.calls == 10 + reduce_calls
+
+
+def test_map_reduce_rate_limit():
+    generate = RecordingGenerate()
+    start = time.monotonic()
+    map_reduce_partials(QUERY, make_context(4), generate, shard_tokens=60, requests_per_second=20)
+    # 4 calls spaced 1 / 20 s apart
+    assert time.monotonic() - start >= 0.15
+    assert len(generate.prompts) == 4
+
+
+def test_rate_limiter_spacing():
+    limiter = RateLimiter(50)
+    times = []
+    for _ in range(5):
+        limiter.acquire()
+        times.append(time.monotonic())
+    assert min(b - a for a, b in zip(times, times[1:])) >= 0.018
+    unlimited = RateLimiter()
+    start = time.monotonic()
+    for _ in range(100):
+        unlimited.acquire()
+    assert time.monotonic() - start < 0.05
+
+
+@pytest.mark.parametrize('rows_in, rows_out, duplicates, truncated, expected', [
+    (100, 100, 0, False, False),
+    (100, 95, 0, True, False),
+    (100, 45, 10, True, False),
+    (100, 30, 10, True, True),
+    (0, 0, 0, False, False),
+])
+def test_needs_map_reduce(rows_in, rows_out, duplicates, truncated, expected):
+    stats = {'rows_in': rows_in, 'rows_out': rows_out, 'duplicates_collapsed': duplicates, 'truncated': truncated}
+    assert needs_map_reduce(stats) is expected
@@ -0,0 +1,93 @@
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from complaint_store import DOCUMENT_COLUMNS, TEXT_COLUMN, ColumnarDocstore
+from lexical_index import BM25_B, BM25_K1, LexicalIndex, tokenize
+from retrieval import RRF_K, SEARCH_MODE_ENV, fuse_rankings, search_lexical, search_mode
+
+TEXTS = [
+    "Chargeback raised on a card payment was never refunded.",
+    "Supply chain finance invoices were paid late.",
+    "The chain of approvals for the supply order took weeks.",
+    "Chargeback chargeback: two chargebacks filed and both ignored.",
+    "Online banking was down during the supply chain payment run.",
+]
+
+
+@pytest.fixture(scope='module')
+def lexical_index():
+    return LexicalIndex.from_texts(TEXTS)
+
+
+@pytest.fixture(scope='module')
+def vector_store(lexical_index):
+    columns = {column: [''] * len(TEXTS) for column in DOCUMENT_COLUMNS}
+    columns[TEXT_COLUMN] = TEXTS
+    docstore = ColumnarDocstore.from_columns([str(i) for i in range(len(TEXTS))], columns)
+    return SimpleNamespace(lexical_index=lexical_index, docstore=docstore)
+
+
+def bm25(term, position):
+    documents = [tokenize(text) for text in TEXTS]
+    matches = sum(term in document for document in documents)
+    idf = math.log(1 + (len(documents) - matches + 0.5) / (matches + 0.5))
+    frequency = documents[position].count(term)
+    average_length = sum(map(len, documents)) / len(documents)
+    length = len(documents[position]) / average_length
+    return idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length))
+
+
+def test_bm25_scores(lexical_index):
+    positions, scores = lexical_index.search(['chargeback'])
+    np.testing.assert_array_equal(positions, [3, 0])
+    np.testing.assert_allclose(scores, [bm25('chargeback', 3), bm25('chargeback', 0)], rtol=1e-5)
+
+
+def test_bm25_sums_terms_and_applies_ids(lexical_index):
+    positions, scores = lexical_index.search(['supply', 'chain'], ids=np.array([1, 2, 3]), k=None)
+    np.testing.assert_array_equal(sorted(positions), [1, 2])
+    expected = {position: bm25('supply', position) + bm25('chain', position) for position in (1, 2)}
+    np.testing.assert_allclose(scores, [expected[position] for position in positions], rtol=1e-5)
+
+
+def test_search_k(lexical_index):
+    positions, _ = lexical_index.search(['supply', 'chain', 'chargeback'], k=2)
+    assert len(positions) == 2
+
+
+def test_phrase_filter(vector_store):
+    # Texts 1 and 4 have "supply chain"; text 2 has both words but not as a phrase
+    positions, scores = search_lexical(vector_store, 'invoices "supply chain"', k=10)
+    np.testing.assert_array_equal(positions, [1, 4])
+    assert scores[0] > scores[1]
+
+
+def test_phrase_with_unknown_term(vector_store):
+    positions, _ = search_lexical(vector_store, '"supply swift"', k=10)
+    assert len(positions) == 0
+
+
+def test_fuse_rankings():
+    positions, scores = fuse_rankings([[3, 1, 2], [1, 4]], k=3)
+    np.testing.assert_array_equal(positions, [1, 3, 4])
+    np.testing.assert_allclose(scores, [1 / (RRF_K + 2) + 1 / (RRF_K + 1), 1 / (RRF_K + 1), 1 / (RRF_K + 2)],
+                               rtol=1e-6)
+
+
+def test_fuse_empty_rankings():
+    positions, scores = fuse_rankings([[], []], k=5)
+    assert len(positions) == 0 and len(scores) == 0
+
+
+def test_search_mode(monkeypatch):
+    monkeypatch.delenv(SEARCH_MODE_ENV, raising=False)
+    assert search_mode("late payments") == 'vector'
+    assert search_mode('complaints about "supply chain"') == 'lexical'
+    assert search_mode("late payments", 'hybrid') == 'hybrid'
+    monkeypatch.setenv(SEARCH_MODE_ENV, 'hybrid')
+    assert search_mode("late payments") == 'hybrid'
+    with pytest.raises(ValueError):
+        search_mode("late payments", 'semantic')
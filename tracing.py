@@ -0,0 +1,187 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+# Set to a file path to write every finished span there as one JSON line
+TRACE_FILE_ENV = 'COMPLAINTS_TRACE_FILE'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Histogram:
+    """
+    Keeps the most recent samples of a metric and reports count, mean and percentiles.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        with self._lock:
+            self.samples.append(value)
+            self.count += 1
+            self.total += value
+
+    def summary(self):
+        with self._lock:
+            values = np.fromiter(self.samples, dtype=np.float64, count=len(self.samples))
+            count, total = self.count, self.total
+        if not len(values):
+            return {'count': count}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {'count': count, 'mean': total / count, 'p50': float(p50), 'p95': float(p95),
+                'p99': float(p99), 'max': float(values.max())}
+
+
+class Span:
+    """
+    One timed stage of a request. Numeric attributes are also recorded as histograms.
+    """
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes)
+        self.span_id = uuid.uuid4().hex[:16]
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.start_time = None
+        self.duration_ms = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def record_usage(self, response):
+        """
+        Copies the token usage and latency that Bedrock returns with converse (or with the
+        metadata event of converse_stream) onto the span.
+        """
+        usage = response.get('usage', {})
+        self.set(
+            input_tokens=self.attributes.get('input_tokens', 0) + usage.get('inputTokens', 0),
+            output_tokens=self.attributes.get('output_tokens', 0) + usage.get('outputTokens', 0),
+        )
+        if 'latencyMs' in response.get('metrics', {}):
+            self.set(bedrock_latency_ms=response['metrics']['latencyMs'])
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = self.elapsed_ms()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.set(error=repr(exc))
+        self.tracer.finish(self)
+        return False
+
+
+class Tracer:
+    """
+    Records spans for the pipeline stages: durations and numeric attributes (result counts,
+    token usage, Bedrock latency) go into in-process histograms named '<span>.<attribute>',
+    and finished spans are optionally written to a JSON-lines file.
+    """
+
+    def __init__(self, export_path=None):
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._export_file = None
+        self.set_exporter(export_path)
+
+    def set_exporter(self, export_path):
+        """
+        Writes finished spans to export_path (JSON lines), or stops exporting if None.
+        """
+        with self._lock:
+            if self._export_file is not None:
+                self._export_file.close()
+            self._export_file = open(export_path, 'a') if export_path else None
+
+    def span(self, name, **attributes):
+        return Span(self, name, attributes)
+
+    def annotate(self, **attributes):
+        """
+        Sets attributes on the current span, if there is one. For code that runs inside
+        another stage's span and does not time itself, e.g. MetadataIndex.resolve.
+        """
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def propagate(self, function):
+        """
+        Wraps function so spans it opens in a worker thread are children of the span that
+        is current here (threads do not inherit the caller's context).
+        """
+        parent = _current_span.get()
+
+        def wrapper(*args, **kwargs):
+            token = _current_span.set(parent)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _current_span.reset(token)
+        return wrapper
+
+    def histogram(self, name):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+
+    def finish(self, span):
+        self.histogram(f'{span.name}.duration_ms').record(span.duration_ms)
+        for key, value in span.attributes.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.histogram(f'{span.name}.{key}').record(value)
+        if self._export_file is not None:
+            record = {
+                'trace_id': span.trace_id,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'name': span.name,
+                'start_time': span.start_time,
+                'duration_ms': span.duration_ms,
+                'thread': threading.current_thread().name,
+                'attributes': span.attributes,
+            }
+            line = json.dumps(record, default=str)
+            with self._lock:
+                if self._export_file is not None:
+                    self._export_file.write(line + '\n')
+                    self._export_file.flush()
+
+    def metrics(self):
+        """
+        Returns:
+        dict: Histogram name -> summary (count, mean, p50, p95, p99, max).
+        """
+        with self._lock:
+            histograms = dict(self.histograms)
+        return {name: histogram.summary() for name, histogram in sorted(histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+
+# Process-wide tracer used by the pipeline modules
+tracer = Tracer(os.environ.get(TRACE_FILE_ENV))